@@ -0,0 +1,111 @@
+#   'Silent net' compression benchmark
+#
+#       Compares per message zlib (old behaviour) with persistent
+#       Compression streams and every available codec on manager traffic
+#       Reports compression ratio, cpu time per message and throughput
+#
+#   Omer Kfir (C)
+
+import os
+import sys
+import zlib
+from time import process_time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../shared')))
+from protocol import MessageParser
+from compression import CompressionHandler, available_codecs, CODEC_NONE
+from traffic import manager_traffic
+
+__author__ = "Omer Kfir"
+
+ROUNDS = 20
+
+
+class OneShotZlib:
+    """
+        Per message zlib, as used before persistent streams
+    """
+
+    def compress(self, data):
+        return zlib.compress(data), True
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+
+def run_case(name : str, make_handlers, messages : list[bytes]) -> dict:
+    """
+        Compresses and decompresses every message with a fresh pair of handlers per round
+
+        INPUT: name, make_handlers, messages
+        OUTPUT: Dictionary of results
+
+        @name -> Name of the case
+        @make_handlers -> Callable returning (sending side, receiving side)
+        @messages -> Constructed protocol messages
+    """
+
+    raw_len = sum(len(msg) for msg in messages) * ROUNDS
+    sent_len = 0
+    compress_time = decompress_time = 0.0
+
+    for _ in range(ROUNDS):
+        sender, receiver = make_handlers()
+
+        for msg in messages:
+            start = process_time()
+            data, compressed = sender.compress(msg)
+            compress_time += process_time() - start
+
+            sent_len += len(data)
+
+            start = process_time()
+            out = receiver.decompress(data) if compressed else data
+            decompress_time += process_time() - start
+
+            assert out == msg
+
+    amount = len(messages) * ROUNDS
+    return {
+        "case": name,
+        "ratio": sent_len / raw_len,
+        "compress_usec": compress_time / amount * 1e6,
+        "decompress_usec": decompress_time / amount * 1e6,
+        "compress_mb_s": raw_len / max(compress_time, 1e-9) / 1e6,
+        "decompress_mb_s": raw_len / max(decompress_time, 1e-9) / 1e6,
+    }
+
+
+def main():
+    messages = [MessageParser.protocol_message_construct(*msg) for msg in manager_traffic()]
+    zdict = MessageParser.compression_dictionary()
+
+    cases = [
+        ("zlib per message", lambda: (OneShotZlib(), OneShotZlib())),
+        ("stream", lambda: (CompressionHandler(), CompressionHandler())),
+        ("stream + dictionary", lambda: (CompressionHandler(zdict=zdict), CompressionHandler(zdict=zdict))),
+        ("stream, no threshold", lambda: (CompressionHandler(zdict=zdict, threshold=0), CompressionHandler(zdict=zdict, threshold=0))),
+    ]
+
+    small = [msg for msg in messages if len(msg) < 64]
+    print(f"{len(messages)} messages, {len(small)} shorter than 64 bytes, "
+          f"{sum(len(msg) for msg in messages)} bytes per round\n")
+
+    print(f"{'case':>30} {'ratio':>7} {'compress us':>12} {'decompress us':>14}")
+    for name, make_handlers in cases:
+        for group, msgs in (("all", messages), ("small", small)):
+            result = run_case(name, make_handlers, msgs)
+            print(f"{name + ' (' + group + ')':>30} {result['ratio']:>7.3f} "
+                  f"{result['compress_usec']:>12.1f} {result['decompress_usec']:>14.1f}")
+
+    # Negotiable codecs on the same payloads, every message compressed
+    print(f"\n{'codec':>30} {'ratio':>7} {'compress MB/s':>14} {'decompress MB/s':>16}")
+    for codec in available_codecs() + [CODEC_NONE]:
+        make_handlers = lambda: (CompressionHandler(codec, zdict=zdict, threshold=0), CompressionHandler(codec, zdict=zdict, threshold=0))
+        result = run_case(codec, make_handlers, messages)
+        print(f"{codec:>30} {result['ratio']:>7.3f} "
+              f"{result['compress_mb_s']:>14.1f} {result['decompress_mb_s']:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
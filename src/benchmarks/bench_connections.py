@@ -0,0 +1,227 @@
+#   'Silent net' connection cost benchmark
+#
+#       Connects many agents to the threaded server and to the asyncio
+#       Server, lets them send synthetic traffic and reports the memory each
+#       Connected agent costs, split by the source file which allocated it
+#       Agents run in a child process so only the server is measured
+#
+#   Omer Kfir (C)
+
+import os
+import gc
+import sys
+import json
+import argparse
+import tempfile
+import threading
+import tracemalloc
+import multiprocessing
+from time import perf_counter, sleep
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../shared')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../server')))
+from protocol import MessageParser, TCPsocket, client, server
+from server import SilentNetServer, UserId
+from async_server import AsyncSilentNetServer
+from traffic import agent_traffic
+
+__author__ = "Omer Kfir"
+
+CONNECTIONS = (100, 1000)
+MESSAGES = 200 # Messages every agent sends
+CONNECT_TIMEOUT = 60
+DRAIN_TIMEOUT = 120
+TOP_FILES = 8
+
+
+def run_agents(port : int, amount : int, messages : int, mix : str, conn) -> None:
+    """
+        Connects 'amount' agents, sends their traffic and keeps them open until told to stop
+
+        INPUT: port, amount, messages, mix, conn
+        OUTPUT: None
+
+        @port -> Server port
+        @amount -> Amount of agents
+        @messages -> Amount of messages every agent sends
+        @mix -> Traffic mix of the agents
+        @conn -> Pipe to the benchmark process
+    """
+
+    agents = []
+    for i in range(amount):
+        agent = client()
+        agent.connect("127.0.0.1", port)
+        agent.protocol_send(MessageParser.CLIENT_MSG_AUTH, f"02:00:00:00:{i // 256:02x}:{i % 256:02x}", f"bench-pc{i}",
+                            encrypt=False, compress=False)
+        agents.append(agent)
+
+    for i, agent in enumerate(agents):
+        for msg in agent_traffic(mix, messages, seed=i):
+            agent.protocol_send(*msg, encrypt=False, compress=False)
+
+    conn.send(True)
+    conn.recv()
+
+    for agent in agents:
+        agent.close()
+
+
+def rss_bytes() -> int:
+    """
+        Returns resident memory of this process (0 where /proc is not available)
+
+        INPUT: None
+        OUTPUT: Bytes
+    """
+
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+def wait_drained(silent_net, timeout : float) -> None:
+    """
+        Waits until the server ingested everything the agents sent
+
+        INPUT: silent_net, timeout
+        OUTPUT: None
+    """
+
+    start = perf_counter()
+    idle = 0
+
+    # Data may still wait in socket buffers, so the queue must stay empty for a while
+    while idle < 5 and perf_counter() - start < timeout:
+        idle = idle + 1 if not silent_net.ingest.depth() else 0
+        sleep(0.1)
+
+
+def memory_by_file(before : tracemalloc.Snapshot, after : tracemalloc.Snapshot, connected : int) -> list[tuple]:
+    """
+        Splits the memory which grew between two snapshots by the file which allocated it
+
+        INPUT: before, after, connected
+        OUTPUT: List of tuples of file name and bytes per agent, largest first
+
+        @before -> Snapshot taken before the agents connected
+        @after -> Snapshot taken once their traffic was ingested
+        @connected -> Amount of connected agents
+    """
+
+    files = {}
+    for stat in after.compare_to(before, "filename"):
+        name = os.path.basename(stat.traceback[0].filename)
+        files[name] = files.get(name, 0) + stat.size_diff
+
+    ordered = sorted(files.items(), key=lambda item: item[1], reverse=True)
+    return [(name, size / max(connected, 1)) for name, size in ordered[:TOP_FILES]]
+
+
+def bench_server(server_class, amount : int, messages : int, mix : str) -> dict:
+    """
+        Measures the memory 'amount' connected agents cost a server
+
+        INPUT: server_class, amount, messages, mix
+        OUTPUT: Dictionary of results
+
+        @server_class -> SilentNetServer or AsyncSilentNetServer
+        @amount -> Amount of agents
+        @messages -> Amount of messages every agent sends (0 for idle agents)
+        @mix -> Traffic mix of the agents
+    """
+
+    class BenchServer(server_class):
+        def _load_configuration(self):
+            self.max_clients = self.default_max_clients = amount
+
+        def _setup_keyboard_shortcuts(self):
+            pass
+
+    db_dir = tempfile.TemporaryDirectory()
+    UserId.DB_NAME = os.path.join(db_dir.name, "bench.db")
+    server.SERVER_BIND_PORT = TCPsocket.get_free_port()
+
+    silent_net = BenchServer()
+    server_thread = threading.Thread(target=silent_net.start)
+    server_thread.start()
+    sleep(1)
+
+    gc.collect()
+    tracemalloc.start()
+    traced_before, _ = tracemalloc.get_traced_memory()
+    snapshot_before = tracemalloc.take_snapshot()
+    rss_before = rss_bytes()
+
+    parent_conn, child_conn = multiprocessing.Pipe()
+    agents = multiprocessing.Process(target=run_agents, args=(server.SERVER_BIND_PORT, amount, messages, mix, child_conn))
+
+    start = perf_counter()
+    agents.start()
+    parent_conn.recv()
+
+    while silent_net.registry.agents() < amount and perf_counter() - start < CONNECT_TIMEOUT:
+        sleep(0.05)
+    connect_time = perf_counter() - start
+    wait_drained(silent_net, DRAIN_TIMEOUT)
+
+    connected = silent_net.registry.agents()
+    threads = threading.active_count()
+
+    gc.collect()
+    traced_after, _ = tracemalloc.get_traced_memory()
+    snapshot_after = tracemalloc.take_snapshot()
+    rss_after = rss_bytes()
+    tracemalloc.stop()
+
+    parent_conn.send(True)
+    agents.join()
+
+    silent_net.quit_server()
+    server_thread.join()
+    db_dir.cleanup()
+
+    return {
+        "server": server_class.__name__,
+        "connections": connected,
+        "messages": messages,
+        "connect_sec": connect_time,
+        "traced_bytes_per_conn": (traced_after - traced_before) / max(connected, 1),
+        "rss_bytes_per_conn": (rss_after - rss_before) / max(connected, 1),
+        "threads": threads,
+        "bytes_per_conn_by_file": memory_by_file(snapshot_before, snapshot_after, connected),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Silent net memory cost per connection")
+    parser.add_argument("--connections", type=int, action="append", help="Amount of agents (default: 100 and 1000)")
+    parser.add_argument("--messages", type=int, default=MESSAGES, help=f"Messages every agent sends, 0 for idle agents (default: {MESSAGES})")
+    parser.add_argument("--mix", default="balanced", help="Traffic mix of the agents (default: balanced)")
+    parser.add_argument("--json", metavar="PATH", help="Write results as json to PATH")
+    args = parser.parse_args()
+
+    results = []
+    for amount in args.connections or CONNECTIONS:
+        for server_class in (SilentNetServer, AsyncSilentNetServer):
+            results.append(bench_server(server_class, amount, args.messages, args.mix))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    print(f"\n{'server':>22} {'connections':>12} {'messages':>9} {'connect s':>10} {'traced B/conn':>14} {'rss B/conn':>11}")
+    for entry in results:
+        print(f"{entry['server']:>22} {entry['connections']:>12} {entry['messages']:>9} {entry['connect_sec']:>10.2f} "
+              f"{entry['traced_bytes_per_conn']:>14.0f} {entry['rss_bytes_per_conn']:>11.0f}")
+
+    for entry in results:
+        print(f"\n{entry['server']} with {entry['connections']} agents, traced bytes per agent by file:")
+        for name, size in entry["bytes_per_conn_by_file"]:
+            print(f"{name:>30} {size:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
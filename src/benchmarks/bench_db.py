@@ -0,0 +1,382 @@
+#   'Silent net' database write benchmark
+#
+#       Writes agent logs the way they were written before transactions
+#       (A commit for every statement), with a select and an update for
+#       Every counted log in batches, and in batches with counts added up
+#       In memory like the ingest writer. Reports logs per second in both storage modes
+#       Then compares cpu usage kept as one growing blob per client with
+#       The samples table, writing and reading as history grows
+#       And reads inactive times kept as one string per client against
+#       The periods table and its running totals
+#
+#   Omer Kfir (C)
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+from random import Random
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+from time import perf_counter
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../shared')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../server')))
+from protocol import MessageParser
+from DB import DBHandler, LogsWriterORM, UserLogsORM, COUNTED_TYPES, INACTIVE_PERIODS_NAME, ACTIVITY_NAME
+from ingest import BATCH_MAX_LOGS
+from traffic import agent_logs
+
+__author__ = "Omer Kfir"
+
+LOGS = 2000
+CLIENTS = 5
+
+CPU_HISTORY = (1000, 10000) # Samples already written by a client
+CPU_CORES = 4
+CPU_INTERVAL = 5 # seconds between samples
+
+INACTIVE_HISTORY = (100, 1000) # Inactive periods of a client
+READS = 200
+
+
+class SelectUpdateLogs (LogsWriterORM):
+    """
+        Counts every log with a select and an update or insert, as before counts were added up in memory
+    """
+
+    def insert_data(self, id : int, data_type : str, data) -> None:
+        if data_type not in COUNTED_TYPES:
+            super().insert_data(id, data_type, data)
+            return
+
+        with self.transaction():
+            count = self.commit(f"SELECT count FROM {self.table_name} WHERE id = ? AND type = ? AND data = ?;", id, data_type, data)
+            if count:
+                self.commit(f"UPDATE {self.table_name} SET count = ? WHERE id = ? AND type = ? AND data = ?;", count[0][0] + 1, id, data_type, data)
+            else:
+                self.commit(f"INSERT INTO {self.table_name} (id, type, data) VALUES (?,?,?);", id, data_type, data)
+
+            if data_type == MessageParser.CLIENT_INPUT_EVENT:
+                self._UserLogsORM__update_last_input(id)
+
+
+class PerStatementLogs (SelectUpdateLogs):
+    """
+        Commits every statement on its own, as before transactions were used
+    """
+
+    def transaction(self):
+        return nullcontext()
+
+    def commit_many(self, command : str, rows) -> None:
+        for row in rows:
+            self.commit(command, *row)
+
+
+class BlobCpuLogs (LogsWriterORM):
+    """
+        Keeps cpu usage as one blob per client which every sample is appended to, as before the samples table
+    """
+
+    def client_setup_db(self, id : int) -> None:
+        super().client_setup_db(id)
+        self.commit(f"INSERT INTO {self.table_name} (id, type, data) VALUES (?,?,'');", id, MessageParser.CLIENT_CPU_USAGE)
+
+    def insert_data(self, id : int, data_type : str, data) -> None:
+        if data_type != MessageParser.CLIENT_CPU_USAGE:
+            super().insert_data(id, data_type, data)
+            return
+
+        command = f"SELECT data FROM {self.table_name} WHERE id = ? AND type = ?;"
+        cpu_logs = self.commit(command, id, data_type)[0][0]
+        if isinstance(cpu_logs, str):
+            cpu_logs = cpu_logs.encode()
+
+        command = f"UPDATE {self.table_name} SET data = ? WHERE id = ? AND type = ?;"
+        self.commit(command, cpu_logs + data + b"|", id, data_type)
+
+    def get_cpu_usage(self, id : int):
+        command = f"SELECT data FROM {self.table_name} WHERE id = ? AND type = ?;"
+        cores_logs = self.commit(command, id, MessageParser.CLIENT_CPU_USAGE)[0][0]
+
+        logs = [log for i in cores_logs.split(b"|") if len(i) > 1 for log in i.split(MessageParser.PROTOCOL_SEPARATOR)]
+        core_usage, times = {}, []
+        for log in logs:
+            log = log.decode().split(",")
+            core_usage.setdefault(log[0], []).append(int(log[1]))
+            if len(log) == 3:
+                times.append(log[2])
+
+        return core_usage, times
+
+    def get_cpu_samples(self, id : int, start : str = None, end : str = None):
+        # The blob can not be read by time, the whole history is parsed
+        core_usage, times = self.get_cpu_usage(id)
+        window = [index for index, sample_time in enumerate(times)
+                  if (start is None or sample_time >= start) and (end is None or sample_time < end)]
+
+        return [times[index] for index in window], {core: [usage[index] for index in window] for core, usage in core_usage.items()}
+
+
+class StringInactiveLogs (LogsWriterORM):
+    """
+        Keeps inactive times as one string per client which is parsed on every read, as before the periods table
+    """
+
+    def write_periods(self, id : int, periods : list[tuple[str, int]]) -> None:
+        data = "".join(f"{start},{duration}~" for start, duration in periods)
+        self.commit(f"INSERT INTO {self.table_name} (id, type, data) VALUES (?,?,?);", id, MessageParser.CLIENT_INACTIVE_EVENT, data)
+
+    def get_inactive_times(self, id : int):
+        command = f"SELECT data FROM {self.table_name} WHERE type = ? AND id = ?;"
+        dates = self.commit(command, MessageParser.CLIENT_INACTIVE_EVENT, id)[0][0]
+        return [i.split(",") for i in dates.split("~")]
+
+    def get_active_precentage(self, id : int) -> int:
+        total_inactive = sum(int(i[1]) for i in self.get_inactive_times(id) if len(i) > 1)
+
+        command = f"SELECT data FROM {self.table_name} WHERE id = ? AND type = ?;"
+        first_input = datetime.strptime(self.commit(command, id, MessageParser.CLIENT_FIRST_INPUT_EVENT)[0][0], "%Y-%m-%d %H:%M:%S")
+        last_input = datetime.strptime(self.commit(command, id, MessageParser.CLIENT_LAST_INPUT_EVENT)[0][0], "%Y-%m-%d %H:%M:%S")
+        total_active = (last_input - first_input).total_seconds() // 60
+
+        return int((total_active / max(total_active + total_inactive, 1)) * 100)
+
+
+class PeriodsInactiveLogs (LogsWriterORM):
+    """
+        Inactive periods table, written directly as ingest would have
+    """
+
+    def write_periods(self, id : int, periods : list[tuple[str, int]]) -> None:
+        self.commit_many(f"INSERT INTO {INACTIVE_PERIODS_NAME} (id, start, duration) VALUES ({id},?,?);", periods)
+        self.commit(f"UPDATE {ACTIVITY_NAME} SET inactive = ? WHERE id = ?;", sum(period[1] for period in periods) * 60, id)
+
+
+def cpu_samples(amount : int, seed : int = 0) -> list[bytes]:
+    """
+        Builds cpu usage logs of consecutive samples
+
+        INPUT: amount, seed
+        OUTPUT: List of logs as the ingest writer receives them
+    """
+
+    rnd = Random(seed)
+    start = datetime(2025, 4, 10, 8)
+
+    samples = []
+    for index in range(amount):
+        sample_time = (start + timedelta(seconds=index * CPU_INTERVAL)).strftime("%Y-%m-%d %H:%M:%S")
+        usage = [f"{core},{rnd.randint(0, 100)}".encode() for core in range(CPU_CORES)]
+        samples.append(MessageParser.PROTOCOL_SEPARATOR.join(usage) + f",{sample_time}".encode())
+
+    return samples
+
+
+def write_per_log(logs_db, logs : list[tuple]) -> None:
+    """ Writes the logs one by one, spread over the clients """
+
+    for index, (data_type, data) in enumerate(logs):
+        logs_db.insert_data(index % CLIENTS, data_type, data)
+
+    logs_db.flush_counters(force=True)
+
+
+def write_batches(logs_db, logs : list[tuple], clients : int = CLIENTS) -> None:
+    """ Writes the logs in transactions of the ingest writer's batch size """
+
+    for start in range(0, len(logs), BATCH_MAX_LOGS):
+        with logs_db.transaction():
+            for index, (data_type, data) in enumerate(logs[start:start + BATCH_MAX_LOGS], start):
+                logs_db.insert_data(index % clients, data_type, data)
+
+            logs_db.flush_counters()
+
+    with logs_db.transaction():
+        logs_db.flush_counters(force=True)
+
+
+def run_case(name : str, orm_class, write, logs : list[tuple], wal : bool) -> dict:
+    """
+        Writes every log to a fresh database
+
+        INPUT: name, orm_class, write, logs, wal
+        OUTPUT: Dictionary of results
+
+        @name -> Name of the case
+        @orm_class -> Logs ORM to write with
+        @write -> Callable writing the logs with the ORM
+        @logs -> List of tuples of data type and data
+        @wal -> Storage mode of the database
+    """
+
+    DBHandler.WAL = wal
+
+    with tempfile.TemporaryDirectory() as db_dir:
+        conn, cursor = DBHandler.connect_DB(os.path.join(db_dir, "bench.db"))
+        logs_db = orm_class(conn, cursor, UserLogsORM.USER_LOGS_NAME)
+
+        start = perf_counter()
+        for id in range(CLIENTS):
+            logs_db.client_setup_db(id)
+        setup_time = perf_counter() - start
+
+        start = perf_counter()
+        write(logs_db, logs)
+        write_time = perf_counter() - start
+
+        DBHandler.close_DB(cursor, conn)
+
+    return {
+        "case": name,
+        "storage": "wal" if wal else "rollback",
+        "logs": len(logs),
+        "logs_per_sec": len(logs) / write_time,
+        "setup_ms": setup_time / CLIENTS * 1000,
+    }
+
+
+def run_cpu_case(name : str, orm_class, history : int) -> dict:
+    """
+        Writes a client's cpu usage history, then times one more batch and the dashboard reads
+
+        INPUT: name, orm_class, history
+        OUTPUT: Dictionary of results
+
+        @name -> Name of the case
+        @orm_class -> Logs ORM to write with
+        @history -> Amount of samples written before the timed batch
+    """
+
+    DBHandler.WAL = True
+    samples = cpu_samples(history + BATCH_MAX_LOGS)
+    last_hour = samples[-1].rsplit(b",", 1)[1].decode()
+    last_hour = (datetime.strptime(last_hour, "%Y-%m-%d %H:%M:%S") - timedelta(hours=1)).strftime("%Y-%m-%d %H:%M:%S")
+
+    with tempfile.TemporaryDirectory() as db_dir:
+        conn, cursor = DBHandler.connect_DB(os.path.join(db_dir, "bench.db"))
+        logs_db = orm_class(conn, cursor, UserLogsORM.USER_LOGS_NAME)
+        logs_db.client_setup_db(0)
+
+        logs = [(MessageParser.CLIENT_CPU_USAGE, sample) for sample in samples]
+        write_batches(logs_db, logs[:history], clients=1)
+
+        start = perf_counter()
+        write_batches(logs_db, logs[history:], clients=1)
+        write_time = perf_counter() - start
+
+        start = perf_counter()
+        logs_db.get_cpu_usage(0)
+        read_time = perf_counter() - start
+
+        start = perf_counter()
+        logs_db.get_cpu_samples(0, last_hour)
+        window_time = perf_counter() - start
+
+        DBHandler.close_DB(cursor, conn)
+
+    return {
+        "case": name,
+        "history": history,
+        "write_usec_per_sample": write_time / BATCH_MAX_LOGS * 1e6,
+        "read_all_ms": read_time * 1000,
+        "read_last_hour_ms": window_time * 1000,
+    }
+
+
+def run_inactive_case(name : str, orm_class, history : int) -> dict:
+    """
+        Times the dashboard reads of a client's inactive times
+
+        INPUT: name, orm_class, history
+        OUTPUT: Dictionary of results
+
+        @name -> Name of the case
+        @orm_class -> Logs ORM with write_periods
+        @history -> Amount of inactive periods of the client
+    """
+
+    DBHandler.WAL = True
+    start = datetime(2025, 4, 10, 8)
+    periods = [((start + timedelta(minutes=index * 30)).strftime("%Y-%m-%d %H:%M:%S"), 6 + index % 20) for index in range(history)]
+
+    with tempfile.TemporaryDirectory() as db_dir:
+        conn, cursor = DBHandler.connect_DB(os.path.join(db_dir, "bench.db"))
+        logs_db = orm_class(conn, cursor, UserLogsORM.USER_LOGS_NAME)
+        logs_db.client_setup_db(0)
+        with logs_db.transaction():
+            logs_db.write_periods(0, periods)
+
+        start = perf_counter()
+        for _ in range(READS):
+            logs_db.get_active_precentage(0)
+        percentage_time = (perf_counter() - start) / READS
+
+        start = perf_counter()
+        for _ in range(READS):
+            logs_db.get_inactive_times(0)
+        times_time = (perf_counter() - start) / READS
+
+        DBHandler.close_DB(cursor, conn)
+
+    return {
+        "case": name,
+        "periods": history,
+        "active_percentage_usec": percentage_time * 1e6,
+        "inactive_times_usec": times_time * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Silent net database write throughput")
+    parser.add_argument("--logs", type=int, default=LOGS, help=f"Amount of logs written per case (default: {LOGS})")
+    parser.add_argument("--mix", default="balanced", help="Traffic mix of the logs (default: balanced)")
+    parser.add_argument("--json", metavar="PATH", help="Write results as json to PATH")
+    args = parser.parse_args()
+
+    logs = agent_logs(args.mix, args.logs)
+    cases = [
+        ("commit per statement", PerStatementLogs, write_per_log),
+        ("select + update batch", SelectUpdateLogs, write_batches),
+        ("counted batch", LogsWriterORM, write_batches),
+    ]
+
+    results = []
+    for wal in (False, True):
+        for name, orm_class, write in cases:
+            results.append(run_case(name, orm_class, write, logs, wal))
+
+    cpu_results = []
+    for history in CPU_HISTORY:
+        for name, orm_class in (("cpu blob", BlobCpuLogs), ("cpu samples table", LogsWriterORM)):
+            cpu_results.append(run_cpu_case(name, orm_class, history))
+
+    inactive_results = []
+    for history in INACTIVE_HISTORY:
+        for name, orm_class in (("inactive string", StringInactiveLogs), ("inactive periods table", PeriodsInactiveLogs)):
+            inactive_results.append(run_inactive_case(name, orm_class, history))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"logs": results, "cpu": cpu_results, "inactive": inactive_results}, f, indent=2)
+
+    print(f"\n{'case':>22} {'storage':>9} {'logs':>7} {'logs/s':>10} {'setup ms':>9}")
+    for entry in results:
+        print(f"{entry['case']:>22} {entry['storage']:>9} {entry['logs']:>7} "
+              f"{entry['logs_per_sec']:>10.0f} {entry['setup_ms']:>9.2f}")
+
+    print(f"\n{'case':>22} {'history':>8} {'write us/sample':>16} {'read all ms':>12} {'read hour ms':>13}")
+    for entry in cpu_results:
+        print(f"{entry['case']:>22} {entry['history']:>8} {entry['write_usec_per_sample']:>16.1f} "
+              f"{entry['read_all_ms']:>12.2f} {entry['read_last_hour_ms']:>13.2f}")
+
+    print(f"\n{'case':>22} {'periods':>8} {'active % us':>12} {'inactive times us':>18}")
+    for entry in inactive_results:
+        print(f"{entry['case']:>22} {entry['periods']:>8} {entry['active_percentage_usec']:>12.1f} "
+              f"{entry['inactive_times_usec']:>18.1f}")
+
+
+if __name__ == "__main__":
+    main()
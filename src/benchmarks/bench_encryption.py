@@ -0,0 +1,67 @@
+#   'Silent net' encryption benchmark
+#
+#       Compares AES-CBC (random iv and padding per message)
+#       With AES-GCM (counter nonces, cached key schedule)
+#       Reports time per message for encryption and decryption
+#
+#   Omer Kfir (C)
+
+import os
+import sys
+from time import perf_counter
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../shared')))
+from encryption import EncryptionHandler, CIPHER_PREFERENCE
+
+__author__ = "Omer Kfir"
+
+MESSAGES_AMOUNT = 5000
+MESSAGE_SIZES = (16, 256, 4096, 65536)
+
+
+def run_case(cipher : str, size : int) -> dict:
+    """
+        Encrypts and decrypts MESSAGES_AMOUNT messages of 'size' bytes
+
+        INPUT: cipher, size
+        OUTPUT: Dictionary of results
+
+        @cipher -> Cipher name
+        @size -> Message size
+    """
+
+    key = os.urandom(32)
+    sender = EncryptionHandler.create_aes_handler(key, cipher, True)
+    receiver = EncryptionHandler.create_aes_handler(key, cipher, False)
+
+    payload = os.urandom(size)
+
+    start = perf_counter()
+    encrypted = [sender.encrypt(payload) for _ in range(MESSAGES_AMOUNT)]
+    encrypt_time = perf_counter() - start
+
+    start = perf_counter()
+    for data in encrypted:
+        receiver.decrypt(data)
+    decrypt_time = perf_counter() - start
+
+    return {
+        "cipher": cipher,
+        "size": size,
+        "encrypt_usec": encrypt_time / MESSAGES_AMOUNT * 1e6,
+        "decrypt_usec": decrypt_time / MESSAGES_AMOUNT * 1e6,
+        "overhead_bytes": len(encrypted[0]) - size,
+    }
+
+
+def main():
+    print(f"{'cipher':>8} {'size':>6} {'encrypt us':>11} {'decrypt us':>11} {'overhead B':>11}")
+    for size in MESSAGE_SIZES:
+        for cipher in reversed(CIPHER_PREFERENCE):
+            result = run_case(cipher, size)
+            print(f"{result['cipher']:>8} {result['size']:>6} "
+                  f"{result['encrypt_usec']:>11.2f} {result['decrypt_usec']:>11.2f} {result['overhead_bytes']:>11}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+#   'Silent net' protocol micro benchmarks
+#
+#       Measures every step of the shared protocol layer on its own
+#       (encode, decode, compress, encrypt) and full round trips
+#       Over a loopback socket pair, using agent traffic mixes
+#       Results can be written as json to track regressions between releases
+#
+#   Omer Kfir (C)
+
+import os
+import sys
+import json
+import zlib
+import platform
+import argparse
+import threading
+from datetime import datetime
+from time import perf_counter
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../shared')))
+from protocol import MessageParser, TCPsocket, client
+from encryption import EncryptionHandler, CIPHER_PREFERENCE
+from compression import CompressionHandler, available_codecs, choose_codec
+from traffic import AGENT_MIXES, agent_traffic, manager_traffic
+from bench_recv import connected_pair
+
+__author__ = "Omer Kfir"
+
+MESSAGES_AMOUNT = 5000
+ROUND_TRIPS_AMOUNT = 2000
+REPEATS = 3
+
+
+def concat_construct(msg_type, *args) -> bytes:
+    """
+        Message construction with repeated concatenation, as it was before join, kept for comparison
+
+        INPUT: msg_type, *args
+        OUTPUT: Byte stream
+    """
+
+    msg_buf = MessageParser.encode_str(msg_type)
+    for argument in args:
+        msg_buf += MessageParser.PROTOCOL_SEPARATOR + MessageParser.encode_str(argument)
+
+    return msg_buf
+
+
+def best_time(func) -> float:
+    """
+        Runs func REPEATS times and returns the fastest run, in seconds
+
+        INPUT: func
+        OUTPUT: Seconds
+    """
+
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = perf_counter()
+        func()
+        best = min(best, perf_counter() - start)
+
+    return best
+
+
+def result(mix : str, stage : str, case : str, seconds : float, amount : int, size : int, **extra) -> dict:
+    """
+        Builds a single result entry
+
+        INPUT: mix, stage, case, seconds, amount, size, **extra
+        OUTPUT: Dictionary of results
+
+        @seconds -> Time all messages took
+        @amount -> Amount of messages
+        @size -> Bytes processed
+    """
+
+    return {
+        "mix": mix,
+        "stage": stage,
+        "case": case,
+        "usec_per_msg": seconds / amount * 1e6,
+        "mb_s": size / max(seconds, 1e-9) / 1e6,
+        **extra,
+    }
+
+
+def bench_encode(mix : str, messages : list[tuple]) -> list[dict]:
+    """ Message construction, current and old way """
+
+    encoded = [MessageParser.protocol_message_construct(*msg) for msg in messages]
+    size = sum(len(msg) for msg in encoded)
+
+    return [
+        result(mix, "encode", "join", best_time(lambda: [MessageParser.protocol_message_construct(*msg) for msg in messages]),
+               len(messages), size),
+        result(mix, "encode", "concat", best_time(lambda: [concat_construct(*msg) for msg in messages]),
+               len(messages), size),
+    ]
+
+
+def bench_decode(mix : str, encoded : list[bytes]) -> list[dict]:
+    """ Splitting messages into fields, fully and type only """
+
+    size = sum(len(msg) for msg in encoded)
+
+    return [
+        result(mix, "decode", "split", best_time(lambda: [MessageParser.protocol_message_deconstruct(msg) for msg in encoded]),
+               len(encoded), size),
+        result(mix, "decode", "split type", best_time(lambda: [MessageParser.protocol_message_deconstruct(msg, 1) for msg in encoded]),
+               len(encoded), size),
+    ]
+
+
+def bench_compress(mix : str, encoded : list[bytes]) -> list[dict]:
+    """
+        Per message zlib (legacy framing) and the negotiable codecs (v2 framing)
+        Codecs compress every message, agent messages are all under the threshold a connection skips compression below
+    """
+
+    size = sum(len(msg) for msg in encoded)
+    zdict = MessageParser.compression_dictionary()
+    results = []
+
+    compressed = [zlib.compress(msg) for msg in encoded]
+    results.append(result(mix, "compress", "zlib per message", best_time(lambda: [zlib.compress(msg) for msg in encoded]),
+                          len(encoded), size, ratio=sum(len(msg) for msg in compressed) / size))
+    results.append(result(mix, "decompress", "zlib per message", best_time(lambda: [zlib.decompress(msg) for msg in compressed]),
+                          len(encoded), size))
+
+    for codec in available_codecs():
+        # Streams carry state between messages, every repeat gets a fresh pair
+        sent = []
+
+        def compress():
+            sender = CompressionHandler(codec, zdict=zdict, threshold=0)
+            sent[:] = [sender.compress(msg) for msg in encoded]
+
+        def decompress():
+            receiver = CompressionHandler(codec, zdict=zdict, threshold=0)
+            [receiver.decompress(data) if was_compressed else data for data, was_compressed in sent]
+
+        results.append(result(mix, "compress", codec, best_time(compress), len(encoded), size,
+                              ratio=sum(len(data) for data, _ in sent) / size))
+        results.append(result(mix, "decompress", codec, best_time(decompress), len(encoded), size))
+
+    return results
+
+
+def bench_encrypt(mix : str, encoded : list[bytes]) -> list[dict]:
+    """ Every cipher, encryption and decryption """
+
+    size = sum(len(msg) for msg in encoded)
+    key = os.urandom(32)
+    results = []
+
+    for cipher in CIPHER_PREFERENCE:
+        sent = []
+
+        def encrypt():
+            sender = EncryptionHandler.create_aes_handler(key, cipher, True)
+            sent[:] = [sender.encrypt(msg) for msg in encoded]
+
+        def decrypt():
+            receiver = EncryptionHandler.create_aes_handler(key, cipher, False)
+            [receiver.decrypt(data) for data in sent]
+
+        results.append(result(mix, "encrypt", cipher, best_time(encrypt), len(encoded), size,
+                              overhead_bytes=(sum(len(data) for data in sent) - size) / len(encoded)))
+        results.append(result(mix, "decrypt", cipher, best_time(decrypt), len(encoded), size))
+
+    return results
+
+
+def connected_clients(framing : int, cipher : str = None, codec : str = None) -> tuple[client, client]:
+    """
+        Creates a connected pair of protocol clients with an agreed session, without a key exchange
+
+        INPUT: framing, cipher, codec
+        OUTPUT: Tuple of (initiating side, responding side)
+
+        @framing -> Frame format of both sides
+        @cipher -> Cipher of the session (None for plain text)
+        @codec -> Compression codec (None for legacy compression)
+    """
+
+    sender, receiver = connected_pair()
+    sides = (client(sender), client(receiver))
+
+    session = {"secret": os.urandom(32), "cipher": cipher or CIPHER_PREFERENCE[-1], "codec": codec, "framing": framing}
+    salt = os.urandom(32)
+    for initiator, side in zip((True, False), sides):
+        side.restore_session(session, salt, initiator)
+
+    return sides
+
+
+def bench_round_trip(mix : str, messages : list[tuple], size : int) -> list[dict]:
+    """ Sends every message over loopback and waits for it to be echoed back """
+
+    messages = messages[:ROUND_TRIPS_AMOUNT]
+    size = size * len(messages) // MESSAGES_AMOUNT
+
+    codec = choose_codec(available_codecs())
+    cases = (
+        ("legacy plain", TCPsocket.FRAMING_LEGACY, None, None, False, False),
+        ("v2 plain", TCPsocket.FRAMING_V2, None, None, False, False),
+        (f"v2 {codec} aes-gcm", TCPsocket.FRAMING_V2, CIPHER_PREFERENCE[0], codec, True, True),
+        (f"v2 {codec} aes-cbc", TCPsocket.FRAMING_V2, CIPHER_PREFERENCE[-1], codec, True, True),
+    )
+
+    results = []
+    for case, framing, cipher, codec_name, encrypt, compress in cases:
+        sender, receiver = connected_clients(framing, cipher, codec_name)
+
+        def echo():
+            for _ in messages:
+                data = receiver.protocol_recv(decrypt=encrypt, decompress=compress)
+                receiver.protocol_send(*data, encrypt=encrypt, compress=compress)
+
+        echo_thread = threading.Thread(target=echo)
+        echo_thread.start()
+
+        start = perf_counter()
+        for msg in messages:
+            sender.protocol_send(*msg, encrypt=encrypt, compress=compress)
+            sender.protocol_recv(decrypt=encrypt, decompress=compress)
+        elapsed = perf_counter() - start
+
+        echo_thread.join()
+        sender.close()
+        receiver.close()
+
+        results.append(result(mix, "round trip", case, elapsed, len(messages), size))
+
+    return results
+
+
+def run_mix(mix : str) -> list[dict]:
+    """
+        Runs every stage on a traffic mix
+
+        INPUT: mix
+        OUTPUT: List of results
+    """
+
+    messages = agent_traffic(mix, MESSAGES_AMOUNT)
+    encoded = [MessageParser.protocol_message_construct(*msg) for msg in messages]
+    size = sum(len(msg) for msg in encoded)
+
+    return (bench_encode(mix, messages) + bench_decode(mix, encoded) + bench_compress(mix, encoded)
+            + bench_encrypt(mix, encoded) + bench_round_trip(mix, messages, size))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Silent net protocol micro benchmarks")
+    parser.add_argument("--mix", action="append", choices=list(AGENT_MIXES), help="Traffic mix to run (default: all)")
+    parser.add_argument("--json", metavar="PATH", help="Write results as json to PATH ('-' for stdout)")
+    args = parser.parse_args()
+
+    results = []
+    for mix in args.mix or AGENT_MIXES:
+        results += run_mix(mix)
+
+    # Server mostly constructs manager answers, which have many more fields than agent messages
+    # They are also the messages long enough to be compressed on a real connection
+    messages = manager_traffic()
+    results += bench_encode("manager", messages)
+    results += bench_compress("manager", [MessageParser.protocol_message_construct(*msg) for msg in messages])
+
+    if args.json:
+        report = {
+            "meta": {
+                "date": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "codecs": available_codecs(),
+                "messages": MESSAGES_AMOUNT,
+                "round_trips": ROUND_TRIPS_AMOUNT,
+            },
+            "results": results,
+        }
+
+        if args.json == "-":
+            print(json.dumps(report, indent=2))
+            return
+
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    print(f"{'mix':>9} {'stage':>11} {'case':>20} {'usec/msg':>9} {'MB/s':>8} {'ratio':>6}")
+    for entry in results:
+        ratio = f"{entry['ratio']:.3f}" if "ratio" in entry else ""
+        print(f"{entry['mix']:>9} {entry['stage']:>11} {entry['case']:>20} "
+              f"{entry['usec_per_msg']:>9.2f} {entry['mb_s']:>8.1f} {ratio:>6}")
+
+
+if __name__ == "__main__":
+    main()
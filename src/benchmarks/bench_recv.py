@@ -0,0 +1,128 @@
+#   'Silent net' receive path micro benchmark
+#
+#       Compares the old receive loop (bytes concatenation)
+#       With TCPsocket's recv_into based receive path
+#       Reports time and traced allocations per message
+#
+#   Omer Kfir (C)
+
+import os
+import sys
+import socket
+import threading
+import tracemalloc
+from time import perf_counter
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../shared')))
+from protocol import TCPsocket
+
+__author__ = "Omer Kfir"
+
+MESSAGES_AMOUNT = 2000
+MESSAGE_SIZES = (16, 256, 4096, 9000)
+
+
+def legacy_recv(sock : socket.socket) -> bytes:
+    """
+        Receive loop as it was before recv_into, kept here for comparison
+
+        INPUT: sock
+        OUTPUT: Byte stream
+
+        @sock -> Connected socket object
+    """
+
+    def recv_amount(size):
+        buffer = b''
+        while size:
+            tmp_buf = sock.recv(min(size, TCPsocket.CHUNK_MAX_LEN))
+            if not tmp_buf:
+                return b''
+
+            buffer += tmp_buf
+            size -= len(tmp_buf)
+        return buffer
+
+    return recv_amount(int(recv_amount(TCPsocket.MSG_LEN_LEN)))
+
+
+def connected_pair() -> tuple[socket.socket, socket.socket]:
+    """
+        Creates a connected pair of loopback TCP sockets
+
+        INPUT: None
+        OUTPUT: Tuple of (sending socket, receiving socket)
+    """
+
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as listener:
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+
+        sender = socket.create_connection(listener.getsockname())
+        receiver, _ = listener.accept()
+
+    return sender, receiver
+
+
+def run_case(size : int, use_legacy : bool) -> dict:
+    """
+        Sends MESSAGES_AMOUNT frames of 'size' bytes and measures the receiving side
+
+        INPUT: size, use_legacy
+        OUTPUT: Dictionary of results
+
+        @size -> Payload size of every frame
+        @use_legacy -> Whether to measure the old receive loop
+    """
+
+    sender, receiver = connected_pair()
+    sending_side = TCPsocket(sender)
+    receiving_side = TCPsocket(receiver)
+
+    payload = os.urandom(size)
+    writer = threading.Thread(target=lambda: [sending_side.send(payload) for _ in range(MESSAGES_AMOUNT)])
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    writer.start()
+
+    allocated = 0
+    start = perf_counter()
+    for _ in range(MESSAGES_AMOUNT):
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+
+        if use_legacy:
+            legacy_recv(receiver)
+        else:
+            receiving_side.recv()
+
+        _, peak = tracemalloc.get_traced_memory()
+        allocated += peak - before
+
+    elapsed = perf_counter() - start
+    tracemalloc.stop()
+
+    writer.join()
+    sending_side.close()
+    receiving_side.close()
+
+    return {
+        "size": size,
+        "path": "legacy" if use_legacy else "recv_into",
+        "usec_per_msg": elapsed / MESSAGES_AMOUNT * 1e6,
+        "bytes_allocated_per_msg": allocated / MESSAGES_AMOUNT,
+    }
+
+
+def main():
+    print(f"{'size':>6} {'path':>10} {'usec/msg':>10} {'alloc B/msg':>12}")
+    for size in MESSAGE_SIZES:
+        for use_legacy in (True, False):
+            result = run_case(size, use_legacy)
+            print(f"{result['size']:>6} {result['path']:>10} "
+                  f"{result['usec_per_msg']:>10.2f} {result['bytes_allocated_per_msg']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+#   'Silent net' capacity check
+#
+#       Connects max clients + 1 agents to the threaded, asyncio and
+#       Sharded servers and checks the last agent is rejected
+#       Then frees a place and checks a new agent is served again
+#
+#   Omer Kfir (C)
+
+import os
+import sys
+import tempfile
+import threading
+from time import perf_counter, sleep
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../shared')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../server')))
+from protocol import MessageParser, TCPsocket, client, server
+from server import SilentNetServer, UserId
+from async_server import AsyncSilentNetServer
+from sharded_server import ShardedSilentNetServer
+
+__author__ = "Omer Kfir"
+
+MAX_CLIENTS = 3
+SHARDS = 2
+SETTLE_TIMEOUT = 10
+CLOSE_TIMEOUT = 2
+
+
+def connect_agent(port : int, index : int) -> client:
+    """
+        Connects an agent and authenticates it
+
+        INPUT: port, index
+        OUTPUT: Client object of the agent
+    """
+
+    agent = client()
+    agent.connect("127.0.0.1", port)
+    agent.protocol_send(MessageParser.CLIENT_MSG_AUTH, f"02:00:00:00:00:{index:02x}", f"check-pc{index}",
+                        encrypt=False, compress=False)
+    return agent
+
+
+def was_closed(agent : client) -> bool:
+    """
+        Returns whether the server closed an agent's connection
+
+        INPUT: agent
+        OUTPUT: Boolean value
+    """
+
+    agent.set_timeout(CLOSE_TIMEOUT)
+    try:
+        return agent.get_socket().recv(1) == b''
+    except OSError:
+        return False
+
+
+def wait_agents(silent_net, amount : int) -> int:
+    """
+        Waits until the server counts 'amount' connections
+
+        INPUT: silent_net, amount
+        OUTPUT: Amount of connections counted
+    """
+
+    start = perf_counter()
+    while len(silent_net.registry) != amount and perf_counter() - start < SETTLE_TIMEOUT:
+        sleep(0.05)
+
+    return len(silent_net.registry)
+
+
+def check_server(server_class) -> list[str]:
+    """
+        Checks a server rejects the agent above max clients
+
+        INPUT: server_class
+        OUTPUT: List of failures (empty if the server passed)
+
+        @server_class -> SilentNetServer, AsyncSilentNetServer or ShardedSilentNetServer
+    """
+
+    class CheckServer(server_class):
+        def _load_configuration(self):
+            self.max_clients = self.default_max_clients = MAX_CLIENTS
+            self.shards = SHARDS
+
+        def _setup_keyboard_shortcuts(self):
+            pass
+
+    db_dir = tempfile.TemporaryDirectory()
+    UserId.DB_NAME = os.path.join(db_dir.name, "check.db")
+    server.SERVER_BIND_PORT = TCPsocket.get_free_port()
+
+    silent_net = CheckServer()
+    server_thread = threading.Thread(target=silent_net.start)
+    server_thread.start()
+    sleep(1)
+
+    failures = []
+    agents = [connect_agent(server.SERVER_BIND_PORT, index) for index in range(MAX_CLIENTS)]
+    if wait_agents(silent_net, MAX_CLIENTS) != MAX_CLIENTS:
+        failures.append(f"{len(silent_net.registry)} agents counted instead of {MAX_CLIENTS}")
+
+    extra = connect_agent(server.SERVER_BIND_PORT, MAX_CLIENTS)
+    if not was_closed(extra):
+        failures.append(f"agent {MAX_CLIENTS + 1} was not rejected")
+    extra.close()
+
+    agents.pop(0).close()
+    if wait_agents(silent_net, MAX_CLIENTS - 1) != MAX_CLIENTS - 1:
+        failures.append("disconnected agent is still counted")
+
+    agents.append(connect_agent(server.SERVER_BIND_PORT, MAX_CLIENTS + 1))
+    if was_closed(agents[-1]):
+        failures.append("agent was rejected after a place was freed")
+
+    for agent in agents:
+        agent.close()
+
+    silent_net.quit_server()
+    server_thread.join()
+    db_dir.cleanup()
+
+    return failures
+
+
+def main():
+    failed = False
+    for server_class in (SilentNetServer, AsyncSilentNetServer, ShardedSilentNetServer):
+        failures = check_server(server_class)
+        failed = failed or bool(failures)
+
+        print(f"\n{server_class.__name__}: {'ok' if not failures else 'FAILED'}")
+        for failure in failures:
+            print(f"    {failure}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+#   'Silent net' benchmark traffic
+#
+#       Builds messages shaped like the ones seen on
+#       Agent and manager connections, used by the benchmarks
+#
+#   Omer Kfir (C)
+
+import os
+import sys
+import json
+from random import Random
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../shared')))
+from protocol import MessageParser
+
+__author__ = "Omer Kfir"
+
+PROCESS_NAMES = ("firefox", "code", "bash", "python3", "chrome", "slack", "zoom", "gedit", "nautilus", "vlc")
+
+# Weights of agent message types in every traffic mix
+AGENT_MIXES = {
+    "balanced": {MessageParser.CLIENT_PROCESS_OPEN: 25, MessageParser.CLIENT_INPUT_EVENT: 25,
+                 MessageParser.CLIENT_CPU_USAGE: 25, MessageParser.CLIENT_IP_INTERACTION: 25},
+    "process": {MessageParser.CLIENT_PROCESS_OPEN: 70, MessageParser.CLIENT_INPUT_EVENT: 10,
+                MessageParser.CLIENT_CPU_USAGE: 10, MessageParser.CLIENT_IP_INTERACTION: 10},
+    "input": {MessageParser.CLIENT_PROCESS_OPEN: 10, MessageParser.CLIENT_INPUT_EVENT: 70,
+              MessageParser.CLIENT_CPU_USAGE: 10, MessageParser.CLIENT_IP_INTERACTION: 10},
+    "cpu": {MessageParser.CLIENT_PROCESS_OPEN: 10, MessageParser.CLIENT_INPUT_EVENT: 10,
+            MessageParser.CLIENT_CPU_USAGE: 70, MessageParser.CLIENT_IP_INTERACTION: 10},
+    "network": {MessageParser.CLIENT_PROCESS_OPEN: 10, MessageParser.CLIENT_INPUT_EVENT: 10,
+                MessageParser.CLIENT_CPU_USAGE: 10, MessageParser.CLIENT_IP_INTERACTION: 70},
+}
+
+
+def agent_message(rnd : Random, msg_type : str, cores : int = 4) -> tuple:
+    """
+        Builds a single agent message of a given type
+
+        INPUT: rnd, msg_type, cores
+        OUTPUT: Tuple of message type followed by its arguments
+
+        @rnd -> Random generator
+        @msg_type -> One of CPO, CIE, CCU, COT
+        @cores -> Amount of cores reported in cpu usage messages
+    """
+
+    if msg_type == MessageParser.CLIENT_PROCESS_OPEN:
+        return (msg_type, rnd.choice(PROCESS_NAMES))
+
+    if msg_type == MessageParser.CLIENT_INPUT_EVENT:
+        return (msg_type, rnd.randint(6, 900))
+
+    if msg_type == MessageParser.CLIENT_CPU_USAGE:
+        usage = [f"{core},{rnd.randint(0, 100)}" for core in range(cores)]
+        usage[-1] += f",2025-04-10 {rnd.randint(8, 18):02d}:{rnd.randint(0, 59):02d}:{rnd.randint(0, 59):02d}"
+        return (msg_type, *usage)
+
+    return (msg_type, f"10.0.{rnd.randint(0, 255)}.{rnd.randint(1, 254)}")
+
+
+def agent_traffic(mix : str = "balanced", amount : int = 1000, seed : int = 0) -> list[tuple]:
+    """
+        Builds messages an agent sends, with message types weighted by a mix
+
+        INPUT: mix, amount, seed
+        OUTPUT: List of messages, each is message type followed by its arguments
+
+        @mix -> Name of mix in AGENT_MIXES
+        @amount -> Amount of messages
+        @seed -> Seed of random generator
+    """
+
+    rnd = Random(seed)
+    types, weights = zip(*AGENT_MIXES[mix].items())
+
+    return [agent_message(rnd, msg_type) for msg_type in rnd.choices(types, weights, k=amount)]
+
+
+def agent_logs(mix : str = "balanced", amount : int = 1000, seed : int = 0) -> list[tuple[str, bytes]]:
+    """
+        Builds agent messages the way the ingest writer receives them
+
+        INPUT: mix, amount, seed
+        OUTPUT: List of tuples of data type and data
+
+        @mix -> Name of mix in AGENT_MIXES
+        @amount -> Amount of logs
+        @seed -> Seed of random generator
+    """
+
+    logs = []
+    for msg in agent_traffic(mix, amount, seed):
+        data_type, data = MessageParser.protocol_message_deconstruct(
+            MessageParser.protocol_message_construct(*msg), MessageParser.PROTOCOL_DATA_INDEX)
+        data_type = data_type.decode()
+
+        # Process names are decoded by the connection handler
+        logs.append((data_type, data.decode() if data_type == MessageParser.CLIENT_PROCESS_OPEN else data))
+
+    return logs
+
+
+def employee_stats(rnd : Random, processes : int = 40, samples : int = 300) -> str:
+    """
+        Builds a statistics json like the one ManagerHandler sends for a client
+
+        INPUT: rnd, processes, samples
+        OUTPUT: Json string
+
+        @rnd -> Random generator
+        @processes -> Amount of different processes
+        @samples -> Amount of cpu samples
+    """
+
+    data = {
+        "processes": {
+            "labels": [f"{rnd.choice(PROCESS_NAMES)}{i}" for i in range(processes)],
+            "data": [rnd.randint(1, 500) for _ in range(processes)]
+        },
+        "inactivity": {
+            "labels": [f"2025-04-{rnd.randint(1, 28):02d} {rnd.randint(8, 18):02d}:{rnd.randint(0, 59):02d}:00" for _ in range(20)],
+            "data": [rnd.randint(6, 90) for _ in range(20)]
+        },
+        "wpm": rnd.randint(0, 80),
+        "cpu_usage": {
+            "labels": [f"2025-04-10 {10 + i // 3600:02d}:{i // 60 % 60:02d}:{i % 60:02d}" for i in range(0, samples * 5, 5)],
+            "data": {
+                "cores": ["0", "1", "2", "3"],
+                "usage": [[rnd.randint(0, 100) for _ in range(samples)] for _ in range(4)]
+            }
+        },
+        "ips": {
+            "labels": [f"10.0.{rnd.randint(0, 255)}.{rnd.randint(1, 254)}" for _ in range(30)],
+            "data": [rnd.randint(1, 200) for _ in range(30)]
+        }
+    }
+
+    return json.dumps(data)
+
+
+def manager_traffic(seed : int = 0) -> list[tuple]:
+    """
+        Builds a manager session, requests and the server's answers
+
+        INPUT: seed
+        OUTPUT: List of messages, each is message type followed by its arguments
+    """
+
+    rnd = Random(seed)
+    clients = [f"{rnd.choice(PROCESS_NAMES)}-pc{i},{rnd.randint(0, 100)},{rnd.randint(0, 1)}" for i in range(40)]
+
+    messages = []
+    for _ in range(5):
+        messages.append((MessageParser.MANAGER_GET_CLIENTS,))
+        messages.append((MessageParser.MANAGER_GET_CLIENTS, *clients))
+
+        for name in rnd.sample(clients, 3):
+            messages.append((MessageParser.MANAGER_GET_CLIENT_DATA, name.split(",")[0]))
+            messages.append((MessageParser.MANAGER_GET_CLIENTS, employee_stats(rnd)))
+
+    return messages
+
@@ -13,6 +13,7 @@ import webbrowser
 import os
 import signal
 import json
+from time import time
 from sys import argv
 from functools import wraps
 from flask import Flask, redirect, render_template, request, jsonify, url_for, send_from_directory
@@ -33,6 +34,8 @@ class SilentNetManager:
         self.app : webbrowser = Flask(__name__)
         self.manager_socket : bool = None
         self.is_connected : bool = False
+        self.is_authenticated : bool = False
+        self.session_ticket : tuple = None  # (ticket, expiry time, session state) of last session
         self.screens : dict = {
             "/exit": 0,
             "/loading": 1,
@@ -104,6 +107,7 @@ class SilentNetManager:
         if self.manager_socket:
             self.manager_socket.close()
         self.is_connected = False
+        self.is_authenticated = False
 
     def exit_program(self):
         """Handle application exit"""
@@ -132,6 +136,9 @@ class SilentNetManager:
 
     def start_screen(self):
         """Render the initial login screen"""
+        if self.is_authenticated:
+            return redirect(url_for("settings_screen"))
+
         password_incorrect = request.args.get('password_incorrect', 'false')
         return render_template("opening_screen.html", password_incorrect=password_incorrect)
 
@@ -143,14 +150,24 @@ class SilentNetManager:
             self.connect_to_server()
             if not self.is_connected:
                 return redirect(url_for("loading_screen"))
+
+        if self.is_authenticated:
+            return redirect(url_for("settings_screen"))
         
-        sent = self.manager_socket.protocol_send(MessageParser.MANAGER_MSG_PASSWORD, encrypt=False, compress=False)
+        sent = self.manager_socket.protocol_send(MessageParser.MANAGER_MSG_PASSWORD, *TCPsocket.FRAMING_VERSIONS, encrypt=False, compress=False)
         if sent == 0:
             self.connect_to_server()
             if not self.is_connected:
                 return redirect(url_for("loading_screen"))
+
+            # The reconnect may have resumed the session with a ticket
+            if self.is_authenticated:
+                return redirect(url_for("settings_screen"))
             
-            self.manager_socket.protocol_send(MessageParser.MANAGER_MSG_PASSWORD, encrypt=False, compress=False)
+            self.manager_socket.protocol_send(MessageParser.MANAGER_MSG_PASSWORD, *TCPsocket.FRAMING_VERSIONS, encrypt=False, compress=False)
+
+        if not self.manager_socket.negotiate_framing():
+            return redirect(url_for("loading_screen"))
 
         if not self.manager_socket.exchange_keys():
             return redirect(url_for("loading_screen"))
@@ -159,9 +176,13 @@ class SilentNetManager:
         if sent == 0:
             return redirect(url_for("loading_screen"))
         
-        response = self.manager_socket.protocol_recv()[MessageParser.PROTOCOL_DATA_INDEX - 1].decode()
+        response = self.manager_socket.protocol_recv()
+        if response == b"" or response == b"ERR":
+            return redirect(url_for("loading_screen"))
         
-        if response == MessageParser.MANAGER_VALID_CONN:
+        if response[MessageParser.PROTOCOL_DATA_INDEX - 1].decode() == MessageParser.MANAGER_VALID_CONN:
+            self._store_session_ticket(response[MessageParser.PROTOCOL_DATA_INDEX:])
+            self.is_authenticated = True
             return redirect(url_for("settings_screen"))
         
         if not self.is_connected:
@@ -226,7 +247,8 @@ class SilentNetManager:
         self.connect_to_server()
         current_state = self.is_connected
 
-        if self.is_connected:
+        # Resumed sessions stay open, the start screen moves straight on
+        if self.is_connected and not self.is_authenticated:
             self.manager_socket.protocol_send(MessageParser.MANAGER_CHECK_CONNECTION, encrypt=False, compress=False)
             self.disconnect()
 
@@ -282,6 +304,41 @@ class SilentNetManager:
             return render_template("loading_screen.html")
         
         self.manager_socket.set_timeout(5)
+        self._resume_session()
+
+    def _store_session_ticket(self, fields):
+        """Keep the ticket sent by the server to resume this session later"""
+        if len(fields) < 2:
+            self.session_ticket = None
+            return
+
+        ticket, lifetime = fields[0].decode(), int(fields[1])
+        self.session_ticket = (ticket, time() + lifetime, self.manager_socket.export_session())
+
+    def _resume_session(self):
+        """Try to resume the last session, skipping key exchange and password"""
+        if self.session_ticket is None:
+            return
+
+        # Tickets are single use
+        ticket, expiry, session = self.session_ticket
+        self.session_ticket = None
+        if expiry <= time():
+            return
+
+        fields = self.manager_socket.resume_session(ticket, session)
+        if fields is None:
+            # Server closes the connection after a rejected ticket, start over with a fresh one
+            self.manager_socket.close()
+            self.manager_socket = client(manager=True)
+            self.is_connected = self.manager_socket.connect(server_ip, server.SERVER_BIND_PORT)
+
+            if self.is_connected:
+                self.manager_socket.set_timeout(5)
+            return
+
+        self._store_session_ticket(fields)
+        self.is_authenticated = True
 
     def run(self):
         """Run the Flask application"""
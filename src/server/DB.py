@@ -2,38 +2,93 @@
 #   
 #
 #   Omer Kfir (C)
-import sqlite3, threading, os, sys
+import sqlite3, threading, os, sys, queue
+from array import array
+from contextlib import contextmanager
+from pathlib import Path
 from datetime import datetime
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../shared')))
 from protocol import MessageParser
 from filter import process_filter
+from counters import CounterAggregator
 
 __author__ = "Omer Kfir"
 
+# Logs which are counted instead of kept one by one
+COUNTED_TYPES = (MessageParser.CLIENT_PROCESS_OPEN, MessageParser.CLIENT_INPUT_EVENT, MessageParser.CLIENT_IP_INTERACTION)
+COUNTED_WHERE = "type IN (" + ", ".join(f"'{data_type}'" for data_type in COUNTED_TYPES) + ")"
+
+CPU_SAMPLES_NAME = "cpu_samples"
+INACTIVE_PERIODS_NAME = "inactive_periods"
+ACTIVITY_NAME = "activity"
+
+# Tables of a client's logs besides the logs table
+CLIENT_TABLES = (CPU_SAMPLES_NAME, INACTIVE_PERIODS_NAME, ACTIVITY_NAME)
+
+def cpu_sample_row(id : int, data : bytes, default_time : str) -> tuple[int, str, bytes]:
+    """
+        Packs a cpu usage log into a samples table row
+
+        INPUT: id, data, default_time
+        OUTPUT: Tuple of id, time and usages of the cores (None if the log is not valid)
+
+        @id: Id of client
+        @data: Log of "core,usage" fields of cores 0 to n in order, the last one ends with ",time"
+        @default_time: Time of the sample if the log has none
+    """
+
+    fields = [field.decode().split(",") for field in data.split(MessageParser.PROTOCOL_SEPARATOR) if field]
+    if not fields:
+        return None
+
+    sample_time = fields[-1][2] if len(fields[-1]) == 3 else default_time
+    try:
+        if [int(field[0]) for field in fields] != list(range(len(fields))):
+            return None
+
+        usage = array('H', [int(field[1]) for field in fields])
+    except (ValueError, IndexError, OverflowError):
+        return None
+
+    # Stored little endian whatever machine wrote it
+    if sys.byteorder == "big":
+        usage.byteswap()
+
+    return id, sample_time, usage.tobytes()
+
 class DBHandler():
     """
         Base class for database handling
     """
 
     DB_NAME = "server_db.db"
+
+    # Storage mode, with WAL readers do not wait for writers and a commit is not fsynced
+    # So logs are written on their own connection while managers read
+    WAL : bool = True
     
     _lock : threading.Lock = threading.RLock()
     
-    def __init__(self, conn, cursor, table_name: str):
+    def __init__(self, conn, cursor, table_name: str, lock = None):
         """
         Initialize database connection using an existing connection and cursor.
 
-        INPUT: conn, cursor, table_name
+        INPUT: conn, cursor, table_name, lock
         OUTPUT: None
 
         @conn: Existing SQLite connection object
         @cursor: Existing SQLite cursor object
         @table_name: Name of the primary table
+        @lock: Lock of the connection, connections without one share the global lock
         """
         self.conn = conn
         self.cursor = cursor
         self.table_name : str = table_name
+        self.lock = lock if lock is not None else DBHandler._lock
+
+        # While set, statements are committed together when the transaction ends
+        self.in_transaction : bool = False
 
         # Create tables if they do not exist
         if table_name.endswith("logs"):
@@ -46,6 +101,50 @@ class DBHandler():
             );
             ''')
             self.commit('CREATE INDEX IF NOT EXISTS idx_logs_uid_type ON logs(id, type);')
+
+            # Counts of the logs not written yet
+            self.counters : CounterAggregator = CounterAggregator()
+
+            # Counted logs are upserted, so each of them must be unique
+            if not self.commit("SELECT name FROM sqlite_master WHERE type = 'index' AND name = 'idx_logs_counted';"):
+                self.__merge_counted_logs()
+                self.commit(f'CREATE UNIQUE INDEX IF NOT EXISTS idx_logs_counted ON logs(id, type, data) WHERE {COUNTED_WHERE};')
+
+            # Cpu usage is a time series, a row for every sample with the usage of every core packed
+            # Rows of a client are stored together and in time order
+            exists = self.commit(f"SELECT name FROM sqlite_master WHERE type = 'table' AND name = '{CPU_SAMPLES_NAME}';")
+            self.commit(f'''
+            CREATE TABLE IF NOT EXISTS {CPU_SAMPLES_NAME} (
+                id INTEGER NOT NULL,
+                time TEXT NOT NULL,
+                usage BLOB NOT NULL,
+                PRIMARY KEY (id, time)
+            ) WITHOUT ROWID;
+            ''')
+
+            if not exists:
+                self.__migrate_cpu_logs()
+
+            # Periods a client was inactive, and its active and inactive seconds added up at ingest
+            exists = self.commit(f"SELECT name FROM sqlite_master WHERE type = 'table' AND name = '{INACTIVE_PERIODS_NAME}';")
+            self.commit(f'''
+            CREATE TABLE IF NOT EXISTS {INACTIVE_PERIODS_NAME} (
+                id INTEGER NOT NULL,
+                start TEXT NOT NULL,
+                duration INTEGER NOT NULL,
+                PRIMARY KEY (id, start)
+            ) WITHOUT ROWID;
+            ''')
+            self.commit(f'''
+            CREATE TABLE IF NOT EXISTS {ACTIVITY_NAME} (
+                id INTEGER PRIMARY KEY,
+                active INTEGER NOT NULL DEFAULT 0,
+                inactive INTEGER NOT NULL DEFAULT 0
+            );
+            ''')
+
+            if not exists:
+                self.__migrate_inactive_logs()
         elif table_name.endswith("uid"):
             self.commit('''
             CREATE TABLE IF NOT EXISTS uid (
@@ -57,6 +156,83 @@ class DBHandler():
             ''')
             self.commit('CREATE INDEX IF NOT EXISTS idx_uid_hostname ON uid(hostname)')
 
+    def __merge_counted_logs(self) -> None:
+        """
+            Merges counted logs which were written twice, before their unique index existed
+
+            INPUT: None
+            OUTPUT: None
+        """
+        with self.transaction():
+            self.commit(f'''
+            UPDATE logs SET count = (
+                SELECT SUM(dup.count) FROM logs AS dup
+                WHERE dup.id = logs.id AND dup.type = logs.type AND dup.data = logs.data
+            )
+            WHERE {COUNTED_WHERE} AND rowid IN (
+                SELECT MIN(rowid) FROM logs WHERE {COUNTED_WHERE} GROUP BY id, type, data HAVING COUNT(*) > 1
+            );
+            ''')
+            self.commit(f'''
+            DELETE FROM logs WHERE {COUNTED_WHERE} AND rowid NOT IN (
+                SELECT MIN(rowid) FROM logs WHERE {COUNTED_WHERE} GROUP BY id, type, data
+            );
+            ''')
+
+    def __migrate_cpu_logs(self) -> None:
+        """
+            Moves cpu usage kept as one blob per client into the samples table
+
+            INPUT: None
+            OUTPUT: None
+        """
+        with self.transaction():
+            for id, blob in self.commit("SELECT id, data FROM logs WHERE type = ?;", MessageParser.CLIENT_CPU_USAGE):
+                if isinstance(blob, str):
+                    blob = blob.encode()
+
+                rows = [cpu_sample_row(id, sample, "") for sample in blob.split(b"|")]
+                rows = [row for row in rows if row is not None]
+
+                self.commit_many(f"INSERT OR REPLACE INTO {CPU_SAMPLES_NAME} (id, time, usage) VALUES (?,?,?);", rows)
+
+            self.commit("DELETE FROM logs WHERE type = ?;", MessageParser.CLIENT_CPU_USAGE)
+
+    def __migrate_inactive_logs(self) -> None:
+        """
+            Moves inactive times kept as one string per client into the periods table
+            Totals of a client are its inactive periods and the rest of the time between its first and last input
+
+            INPUT: None
+            OUTPUT: None
+        """
+        with self.transaction():
+            command = "SELECT id, data FROM logs WHERE type = ?;"
+            first_inputs = dict(self.commit(command, MessageParser.CLIENT_FIRST_INPUT_EVENT))
+            last_inputs = dict(self.commit(command, MessageParser.CLIENT_LAST_INPUT_EVENT))
+
+            for id, data in self.commit(command, MessageParser.CLIENT_INACTIVE_EVENT):
+                if isinstance(data, bytes):
+                    data = data.decode()
+
+                # String format -> datetime of inactive, inactive minutes
+                # Example: 2025-10-10 20:20:20,10~2025-10-10 20:20:30,7~
+                periods = [period.split(",") for period in data.split("~") if period]
+                periods = [(id, start, int(duration)) for start, duration in periods]
+                self.commit_many(f"INSERT OR REPLACE INTO {INACTIVE_PERIODS_NAME} (id, start, duration) VALUES (?,?,?);", periods)
+
+                inactive = sum(period[2] for period in periods) * 60
+                active = 0
+                if id in first_inputs and id in last_inputs:
+                    first_input = datetime.strptime(first_inputs[id], "%Y-%m-%d %H:%M:%S")
+                    last_input = datetime.strptime(last_inputs[id], "%Y-%m-%d %H:%M:%S")
+                    active = max(int((last_input - first_input).total_seconds()) - inactive, 0)
+
+                command = f"INSERT OR REPLACE INTO {ACTIVITY_NAME} (id, active, inactive) VALUES (?,?,?);"
+                self.commit(command, id, active, inactive)
+
+            self.commit("DELETE FROM logs WHERE type = ?;", MessageParser.CLIENT_INACTIVE_EVENT)
+
     @staticmethod
     def connect_DB(db_name : str) -> tuple:
         """
@@ -67,6 +243,12 @@ class DBHandler():
         """
 
         conn = sqlite3.connect(db_name, check_same_thread=False)
+
+        if DBHandler.WAL:
+            # Journal mode is kept in the database file, synchronous is set per connection
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("PRAGMA synchronous=NORMAL;")
+
         return conn, conn.cursor()
 
     @staticmethod
@@ -106,6 +288,32 @@ class DBHandler():
 
         self.clean_deleted_records_DB()
     
+    @contextmanager
+    def transaction(self):
+        """
+            Groups every statement executed inside the block into one commit
+            Rolls back the whole block if an exception escapes it
+
+            INPUT: None
+            OUTPUT: None
+        """
+
+        with self.lock:
+            if self.in_transaction:
+                # Already inside a transaction, outer block commits
+                yield
+                return
+
+            self.in_transaction = True
+            try:
+                yield
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+            finally:
+                self.in_transaction = False
+
     def commit(self, command: str, *command_args):
         """
             Commits a command to database
@@ -119,7 +327,7 @@ class DBHandler():
         
         ret_data = ""
         
-        with DBHandler._lock:
+        with self.lock:
         
             if not self.conn or not self.cursor:
                 raise ValueError("Database connection not established")
@@ -127,15 +335,150 @@ class DBHandler():
             try:
                 self.cursor.execute(command, command_args)
                 ret_data = self.cursor.fetchall()
-                self.conn.commit()
+
+                if not self.in_transaction:
+                    self.conn.commit()
             except Exception as e:
-                self.conn.rollback()
                 # Reset cursor
                 self.cursor = self.conn.cursor()
                 print(f"Commit DB exception {e}")
+
+                # Inside a transaction the whole block is rolled back by transaction()
+                if self.in_transaction:
+                    raise
+                self.conn.rollback()
         
         return ret_data
 
+    def commit_many(self, command: str, rows) -> None:
+        """
+            Executes a command once for every row of arguments, all in one commit
+
+            INPUT: command, rows
+            OUTPUT: None
+
+            @command: SQL command to execute
+            @rows: Iterable of argument tuples
+        """
+
+        with self.lock:
+
+            if not self.conn or not self.cursor:
+                raise ValueError("Database connection not established")
+
+            try:
+                self.cursor.executemany(command, rows)
+
+                if not self.in_transaction:
+                    self.conn.commit()
+            except Exception as e:
+                # Reset cursor
+                self.cursor = self.conn.cursor()
+                print(f"Commit DB exception {e}")
+
+                # Inside a transaction the whole block is rolled back by transaction()
+                if self.in_transaction:
+                    raise
+                self.conn.rollback()
+
+
+class ReadPool():
+    """
+        Pool of read only connections to a database
+        Queries running on it do not take the global database lock
+    """
+
+    POOL_SIZE = 4
+
+    def __init__(self, db_path : str, size : int = POOL_SIZE):
+        """
+        Opens the connections, the database must already exist.
+
+        INPUT: db_path, size
+        OUTPUT: None
+
+        @db_path: Path of the database
+        @size: Amount of connections, queries beyond it wait for a free one
+        """
+        uri = Path(db_path).absolute().as_uri() + "?mode=ro"
+
+        self.__connections : queue.Queue = queue.Queue()
+        for _ in range(size):
+            self.__connections.put(sqlite3.connect(uri, uri=True, check_same_thread=False))
+
+        self.size : int = size
+
+    @contextmanager
+    def cursor(self):
+        """
+            Borrows a connection for one query
+
+            INPUT: None
+            OUTPUT: Cursor of the borrowed connection
+        """
+
+        conn = self.__connections.get()
+        cursor = conn.cursor()
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+            self.__connections.put(conn)
+
+    def close(self) -> None:
+        """
+        Closes every connection of the pool, waits for borrowed ones
+
+        INPUT: None
+        OUTPUT: None
+        """
+        for _ in range(self.size):
+            conn = self.__connections.get()
+            conn.close()
+
+
+class DBReader():
+    """
+        Runs the queries of an ORM on a read pool
+        Readers only offer the ORM's statistics, never its writes
+    """
+
+    def __new__(cls, pool : ReadPool, table_name : str):
+        # Readers are never singletons, skip the ORM's __new__
+        return object.__new__(cls)
+
+    def __init__(self, pool : ReadPool, table_name : str):
+        """
+        Initialize the reader, tables are created by the writing ORM.
+
+        INPUT: pool, table_name
+        OUTPUT: None
+
+        @pool: Read pool of the database
+        @table_name: Name of the primary table
+        """
+        self.pool = pool
+        self.table_name : str = table_name
+
+    def commit(self, command: str, *command_args):
+        """
+            Runs a query on a pooled connection
+
+            INPUT: command, command_args
+            OUTPUT: Rows returned by the query
+
+            @command: SQL query to execute
+            @command_args: Arguments for the query
+        """
+
+        try:
+            with self.pool.cursor() as cursor:
+                cursor.execute(command, command_args)
+                return cursor.fetchall()
+        except Exception as e:
+            print(f"Read DB exception {e}")
+            return ""
+
 
 class UserLogsORM (DBHandler):
     """
@@ -173,12 +516,37 @@ class UserLogsORM (DBHandler):
             # Initialize the instance's values
             super().__init__(conn, cursor, table_name)
     
+    @contextmanager
+    def transaction(self):
+        """
+            Groups every statement executed inside the block into one commit
+            If the block is rolled back its counts are taken back too, counts it wrote return to memory
+
+            INPUT: None
+            OUTPUT: None
+        """
+
+        with self.lock:
+            if self.in_transaction:
+                # Already inside a transaction, outer block commits
+                yield
+                return
+
+            self.counters.begin()
+            try:
+                with super().transaction():
+                    yield
+            except Exception:
+                self.counters.rollback()
+                raise
+
+            self.counters.commit()
+
     def client_setup_db(self, id : int) -> None:
         """
             Writes basic logs that need to be for every client when connected
             Writes when client first logged in (Also writes last client input event with the same time)
-            Writes an empty record of inactive times
-            Writes an empty record of cpu usages
+            Writes empty totals of active and inactive time
 
             INPUT: id
             OUTPUT: None
@@ -188,21 +556,19 @@ class UserLogsORM (DBHandler):
 
         cur_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-        # First log of client
-        command = f"INSERT INTO {self.table_name} (id, type, data) VALUES (?,?,?);"
-        self.commit(command, id, MessageParser.CLIENT_FIRST_INPUT_EVENT, cur_time)
+        rows = [
+            # First log of client
+            (id, MessageParser.CLIENT_FIRST_INPUT_EVENT, cur_time),
 
-        # "Last" log of client (it's not really the last time, it's just a record for next when client logs again)
-        command = f"INSERT INTO {self.table_name} (id, type, data) VALUES (?,?,?);"
-        self.commit(command, id, MessageParser.CLIENT_LAST_INPUT_EVENT, cur_time)
+            # "Last" log of client (it's not really the last time, it's just a record for next when client logs again)
+            (id, MessageParser.CLIENT_LAST_INPUT_EVENT, cur_time),
+        ]
 
-        # Empty record of inactive times
-        command = f"INSERT INTO {self.table_name} (id, type, data) VALUES (?,?,'');"
-        self.commit(command, id, MessageParser.CLIENT_INACTIVE_EVENT)
+        command = f"INSERT INTO {self.table_name} (id, type, data) VALUES (?,?,?);"
+        self.commit_many(command, rows)
 
-        # Empty record of cpu usage
-        command = f"INSERT INTO {self.table_name} (id, type, data) VALUES (?,?,'');"
-        self.commit(command, id, MessageParser.CLIENT_CPU_USAGE)
+        command = f"INSERT OR REPLACE INTO {ACTIVITY_NAME} (id) VALUES (?);"
+        self.commit(command, id)
 
     def delete_id_records_DB(self, id : int):
         """
@@ -216,14 +582,30 @@ class UserLogsORM (DBHandler):
         command = f"DELETE FROM {self.table_name} WHERE id = ?"
         self.commit(command, id)
 
+        for table_name in CLIENT_TABLES:
+            self.commit(f"DELETE FROM {table_name} WHERE id = ?", id)
+
         self.clean_deleted_records_DB()
 
-    def __check_inactive(self, id : int) -> tuple[str, int]:
+    def delete_all_records_DB(self):
+        """
+            Deletes all records from the table and from every other table of the clients
+
+            INPUT: None
+            OUTPUT: None
+        """
+        for table_name in CLIENT_TABLES:
+            self.commit(f"DELETE FROM {table_name}")
+
+        super().delete_all_records_DB()
+
+    def __check_inactive(self, id : int) -> tuple[str, int, int]:
         """
             Checks if client is currently inactive
 
             INPUT: int
-            OUTPUT: Tuple conists of last datetime in string format client was active and the amount of minutes currently inactive
+            OUTPUT: Tuple conists of last datetime in string format client was active, the amount of minutes currently inactive
+                    (Both None if client is active) and the amount of seconds since that datetime
 
             @id: Id of client
         """
@@ -231,20 +613,25 @@ class UserLogsORM (DBHandler):
         cur_time = datetime.now()
 
         command = f"SELECT data FROM {self.table_name} WHERE id = ? AND type = ?;"
-        date_str = self.commit(command, id, MessageParser.CLIENT_LAST_INPUT_EVENT)[0][0]
-        
+        date_str = self.commit(command, id, MessageParser.CLIENT_LAST_INPUT_EVENT)
+        if not date_str:
+            return None, None, 0
+
+        date_str = date_str[0][0]
         date = datetime.strptime(date_str , "%Y-%m-%d %H:%M:%S")
-        inactive_time = int((cur_time - date).total_seconds() // 60)
+        seconds = max(int((cur_time - date).total_seconds()), 0)
+        inactive_time = seconds // 60
 
         # Inactive time is considered above five minutes
         if inactive_time > 5:
-            return date_str, inactive_time
+            return date_str, inactive_time, seconds
         
-        return None, None
+        return None, None, seconds
 
     def __update_last_input(self, id : int) -> None:
         """
             Updates last time user logged input event
+            Time since the previous input event is added to the active or inactive total
 
             INPUT: id
             OUTPUT: None
@@ -253,19 +640,15 @@ class UserLogsORM (DBHandler):
         """
 
         # Check if client is inactive until now, if so log it
-        date, inactive_time = self.__check_inactive(id)
+        date, inactive_time, seconds = self.__check_inactive(id)
         if date:
+            command = f"INSERT OR REPLACE INTO {INACTIVE_PERIODS_NAME} (id, start, duration) VALUES (?,?,?);"
+            self.commit(command, id, date, inactive_time)
 
-            # Get string of inactive times
-            # String format -> datetime of inactive, inactive minutes
-            # Example: 2025-10-10 20:20:20,10~2025-10-10 20:20:30,7~
-            command = f"SELECT data FROM {self.table_name} WHERE id = ? AND type = ?;"
-            data = self.commit(command, id, MessageParser.CLIENT_INACTIVE_EVENT)[0][0]
-
-            data += f"{date},{inactive_time}~"
-            command = f"UPDATE {self.table_name} SET data = ? WHERE id = ? AND type = ?;"
-
-            self.commit(command, data, id, MessageParser.CLIENT_INACTIVE_EVENT)
+        active, inactive = (0, seconds) if date else (seconds, 0)
+        command = f"""INSERT INTO {ACTIVITY_NAME} (id, active, inactive) VALUES (?,?,?)
+                      ON CONFLICT (id) DO UPDATE SET active = active + excluded.active, inactive = inactive + excluded.inactive;"""
+        self.commit(command, id, active, inactive)
 
         command = f"UPDATE {self.table_name} SET data = ? WHERE id = ? AND type = ?;"
 
@@ -274,25 +657,30 @@ class UserLogsORM (DBHandler):
         
         self.commit(command, cur_time, id, MessageParser.CLIENT_LAST_INPUT_EVENT)
 
-    def __get_total_active_time(self, id : int) -> int:
+    def __get_activity(self, id : int) -> tuple[int, int]:
         """
-            Calculates total active time of user
+            Gets the totals of active and inactive time of user
 
-            INPUT: int
-            OUTPUT: Integer - minutes amount of active time
+            INPUT: id
+            OUTPUT: Tuple of active and inactive seconds, including the current inactive time
 
             @id: Id of client
         """
 
-        command = f"SELECT data FROM {self.table_name} WHERE id = ? AND type = ?;"
-        first_input = datetime.strptime(self.commit(command, id, MessageParser.CLIENT_FIRST_INPUT_EVENT)[0][0], "%Y-%m-%d %H:%M:%S")
-        last_input = datetime.strptime(self.commit(command, id, MessageParser.CLIENT_LAST_INPUT_EVENT)[0][0], "%Y-%m-%d %H:%M:%S")
+        command = f"SELECT active, inactive FROM {ACTIVITY_NAME} WHERE id = ?;"
+        totals = self.commit(command, id)
+        active, inactive = totals[0] if totals else (0, 0)
+
+        # Time since the last input event is only added once the next one comes
+        date, _, seconds = self.__check_inactive(id)
+        if date:
+            inactive += seconds
 
-        return (last_input - first_input).total_seconds() // 60
+        return active, inactive
     
-    def __update_cpu_usage(self, id: int, data : bytes) -> None:
+    def __insert_cpu_sample(self, id: int, data : bytes) -> None:
         """
-            Updates cpu usage queuery
+            Appends a cpu usage sample
 
             INPUT: id, data
             OUTPUT: None
@@ -301,20 +689,18 @@ class UserLogsORM (DBHandler):
             @data: Bytes of data
         """
 
-        command = f"SELECT data FROM {self.table_name} WHERE id = ? AND type = ?;"
-        cpu_logs = self.commit(command, id, MessageParser.CLIENT_CPU_USAGE)[0][0]
-        
-        if isinstance(cpu_logs, str):
-            cpu_logs = cpu_logs.encode()
-
-        cpu_logs += data + b"|"
+        row = cpu_sample_row(id, data, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        if row is None:
+            return
 
-        command = f"UPDATE {self.table_name} SET data = ? WHERE id = ? AND type = ?;"
-        self.commit(command, cpu_logs, id, MessageParser.CLIENT_CPU_USAGE)
+        command = f"INSERT OR REPLACE INTO {CPU_SAMPLES_NAME} (id, time, usage) VALUES (?,?,?);"
+        self.commit(command, *row)
 
     def insert_data(self, id: int, data_type: str, data: bytes) -> None:
         """
             Insert data to SQL table, if record already exists incement its counter
+            Every statement of the log is committed together
+            Counted logs add up in memory, they are written by flush_counters
 
             INPUT: id, data_type, data
             OUTPUT: None
@@ -324,8 +710,31 @@ class UserLogsORM (DBHandler):
             @data: Bytes of data
         """
 
+        with self.transaction():
+            self.__insert_log(id, data_type, data)
+
+    def __insert_log(self, id: int, data_type: str, data: bytes) -> None:
+        """
+            Inserts a log, called inside a transaction
+
+            INPUT: id, data_type, data
+            OUTPUT: None
+        """
+
         if data_type == MessageParser.CLIENT_CPU_USAGE:
-            self.__update_cpu_usage(id, data)
+            self.__insert_cpu_sample(id, data)
+            return
+
+        if data_type in COUNTED_TYPES:
+            self.counters.add(id, data_type, data)
+
+            # Least recently counted logs are written to make room
+            if self.counters.full():
+                self.__write_counts(self.counters.evict())
+
+            # Check if it is an input event
+            if data_type == MessageParser.CLIENT_INPUT_EVENT:
+                self.__update_last_input(id)
             return
 
         command = f"SELECT count FROM {self.table_name} WHERE id = ? AND type = ? AND data = ?;"
@@ -346,6 +755,39 @@ class UserLogsORM (DBHandler):
         if data_type == MessageParser.CLIENT_INPUT_EVENT:
             self.__update_last_input(id)
 
+    def __write_counts(self, rows : list[tuple]) -> None:
+        """
+            Adds counts to their logs, creating the logs which do not exist yet
+
+            INPUT: rows
+            OUTPUT: None
+
+            @rows: List of tuples of id, data type, data and count
+        """
+
+        if not rows:
+            return
+
+        command = f"""INSERT INTO {self.table_name} (id, type, data, count) VALUES (?,?,?,?)
+                      ON CONFLICT (id, type, data) WHERE {COUNTED_WHERE}
+                      DO UPDATE SET count = count + excluded.count;"""
+        self.commit_many(command, rows)
+
+    def flush_counters(self, force : bool = False) -> None:
+        """
+            Writes the counted logs once they are due
+
+            INPUT: force
+            OUTPUT: None
+
+            @force: Write them even if the flush interval did not pass
+        """
+
+        if force or self.counters.due():
+            # Counts are put back in memory if they could not be written
+            with self.transaction():
+                self.__write_counts(self.counters.drain())
+
     # Statistics done with DB
     def get_process_count(self, id : int) -> list[tuple[str, int]]:
         """
@@ -360,63 +802,104 @@ class UserLogsORM (DBHandler):
         command = f"SELECT data, count FROM {self.table_name} WHERE type = ? AND id = ?;"
         return self.commit(command, MessageParser.CLIENT_PROCESS_OPEN, id)
     
-    def get_inactive_times(self, id : int) -> list[tuple[datetime, str]]:
+    def get_inactive_times(self, id : int, start : str = None, end : str = None) -> list[tuple[str, int]]:
         """
-            Calculates idle times of user
+            Gets idle times of user
 
-            INPUT: id
-            OUTPUT: List of Tuples of the datetime the user went idle and the time of idleness
+            INPUT: id, start, end
+            OUTPUT: List of Tuples of the datetime the user went idle and the minutes of idleness, in time order
 
             @id: Id of client
+            @start: Periods which started from this time, "%Y-%m-%d %H:%M:%S" (None from the first one)
+            @end: Periods which started before this time (None until the current one)
         """
 
-        # Check if currently inactive
-        date, inactive_time = self.__check_inactive(id)
+        command = f"SELECT start, duration FROM {INACTIVE_PERIODS_NAME} WHERE id = ?"
+        args = [id]
 
-        command = f"SELECT data FROM {self.table_name} WHERE type = ? AND id = ?;"
-        dates = self.commit(command, MessageParser.CLIENT_INACTIVE_EVENT, id)[0][0]
+        if start is not None:
+            command += " AND start >= ?"
+            args.append(start)
+        if end is not None:
+            command += " AND start < ?"
+            args.append(end)
 
-        if date:
-            dates += f"{date},{inactive_time}"
+        periods = list(self.commit(command + " ORDER BY start;", *args))
 
-        dates = dates.split("~")
-        return [i.split(",") for i in dates], True if date else False
+        # Check if currently inactive
+        date, inactive_time, _ = self.__check_inactive(id)
+        if date and (start is None or date >= start) and (end is None or date < end):
+            periods.append((date, inactive_time))
+
+        return periods
     
-    def get_wpm(self, id : int, inactive_times : list[tuple[datetime, int]], inactive_after_last : bool) -> int:
+    def get_wpm(self, id : int) -> int:
         """
             Calculates the average wpm the user does while excluding inactive times
 
-            INPUT: id, inactive
+            INPUT: id
             OUTPUT: Integer
 
             @id: Id of client
-            @inactive_times: Pre calculated inactive times of user
-            @inactive_after_last: Boolean to indicate if inactive times include time after last logged input event
         """
 
-        # Calculate total inactive time in minutes
-        if inactive_after_last:
-            inactive_times = inactive_times[:-1]
-        
-        total_inactive = sum(int(i[1]) for i in inactive_times if i != '' and len(i) > 1)
-
         # Get word count, 57 is the translation for space char in input_event in linux
         # Checks for data which has space char in it
         command = f"SELECT count FROM {self.table_name} WHERE type = ? AND data LIKE '%57%' AND id = ?;"
         words_cnt = self.commit(command, MessageParser.CLIENT_INPUT_EVENT, id)
         words_cnt = words_cnt[0][0] if words_cnt else 0  # Extract value safely
 
-        # Get first input timestamp
-        command = f"SELECT data FROM {self.table_name} WHERE type = ? AND id = ?;"
-        first_input = datetime.strptime(self.commit(command, MessageParser.CLIENT_FIRST_INPUT_EVENT, id)[0][0], "%Y-%m-%d %H:%M:%S")
-        last_input = datetime.strptime(self.commit(command, MessageParser.CLIENT_LAST_INPUT_EVENT, id)[0][0], "%Y-%m-%d %H:%M:%S")
-
         # Calculate active time in minutes
-        active_time = ((last_input - first_input).total_seconds() - total_inactive * 60) / 60
+        command = f"SELECT active FROM {ACTIVITY_NAME} WHERE id = ?;"
+        active_time = self.commit(command, id)
+        active_time = active_time[0][0] / 60 if active_time else 0
         active_time = max(active_time, 1)  # Prevent division by zero
 
         return words_cnt // active_time
     
+    def get_cpu_samples(self, id: int, start : str = None, end : str = None) -> tuple[list[str], dict[int, array]]:
+        """
+            Gets the cpu usage samples of a time window
+
+            INPUT: id, start, end
+            OUTPUT: Tuple of list of sample times and dictionary of core and its usages (array('H') in time order)
+
+            @id: Id of client
+            @start: First time of the window, "%Y-%m-%d %H:%M:%S" (None from the first sample)
+            @end: Time the window ends before (None until the last sample)
+        """
+
+        command = f"SELECT time, usage FROM {CPU_SAMPLES_NAME} WHERE id = ?"
+        args = [id]
+
+        if start is not None:
+            command += " AND time >= ?"
+            args.append(start)
+        if end is not None:
+            command += " AND time < ?"
+            args.append(end)
+
+        rows = self.commit(command + " ORDER BY time;", *args)
+        times = [row[0] for row in rows]
+
+        cores = max((len(row[1]) // 2 for row in rows), default=0)
+        if all(len(row[1]) == cores * 2 for row in rows):
+            # Samples are rows of a matrix, every core is a column of it
+            usages = array('H', b"".join(row[1] for row in rows))
+            columns = [usages[core::cores] for core in range(cores)]
+        else:
+            # Amount of cores changed, cores missing from a sample read as 0
+            columns = [array('H', bytes(len(rows) * 2)) for _ in range(cores)]
+            for index, (_, usage) in enumerate(rows):
+                for core, core_usage in enumerate(array('H', usage)):
+                    columns[core][index] = core_usage
+
+        if sys.byteorder == "big":
+            for column in columns:
+                column.byteswap()
+
+        return times, dict(enumerate(columns))
+
     def get_cpu_usage(self, id: int):
         """
             Gets all logs of cpu usage
@@ -427,29 +910,8 @@ class UserLogsORM (DBHandler):
             @id: Id of client
         """
 
-        command = f"SELECT data FROM {self.table_name} WHERE id = ? AND type = ?;"
-        cores_logs = self.commit(command, id, MessageParser.CLIENT_CPU_USAGE)[0][0]
-
-        if isinstance(cores_logs, str):
-            cores_logs = cores_logs.encode()
-
-        cores_logs = cores_logs.split(b"|")
-        logs = [log for i in cores_logs if len(i) > 1 for log in i.split(MessageParser.PROTOCOL_SEPARATOR)]
-        cpu_usage_logs = []
-        
-        core_usage = {}
-        for log in logs:
-            log = log.decode().split(",")
-            core, usage = log[:2]
-
-            if core not in core_usage:
-                core_usage[core] = []
-            core_usage[core].append(int(usage))
-            
-            if len(log) == 3:
-                cpu_usage_logs.append(log[2])
-        
-        return core_usage, cpu_usage_logs
+        times, core_usage = self.get_cpu_samples(id)
+        return {str(core): usage.tolist() for core, usage in core_usage.items()}, times
 
     def get_active_precentage(self, id: int) -> int:
         """
@@ -459,10 +921,7 @@ class UserLogsORM (DBHandler):
             OUTPUT: Integer
         """
 
-        inactive_time, _ = self.get_inactive_times(id)
-        
-        total_inactive = sum(int(i[1]) for i in inactive_time if i != '' and len(i) > 1)
-        total_active = self.__get_total_active_time(id)
+        total_active, total_inactive = self.__get_activity(id)
 
         if total_active + total_inactive == 0:
             return 100
@@ -482,6 +941,28 @@ class UserLogsORM (DBHandler):
         command = f"SELECT data, count FROM {self.table_name} WHERE id = ? AND type = ?;"
         return self.commit(command, id, MessageParser.CLIENT_IP_INTERACTION)
 
+class LogsWriterORM (UserLogsORM):
+    """
+        UserLogsORM on a connection of its own, used by a single ingest writer
+        Unlike UserLogsORM every writer gets its own instance and lock
+    """
+
+    def __new__(cls, conn, cursor, table_name: str, lock = None):
+        return DBHandler.__new__(cls)
+
+    def __init__(self, conn, cursor, table_name: str, lock = None):
+        DBHandler.__init__(self, conn, cursor, table_name, lock if lock is not None else threading.RLock())
+
+class LogsShardORM (LogsWriterORM):
+    """
+        UserLogsORM over a single shard database
+        Unlike UserLogsORM every shard gets its own instance
+    """
+
+    def __init__(self, conn, cursor, table_name: str):
+        # Shards opened by the main process share the global lock with the clients table
+        DBHandler.__init__(self, conn, cursor, table_name)
+
 class UserId (DBHandler):
 
     USER_ID_NAME = "uid"
@@ -543,6 +1024,18 @@ class UserId (DBHandler):
             @hostname: User's computer hostname
             @id: Id of client
         """
+
+        # Lookups and insert are one unit, so a client registering at the same time gets another hostname
+        with self.transaction():
+            return self.__insert_user(mac, hostname, id)
+
+    def __insert_user(self, mac: str, hostname : str, id : int) -> tuple[bool, int]:
+        """
+            Inserts a client, called inside a transaction
+
+            INPUT: mac, hostname, id
+            OUTPUT: Boolean indicating if already in use and the id of the client
+        """
         id_command = f"SELECT id FROM {self.table_name} WHERE mac = ? AND hostname = ?;"
 
         command = f"SELECT hostname FROM {self.table_name} WHERE mac = ? AND hostname = ?;"
@@ -647,4 +1140,14 @@ class UserId (DBHandler):
         """
 
         command = f"SELECT id FROM {self.table_name} WHERE hostname = ?;"
-        return self.commit(command, hostname)[0][0]
\ No newline at end of file
+        return self.commit(command, hostname)[0][0]
+
+class UserLogsReader (DBReader, UserLogsORM):
+    """
+        Statistics of UserLogsORM read from a read pool
+    """
+
+class UserIdReader (DBReader, UserId):
+    """
+        Queries of UserId read from a read pool
+    """
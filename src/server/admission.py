@@ -0,0 +1,220 @@
+#   'Silent net' admission control
+#
+#       Decides when to defer new connections and when to slow down
+#       Reading from the noisiest agents, by the ingest queue depth
+#       And by how far behind the database writer is
+#
+#   Omer Kfir (C)
+
+import threading
+from time import monotonic
+
+__author__ = "Omer Kfir"
+
+# Queue fill (fraction of its size) and writer lag (seconds) from which the server is behind
+SOFT_DEPTH = 0.5
+SOFT_LAG = 0.5
+
+# From here on new connections are deferred
+HARD_DEPTH = 0.9
+HARD_LAG = 2.0
+
+# Agents sending this many times the average rate are the noisy ones
+NOISY_FACTOR = 2.0
+MAX_READ_DELAY = 0.5 # seconds
+ACCEPT_RETRY = 0.1 # seconds
+
+RATE_WINDOW = 1.0 # seconds
+
+
+class RateMeter:
+    """
+        Logs per second over the last window
+    """
+
+    __slots__ = ("__window_start", "__window_logs", "__rate")
+
+    def __init__(self):
+        self.__window_start : float = monotonic()
+        self.__window_logs : int = 0
+        self.__rate : float = 0.0
+
+    def add(self, logs : int) -> None:
+        """
+            Counts logs, closes the window once it is over
+
+            INPUT: logs
+            OUTPUT: None
+        """
+
+        self.__window_logs += logs
+
+        now = monotonic()
+        elapsed = now - self.__window_start
+        if elapsed >= RATE_WINDOW:
+            self.__rate = self.__window_logs / elapsed
+            self.__window_start, self.__window_logs = now, 0
+
+    def rate(self) -> float:
+        """
+            Returns logs per second of the last full window
+
+            INPUT: None
+            OUTPUT: Rate
+        """
+
+        return self.__rate
+
+
+class AdmissionController:
+    """
+        Admission and backpressure decisions of the server, every decision is counted
+    """
+
+    def __init__(self, ingest):
+        """
+            Initialize the controller
+
+            INPUT: ingest
+            OUTPUT: None
+
+            @ingest -> Ingest pipeline (queue_max, depth() and writer_lag())
+        """
+
+        self.ingest = ingest
+
+        self.__lock = threading.Lock()
+        self.__rate = RateMeter()
+
+        # Counters
+        self.accept_polls_deferred : int = 0
+        self.handshakes_deferred : int = 0
+        self.handshakes_rejected : int = 0
+        self.reads_throttled : int = 0
+        self.throttle_seconds : float = 0.0
+
+    def pressure(self) -> tuple[float, float]:
+        """
+            Returns how full the ingest queue is and how far behind the writer is
+
+            INPUT: None
+            OUTPUT: Tuple of queue fill (0 - 1) and writer lag in seconds
+        """
+
+        return self.ingest.depth() / self.ingest.queue_max, self.ingest.writer_lag()
+
+    def behind(self) -> bool:
+        """ Returns whether ingest is falling behind """
+
+        fill, lag = self.pressure()
+        return fill >= SOFT_DEPTH or lag >= SOFT_LAG
+
+    def overloaded(self) -> bool:
+        """ Returns whether ingest is overloaded """
+
+        fill, lag = self.pressure()
+        return fill >= HARD_DEPTH or lag >= HARD_LAG
+
+    def admit(self) -> bool:
+        """
+            Decides whether a new connection can be served now
+
+            Every refusal is one ACCEPT_RETRY poll, so accept_polls_deferred
+            counts polls spent waiting rather than deferred connections
+
+            INPUT: None
+            OUTPUT: Boolean value, False if the connection should wait ACCEPT_RETRY and ask again
+        """
+
+        if not self.overloaded():
+            return True
+
+        with self.__lock:
+            self.accept_polls_deferred += 1
+        return False
+
+    def admit_handshake(self, unauthenticated : int, limit : int, defer : bool = True) -> bool:
+        """
+            Decides whether another connection may start its handshake
+
+            INPUT: unauthenticated, limit, defer
+            OUTPUT: Boolean value, False if the connection should wait ACCEPT_RETRY and ask again (or be closed)
+
+            @unauthenticated -> Amount of connections which did not authenticate yet
+            @limit -> Max amount of connections which did not authenticate yet
+            @defer -> Whether a refused connection waits (still in the listen backlog) or is closed
+        """
+
+        if unauthenticated < limit:
+            return True
+
+        with self.__lock:
+            if defer:
+                self.handshakes_deferred += 1
+            else:
+                self.handshakes_rejected += 1
+        return False
+
+    def record(self, logs : int) -> None:
+        """
+            Counts logs submitted by every connection
+
+            INPUT: logs
+            OUTPUT: None
+        """
+
+        with self.__lock:
+            self.__rate.add(logs)
+
+    def read_delay(self, connection_rate : float, connections : int) -> float:
+        """
+            Returns for how long to pause reading from a connection
+            Only noisy connections are paused, and only while ingest is behind
+
+            INPUT: connection_rate, connections
+            OUTPUT: Seconds (0 to keep reading)
+
+            @connection_rate -> Logs per second of the connection
+            @connections -> Amount of connected agents
+        """
+
+        if not connection_rate:
+            return 0.0
+
+        average = self.__rate.rate() / max(connections, 1)
+        if connection_rate <= average * NOISY_FACTOR:
+            return 0.0
+
+        fill, lag = self.pressure()
+        if fill < SOFT_DEPTH and lag < SOFT_LAG:
+            return 0.0
+
+        # Delay grows from nothing at the soft limits to the max at the hard limits
+        level = max((fill - SOFT_DEPTH) / (HARD_DEPTH - SOFT_DEPTH), (lag - SOFT_LAG) / (HARD_LAG - SOFT_LAG))
+        delay = MAX_READ_DELAY * min(max(level, 0.1), 1.0)
+
+        with self.__lock:
+            self.reads_throttled += 1
+            self.throttle_seconds += delay
+        return delay
+
+    def stats(self) -> dict:
+        """
+            Returns every counter along with the current ingest state
+
+            INPUT: None
+            OUTPUT: Dictionary of counter names and values
+        """
+
+        fill, lag = self.pressure()
+        return {
+            "queue_depth": self.ingest.depth(),
+            "queue_fill": round(fill, 3),
+            "writer_lag_sec": round(lag, 3),
+            "logs_per_sec": round(self.__rate.rate(), 1),
+            "accept_polls_deferred": self.accept_polls_deferred,
+            "handshakes_deferred": self.handshakes_deferred,
+            "handshakes_rejected": self.handshakes_rejected,
+            "reads_throttled": self.reads_throttled,
+            "throttle_sec": round(self.throttle_seconds, 3),
+        }
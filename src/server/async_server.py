@@ -0,0 +1,240 @@
+"""
+'Silent net' asyncio server
+
+Serves agents as coroutines on a single event loop instead of a thread per connection,
+Which lets one process hold thousands of agent connections.
+Agent ingest, manager handling and the databases are shared with server.py.
+The manager session (key exchange, database queries) runs in a worker thread
+Over the same asyncio stream so it never blocks agent ingest.
+
+Usage: python async_server.py <max_clients:int> <safety:int> <password:str>
+Omer Kfir (C)
+"""
+
+import asyncio
+import traceback
+from time import monotonic
+from concurrent.futures import ThreadPoolExecutor
+
+from server import *
+from async_protocol import AsyncClient
+
+__author__ = "Omer Kfir"
+
+
+class AsyncSilentNetServer(SilentNetServer):
+    """Server which serves every connection as a coroutine on one event loop"""
+
+    # Connections cost a coroutine and a few buffers, not a thread
+    MAX_CLIENTS_LIMIT = 10000
+
+    def __init__(self):
+        """Initialize server with default configuration"""
+        super().__init__()
+        self.loop : asyncio.AbstractEventLoop = None
+        self.stop_event : asyncio.Event = None
+
+        # Blocking views of connections served on worker threads, mapped to their connection
+        self.blocking_clients : dict[client, AsyncClient] = {}
+
+        # Blocking database calls (authentication, deletions) run on a single thread so the event loop keeps serving
+        self.db_executor : ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+
+    def run_db(self, func, *args):
+        """Run a blocking database call on the database thread, returns an awaitable"""
+        return self.loop.run_in_executor(self.db_executor, func, *args)
+
+    def _run_server(self):
+        """Run the event loop until the server is closed"""
+        try:
+            asyncio.run(self._serve())
+        except KeyboardInterrupt:
+            print("\nServer interrupted by user (Ctrl+C)\nClosing server")
+            self.proj_run = False
+        finally:
+            self._cleanup()
+
+    async def _serve(self):
+        """Accept connections until the server is closed"""
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+
+        listener = await asyncio.start_server(self._handle_stream, server.SERVER_BIND_IP, server.SERVER_BIND_PORT,
+                                              backlog=min(self.MAX_CLIENTS_LIMIT, 1024))
+
+        await self.stop_event.wait()
+        self.shutdown_report = report = ShutdownReport(self.shutdown_deadline)
+
+        with report.phase("accept"):
+            listener.close()
+            print("\nServer socket closed")
+
+        with report.phase("handlers"):
+            # Wake up every connection so its coroutine can finish
+            connections = self.registry.connections()
+            for _, client in connections:
+                client.close()
+
+            pending = ()
+            if connections:
+                _, pending = await asyncio.wait([task for task, _ in connections], timeout=report.remaining())
+
+            for task in pending:
+                task.cancel()
+
+        if pending:
+            print(f"Warning: {len(pending)} connection handlers did not finish before the shutdown deadline")
+
+        await listener.wait_closed()
+
+    async def _handle_stream(self, reader, writer):
+        """Register a new connection and serve it"""
+        client = AsyncClient(reader, writer)
+
+        # The connection was already accepted, so past the cap of connections in their handshake it is closed
+        # Instead of waiting where nothing would bound or time it out
+        if self.stop_event.is_set() or \
+           not self.admission.admit_handshake(self.registry.unauthenticated(), self.MAX_UNAUTHENTICATED, defer=False):
+            client.close()
+            return
+
+        self.registry.add(client, asyncio.current_task())
+        self._start_handshake(client)
+
+        try:
+            # Connections are not served while ingest is overloaded, their handshake deadline keeps running
+            deadline = monotonic() + self.HANDSHAKE_DEADLINE
+            while not self.admission.admit():
+                if self.stop_event.is_set() or monotonic() >= deadline:
+                    return
+
+                await asyncio.sleep(ACCEPT_RETRY)
+
+            await self._handle_client_connection(client)
+        except Exception as e:
+            print(f"Error serving client: {e}")
+            print(traceback.format_exc())
+        finally:
+            self._remove_disconnected_client(client)
+
+    async def _handle_client_connection(self, client : AsyncClient):
+        """Determine client type and route to appropriate handler"""
+        data = await client.protocol_recv(MessageParser.PROTOCOL_DATA_INDEX, decrypt=False, decompress=False)
+        if data == b'' or data == b'ERR' or data[0].decode() == MessageParser.MANAGER_CHECK_CONNECTION:
+            return
+
+        msg_type = data[0].decode()
+        msg = data[1] if len(data) > 1 else b''
+
+        if msg_type == MessageParser.CLIENT_MSG_AUTH:
+            if len(self.registry) >= self.max_clients:
+                return
+
+            await self._handle_employee_connection(client, msg)
+
+        elif msg_type in (MessageParser.MANAGER_MSG_PASSWORD, MessageParser.MANAGER_RESUME_SESSION):
+            if self.managers_connected >= self.MAX_MANAGERS:
+                await client.protocol_send(MessageParser.MANAGER_ALREADY_CONNECTED, encrypt=False)
+                return
+
+            # Manager is served by the blocking handlers of server.py on a worker thread
+            blocking = client.to_blocking()
+            self.blocking_clients[blocking] = client
+
+            try:
+                await asyncio.to_thread(self._determine_client_type, blocking, msg_type, msg)
+            finally:
+                del self.blocking_clients[blocking]
+
+    def _authenticated(self, client):
+        """Client passed its handshake, managers authenticate on the blocking view of their connection"""
+        super()._authenticated(self.blocking_clients.get(client, client))
+
+    async def _handle_employee_connection(self, client : AsyncClient, msg):
+        """Handle employee authentication and connection"""
+        try:
+            mac, hostname = MessageParser.protocol_message_deconstruct(msg)
+            mac, hostname = mac.decode(), hostname.decode()
+            logged, id = await self.run_db(self.uid_data_base.insert_data, mac, hostname)
+
+            client.set_address(mac)
+            if not logged:
+                await self.run_db(self.log_data_base.client_setup_db, id)
+
+            handler = AsyncClientHandler(self, client, id)
+
+        except Exception:
+            print(f"Rejecting client {client.get_ip()} due to invalid authentication")
+            client.close()
+            return
+
+        await handler.process_data()
+
+    def quit_server(self):
+        """Shut down the server gracefully"""
+        self.proj_run = False
+
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stop_event.set)
+
+    def _stop_connections(self, report):
+        """Connections were already stopped on the event loop, only database calls may still run"""
+        with report.phase("database calls"):
+            self.db_executor.shutdown(wait=True)
+
+
+class AsyncClientHandler(ClientHandler):
+    """Handles communication with an employee client as a coroutine"""
+
+    __slots__ = ()
+
+    async def process_data(self):
+        """Process data received from employee client"""
+        print(f"\nEmployee connected: {self.client.get_ip()}")
+        self._watch_liveness()
+
+        while self.server.proj_run:
+            try:
+                data = await self.client.protocol_recv(MessageParser.PROTOCOL_DATA_INDEX, decrypt=False, decompress=False)
+
+                if data == b'' or len(data) != 2:
+                    break
+
+                # A batch message is ingested as one unit
+                if data[0].decode() == MessageParser.CLIENT_MSG_BATCH:
+                    records = MessageParser.protocol_batch_deconstruct(data[1])
+                else:
+                    records = [data]
+
+                self._count_messages(len(records))
+                logs, valid = self._collect_logs(records)
+
+                # Only wait on a thread when the ingest queue is full, the event loop must not block
+                if logs and not self.server.ingest.submit(self.id, logs, block=False):
+                    await asyncio.to_thread(self.server.ingest.submit, self.id, logs)
+
+                if logs:
+                    delay = self._read_delay()
+                    if delay:
+                        await asyncio.sleep(delay)
+
+                if not valid and await self.server.run_db(self._handle_unsafe_message):
+                    break
+
+            except Exception as e:
+                print(f"Error from client {self.client.get_address()}: {e}")
+                print(traceback.format_exc())
+                if await self.server.run_db(self._handle_unsafe_message):
+                    break
+
+        self._cleanup_disconnection()
+
+
+def main():
+    """Main entry point for the asyncio server"""
+    server = AsyncSilentNetServer()
+    server.start()
+
+
+if __name__ == "__main__":
+    main()
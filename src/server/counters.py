@@ -0,0 +1,146 @@
+#   'Silent net' log counters
+#
+#       Counted logs (processes, input events, reached out ips) are
+#       Added up in memory and written as one upsert per flush
+#       Instead of a select and an update for every log
+#
+#   Omer Kfir (C)
+
+from collections import OrderedDict
+from time import monotonic
+
+__author__ = "Omer Kfir"
+
+COUNTERS_MAX = 10000 # Distinct (id, type, data) keys kept in memory
+COUNTERS_FLUSH_INTERVAL = 0.5 # seconds
+EVICT_FRACTION = 0.25 # Part of the counters written once they are full
+
+
+class CounterAggregator:
+    """
+        Bounded table of (id, type, data) -> count not written yet
+        Changes made inside a batch can be taken back if the batch was not committed
+        Used by a single writer thread, it is not thread safe
+    """
+
+    def __init__(self, max_entries : int = COUNTERS_MAX, flush_interval : float = COUNTERS_FLUSH_INTERVAL):
+        """
+            Initialize an empty table
+
+            INPUT: max_entries, flush_interval
+            OUTPUT: None
+
+            @max_entries -> Max amount of keys, the least recently counted ones are evicted past it
+            @flush_interval -> Max seconds a count waits before the whole table is due
+        """
+
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+
+        # Least recently counted first
+        self.__counts : OrderedDict = OrderedDict()
+        self.__last_flush : float = monotonic()
+
+        # Changes of the open batch, None while there is none
+        self.__added : list = None # (key, count) counted in the batch
+        self.__removed : list = [] # Rows evicted or drained in the batch
+
+    def __len__(self) -> int:
+        return len(self.__counts)
+
+    def add(self, id : int, data_type : str, data, count : int = 1) -> None:
+        """
+            Counts a log
+
+            INPUT: id, data_type, data, count
+            OUTPUT: None
+        """
+
+        key = (id, data_type, data)
+        counts = self.__counts
+
+        counts[key] = counts.get(key, 0) + count
+        counts.move_to_end(key)
+
+        if self.__added is not None:
+            self.__added.append((key, count))
+
+    def full(self) -> bool:
+        """ Returns whether the table reached its max amount of keys """
+
+        return len(self.__counts) >= self.max_entries
+
+    def due(self) -> bool:
+        """ Returns whether the flush interval passed since the last full flush """
+
+        return monotonic() - self.__last_flush >= self.flush_interval
+
+    def evict(self) -> list[tuple]:
+        """
+            Removes the least recently counted keys, hot keys keep adding up in memory
+
+            INPUT: None
+            OUTPUT: List of tuples of id, data type, data and count
+        """
+
+        amount = min(max(int(len(self.__counts) * EVICT_FRACTION), 1), len(self.__counts))
+
+        rows = []
+        for _ in range(amount):
+            key, count = self.__counts.popitem(last=False)
+            rows.append((*key, count))
+
+        if self.__added is not None:
+            self.__removed.extend(rows)
+
+        return rows
+
+    def drain(self) -> list[tuple]:
+        """
+            Removes every key
+
+            INPUT: None
+            OUTPUT: List of tuples of id, data type, data and count
+        """
+
+        rows = [(*key, count) for key, count in self.__counts.items()]
+        self.__counts.clear()
+        self.__last_flush = monotonic()
+
+        if self.__added is not None:
+            self.__removed.extend(rows)
+
+        return rows
+
+    def begin(self) -> None:
+        """ Starts a batch, its changes are kept until commit or rollback """
+
+        self.__added, self.__removed = [], []
+
+    def commit(self) -> None:
+        """ Ends the batch, its counts were written or still wait in memory """
+
+        self.__added, self.__removed = None, []
+
+    def rollback(self) -> None:
+        """
+            Ends the batch and takes it back
+            Rows it removed are put back, since they were not written, and counts it added are removed
+
+            INPUT: None
+            OUTPUT: None
+        """
+
+        added, removed = self.__added or [], self.__removed
+        self.__added, self.__removed = None, []
+
+        for id, data_type, data, count in removed:
+            self.add(id, data_type, data, count)
+
+        counts = self.__counts
+        for key, count in added:
+            left = counts.get(key, 0) - count
+            if left > 0:
+                counts[key] = left
+            else:
+                counts.pop(key, None)
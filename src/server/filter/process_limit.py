@@ -1,14 +1,18 @@
 import time
-from collections import OrderedDict
 
 TIME_LIMIT = 3 # seconds
 MAX_PROCESSES = 1000 # Max amount of processes
 
 class ProcessDebouncer:
+    __slots__ = ("time_limit", "max_processes", "cache")
+
     def __init__(self, time_limit=TIME_LIMIT, max_processes=MAX_PROCESSES):
         self.time_limit : int = time_limit
         self.max_processes : int = max_processes
-        self.cache : OrderedDict = OrderedDict()
+
+        # Process name -> last time it was logged, oldest first
+        # Only processes logged within the time limit are kept, older ones would be logged anyway
+        self.cache : dict = {}
 
     def should_log(self, process_name : str) -> bool:
         """
@@ -19,21 +23,23 @@ class ProcessDebouncer:
 
             @process_name: The name of the process to check
         """
-        cur_time = time.time()
-        
-        if process_name in self.cache:
-            last_time = self.cache[process_name]
-
-            if cur_time - last_time < self.time_limit:
-                return False
-            
-            # Signal that the process has been used
-            # Therefore when we would remove processes to reduce weight
-            # This process is unlikely to be removed
-            self.cache.move_to_end(process_name)
-        
-        self.cache[process_name] = cur_time
-        if len(self.cache) > self.max_processes:
-            self.cache.popitem(last=False)
-        
-        return True
\ No newline at end of file
+        cur_time = time.monotonic()
+        cache = self.cache
+
+        last_time = cache.get(process_name)
+        if last_time is not None and cur_time - last_time < self.time_limit:
+            return False
+
+        # Logged again, so it moves to the end of the cache
+        cache.pop(process_name, None)
+
+        # Forget processes whose time limit is over, they are at the start of the cache
+        while cache:
+            oldest = next(iter(cache))
+            if cur_time - cache[oldest] < self.time_limit and len(cache) < self.max_processes:
+                break
+
+            del cache[oldest]
+
+        cache[process_name] = cur_time
+        return True
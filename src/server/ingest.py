@@ -0,0 +1,305 @@
+#   'Silent net' ingest pipeline
+#
+#       Connection handlers push parsed logs into a bounded queue
+#       A single writer thread drains it and applies the logs
+#       In large transactions, flushing by batch size or time
+#
+#   Omer Kfir (C)
+
+import queue
+import threading
+from time import monotonic
+
+__author__ = "Omer Kfir"
+
+INGEST_QUEUE_MAX = 10000 # Queued submissions, each is one or more logs of a client
+BATCH_MAX_LOGS = 2000
+FLUSH_INTERVAL = 0.2 # seconds
+STOP_GRACE = 1 # seconds a writer past the stop timeout gets to finish its batch
+
+
+class IngestPipeline:
+    """
+        Bounded queue of client logs with a single batched database writer
+    """
+
+    def __init__(self, log_data_base, queue_max : int = INGEST_QUEUE_MAX,
+                 batch_max : int = BATCH_MAX_LOGS, flush_interval : float = FLUSH_INTERVAL):
+        """
+            Initialize the pipeline, the writer starts with start()
+
+            INPUT: log_data_base, queue_max, batch_max, flush_interval
+            OUTPUT: None
+
+            @log_data_base -> UserLogsORM logs are written to
+            @queue_max -> Max amount of queued submissions, submit blocks when full
+            @batch_max -> Max amount of logs written in one transaction
+            @flush_interval -> Max seconds a log waits before its batch is written
+        """
+
+        self.log_data_base = log_data_base
+        self.queue_max = queue_max
+        self.batch_max = batch_max
+        self.flush_interval = flush_interval
+
+        self.__queue : queue.Queue = queue.Queue(queue_max)
+        self.__writer : threading.Thread = None
+
+        # Queued submissions of every client
+        self.__pending : dict[int, int] = {}
+        self.__pending_lock : threading.Lock = threading.Lock()
+
+        # Set when the shutdown deadline passed, the writer stops after its current batch
+        self.__abandon : bool = False
+
+        # Queue time of the oldest log not written yet, None while the writer is idle
+        self.__oldest : float = None
+
+        # Counters, only updated by the writer
+        self.logs_written : int = 0
+        self.batches_written : int = 0
+
+    def start(self) -> None:
+        """
+            Starts the writer thread
+
+            INPUT: None
+            OUTPUT: None
+        """
+
+        self.__writer = threading.Thread(target=self.__write_loop, name="ingest-writer", daemon=True)
+        self.__writer.start()
+
+    def submit(self, id : int, logs : list[tuple[str, bytes]], block : bool = True, timeout : float = None) -> bool:
+        """
+            Queues logs of a client to be written
+
+            INPUT: id, logs, block, timeout
+            OUTPUT: Boolean value which indicates whether the logs were queued
+
+            @id -> Id of client
+            @logs -> List of tuples of data type and data
+            @block -> Whether to wait for room in the queue
+            @timeout -> Max seconds to wait for room (None to wait forever)
+        """
+
+        with self.__pending_lock:
+            self.__pending[id] = self.__pending.get(id, 0) + 1
+
+        try:
+            self.__queue.put((id, logs, monotonic()), block, timeout)
+            return True
+        except queue.Full:
+            self.__done(id)
+            return False
+
+    def __done(self, id : int) -> None:
+        """
+            Uncounts a queued submission of a client
+
+            INPUT: id
+            OUTPUT: None
+        """
+
+        with self.__pending_lock:
+            pending = self.__pending.get(id, 0) - 1
+            if pending > 0:
+                self.__pending[id] = pending
+            else:
+                self.__pending.pop(id, None)
+
+    def pending(self, id : int) -> int:
+        """
+            Returns the amount of queued submissions of a client
+
+            INPUT: id
+            OUTPUT: Amount of submissions not written yet
+        """
+
+        return self.__pending.get(id, 0)
+
+    def depth(self) -> int:
+        """
+            Returns the amount of queued submissions
+
+            INPUT: None
+            OUTPUT: Queue depth
+        """
+
+        return self.__queue.qsize()
+
+    def writer_lag(self) -> float:
+        """
+            Returns for how long the oldest log not written yet has been waiting
+
+            INPUT: None
+            OUTPUT: Seconds
+        """
+
+        oldest = self.__oldest
+        return monotonic() - oldest if oldest is not None else 0.0
+
+    def flush(self) -> None:
+        """
+            Waits until everything queued before the call was written, logs queued meanwhile are not waited for
+            Called before deleting logs so queued logs of a deleted client are not written after it
+
+            INPUT: None
+            OUTPUT: None
+        """
+
+        writer = self.__writer
+        if writer is None or not writer.is_alive():
+            return
+
+        # The writer sets the marker once the logs before it and every count are written
+        marker = threading.Event()
+        self.__queue.put(marker)
+
+        while not marker.wait(self.flush_interval):
+            if not writer.is_alive():
+                return
+
+    def stop(self, timeout : float = None) -> int:
+        """
+            Writes everything still queued and stops the writer
+            Once the timeout passes the writer stops after the batch it is writing
+            A writer which does not stop within STOP_GRACE is left running
+
+            INPUT: timeout
+            OUTPUT: Amount of submissions which were not written
+
+            @timeout -> Max seconds to wait for the queue to drain (None to wait forever)
+        """
+
+        if self.__writer is None:
+            return 0
+
+        deadline = monotonic() + timeout if timeout is not None else None
+        try:
+            self.__queue.put(None, timeout=timeout)
+            self.__writer.join(max(deadline - monotonic(), 0) if deadline is not None else None)
+        except queue.Full:
+            pass
+
+        if self.__writer.is_alive():
+            self.__abandon = True
+
+            # A writer waiting for submissions wakes up on the stop marker
+            try:
+                self.__queue.put_nowait(None)
+            except queue.Full:
+                pass
+
+            self.__writer.join(STOP_GRACE)
+            if self.__writer.is_alive():
+                print(f"Warning: {self.__writer.name} is still running after the shutdown deadline")
+
+        self.__writer = None
+        with self.__pending_lock:
+            return sum(self.__pending.values())
+
+    def __next_batch(self) -> tuple[list, bool, threading.Event]:
+        """
+            Collects submissions until the batch is full, the flush interval passed or a flush marker came
+
+            INPUT: None
+            OUTPUT: Tuple of list of submissions, whether the writer was told to stop and the flush marker ending the batch (None if none)
+        """
+
+        batch = []
+        logs = 0
+
+        # Wait for the first submission without a deadline, an idle writer has nothing to flush
+        item = self.__queue.get()
+        deadline = monotonic() + self.flush_interval
+
+        while True:
+            if item is None:
+                self.__queue.task_done()
+                return batch, True, None
+
+            if isinstance(item, threading.Event):
+                self.__queue.task_done()
+                return batch, False, item
+
+            # The queue is in order, so the first log of a batch is the oldest not written
+            if not batch:
+                self.__oldest = item[2]
+
+            batch.append(item)
+            logs += len(item[1])
+            if logs >= self.batch_max:
+                return batch, False, None
+
+            try:
+                item = self.__queue.get(timeout=max(deadline - monotonic(), 0))
+            except queue.Empty:
+                return batch, False, None
+
+    def __write_loop(self) -> None:
+        """
+            Writer thread, applies batches until told to stop
+
+            INPUT: None
+            OUTPUT: None
+        """
+
+        stop = False
+        while not stop and not self.__abandon:
+            batch, stop, marker = self.__next_batch()
+            if not batch:
+                if marker is not None:
+                    self.__write_counters(True)
+                    marker.set()
+                continue
+
+            written = 0
+            try:
+                with self.log_data_base.transaction():
+                    for id, logs, _ in batch:
+                        # Past the shutdown deadline the rest of the batch is dropped, what was applied is committed
+                        if self.__abandon:
+                            break
+
+                        for data_type, data in logs:
+                            self.log_data_base.insert_data(id, data_type, data)
+                        written += 1
+
+                self.logs_written += sum(len(logs) for _, logs, _ in batch[:written])
+                self.batches_written += 1
+            except Exception as e:
+                print(f"Error writing logs batch: {e}")
+                written = len(batch)
+            finally:
+                # Counts are written when due, before a flush returns, and whenever the writer is about to go idle
+                # So readers of an idle server see every log
+                self.__write_counters(marker is not None or self.__queue.empty())
+
+                self.__oldest = None
+                for index, (id, _, _) in enumerate(batch):
+                    if index < written:
+                        self.__done(id)
+                    self.__queue.task_done()
+
+                if marker is not None:
+                    marker.set()
+
+        # Counts still in memory are written before the writer exits, also past the shutdown deadline
+        self.__write_counters(True)
+
+    def __write_counters(self, force : bool) -> None:
+        """
+            Writes the counted logs in a transaction of their own, so a failed batch does not lose them
+
+            INPUT: force
+            OUTPUT: None
+
+            @force -> Write them even if they are not due yet
+        """
+
+        try:
+            with self.log_data_base.transaction():
+                self.log_data_base.flush_counters(force)
+        except Exception as e:
+            print(f"Error writing log counts: {e}")
@@ -0,0 +1,196 @@
+#   'Silent net' connection registry
+#
+#       Connections of the server and the agents behind them
+#       With throughput stats of every agent
+#
+#   Omer Kfir (C)
+
+import threading
+from time import time
+
+from admission import RateMeter
+
+__author__ = "Omer Kfir"
+
+
+class ConnectionStats:
+    """
+        Throughput of a connected agent
+    """
+
+    __slots__ = ("id", "client", "connected_at", "last_seen", "messages", "meter")
+
+    def __init__(self, id : int, client):
+        self.id : int = id
+        self.client = client
+        self.connected_at : float = time()
+        self.last_seen : float = self.connected_at
+        self.messages : int = 0
+
+        # Messages per second, also used to find the noisy agents
+        self.meter : RateMeter = RateMeter()
+
+    def seen(self, messages : int) -> None:
+        """
+            Counts messages received from the agent
+
+            INPUT: messages
+            OUTPUT: None
+        """
+
+        self.messages += messages
+        self.meter.add(messages)
+        self.last_seen = time()
+
+    def snapshot(self, queued : int = 0) -> dict:
+        """
+            Returns the stats as a dictionary
+
+            INPUT: queued
+            OUTPUT: Dictionary of stat names and values
+
+            @queued -> Submissions of the agent waiting in the ingest queue
+        """
+
+        bytes_in, bytes_out = self.client.get_traffic()
+        return {
+            "bytes_in": bytes_in,
+            "bytes_out": bytes_out,
+            "messages": self.messages,
+            "messages_per_sec": round(self.meter.rate(), 1),
+            "connected_at": int(self.connected_at),
+            "last_seen": int(self.last_seen),
+            "queued": queued,
+        }
+
+
+class ConnectionRegistry:
+    """
+        Open connections keyed by their client object, connected agents keyed by their id
+        Connections which did not authenticate yet are kept apart and are not counted by len()
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+
+        self.__connections : dict = {} # Client object -> thread / task serving it
+        self.__unauthenticated : set = set()
+        self.__agents : dict[int, ConnectionStats] = {}
+
+    def __len__(self) -> int:
+        return len(self.__connections) - len(self.__unauthenticated)
+
+    def add(self, client, task, authenticated : bool = False) -> None:
+        """
+            Registers a new connection
+
+            INPUT: client, task, authenticated
+            OUTPUT: None
+
+            @client -> Client object of the connection
+            @task -> Thread or task serving it
+            @authenticated -> Whether the connection already authenticated
+        """
+
+        with self.__lock:
+            self.__connections[client] = task
+            if not authenticated:
+                self.__unauthenticated.add(client)
+
+    def authenticate(self, client) -> None:
+        """
+            Counts a connection once it authenticated
+
+            INPUT: client
+            OUTPUT: None
+        """
+
+        with self.__lock:
+            self.__unauthenticated.discard(client)
+
+    def unauthenticated(self) -> int:
+        """ Returns the amount of connections which did not authenticate yet """
+
+        return len(self.__unauthenticated)
+
+    def remove(self, client) -> bool:
+        """
+            Removes a connection
+
+            INPUT: client
+            OUTPUT: Boolean value which indicates whether the connection was registered
+        """
+
+        with self.__lock:
+            self.__unauthenticated.discard(client)
+            return self.__connections.pop(client, None) is not None
+
+    def connections(self) -> list[tuple]:
+        """
+            Returns a copy of the open connections, authenticated or not
+
+            INPUT: None
+            OUTPUT: List of tuples of thread / task and client object
+        """
+
+        with self.__lock:
+            return [(task, client) for client, task in self.__connections.items()]
+
+    def connect_agent(self, id : int, client) -> ConnectionStats:
+        """
+            Marks an agent as connected
+
+            INPUT: id, client
+            OUTPUT: Stats of the agent's connection
+
+            @id -> Id of client
+            @client -> Client object of the agent
+        """
+
+        stats = ConnectionStats(id, client)
+        with self.__lock:
+            self.__agents[id] = stats
+
+        return stats
+
+    def disconnect_agent(self, id : int, stats : ConnectionStats = None) -> None:
+        """
+            Marks an agent as disconnected
+
+            INPUT: id, stats
+            OUTPUT: None
+
+            @id -> Id of client
+            @stats -> Stats returned when it connected, a newer connection of the same agent is kept
+        """
+
+        with self.__lock:
+            if stats is None or self.__agents.get(id) is stats:
+                self.__agents.pop(id, None)
+
+    def is_connected(self, id : int) -> bool:
+        """ Returns whether an agent is connected """
+
+        return id in self.__agents
+
+    def agents(self) -> int:
+        """ Returns the amount of connected agents """
+
+        return len(self.__agents)
+
+    def agent_stats(self, id : int, ingest = None):
+        """
+            Returns the stats of a connected agent
+
+            INPUT: id, ingest
+            OUTPUT: Dictionary of stats (None if the agent is not connected)
+
+            @id -> Id of client
+            @ingest -> Ingest pipeline to read the agent's queued submissions from
+        """
+
+        stats = self.__agents.get(id)
+        if stats is None:
+            return None
+
+        return stats.snapshot(ingest.pending(id) if ingest is not None else 0)
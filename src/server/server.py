@@ -11,11 +11,13 @@ import sys
 import threading
 import os
 import json
-from time import sleep
+from time import sleep, time
 from random import uniform
 from keyboard import on_press_key
 from socket import timeout
 import traceback
+import secrets
+from contextlib import contextmanager
 
 # Append parent directory to be able to import protocol
 path = os.path.dirname(__file__)
@@ -24,9 +26,19 @@ sys.path.append(os.path.abspath(os.path.join(path, '../shared')))
 from protocol import *
 from DB import *
 from filter import process_limit
+from session_tickets import SessionTicketCache
+from ingest import IngestPipeline
+from admission import AdmissionController, ACCEPT_RETRY
+from registry import ConnectionRegistry, ConnectionStats
+from timer_wheel import TimerWheel
+from shutdown import ShutdownReport
 
 __author__ = "Omer Kfir"
 
+# Environment variables which override the timing constants of the server
+LIVENESS_TIMEOUT_ENV = "SILENTNET_LIVENESS_TIMEOUT"
+SHUTDOWN_DEADLINE_ENV = "SILENTNET_SHUTDOWN_DEADLINE"
+
 
 class SilentNetServer:
     """
@@ -37,26 +49,57 @@ class SilentNetServer:
     - Server configuration
     """
 
+    # Every connection is served by its own thread
+    MAX_CLIENTS_LIMIT = 40
+
+    # Seconds without a message before an employee is considered offline, overridden by LIVENESS_TIMEOUT_ENV
+    LIVENESS_TIMEOUT = 50
+
+    # Managers which may be connected at once
+    MAX_MANAGERS = 4
+
+    # Connections which did not authenticate yet, they do not count toward max clients
+    MAX_UNAUTHENTICATED = 64
+
+    # Seconds a connection has to authenticate in, however slowly it sends
+    HANDSHAKE_DEADLINE = 5
+
+    # Seconds the shutdown may take, queued logs which were not written by then are lost, overridden by SHUTDOWN_DEADLINE_ENV
+    SHUTDOWN_DEADLINE = 10
+
     def __init__(self):
         """Initialize server with default configuration"""
         self.max_clients : int = 5
         self.safety : int = 5
+        self.default_max_clients : int = 5
+        self.default_safety : int = 5
         self.password : str = "itzik"
         self.proj_run : bool = True
-        self.manager_connected : bool = False
-        self.clients_connected : list[threading.Thread, client] = []  # List of (thread object, client object)
-        self.ids_connected : list[int] = []  # List of ids of connected clients
-        self.ids_lock : threading.Lock = threading.Lock()
+        self.managers_connected : int = 0
+        self.managers_lock : threading.Lock = threading.Lock()
+        self.registry : ConnectionRegistry = ConnectionRegistry()  # Open connections and connected clients
+        self.liveness : TimerWheel = TimerWheel()  # Deadlines of connected employees
+        self.liveness_timeout : float = self.LIVENESS_TIMEOUT
+        self.shutdown_deadline : float = self.SHUTDOWN_DEADLINE
+        self.shutdown_report : ShutdownReport = None
         self.clients_recv_event : threading.Event = threading.Event()
         self.clients_recv_lock : threading.Lock = threading.Lock()
         self.log_data_base : UserLogsORM = None
         self.uid_data_base : UserId = None
+        self.ingest_data_base : UserLogsORM = None  # Connection logs are written on
+        self.read_pools : list[ReadPool] = []
+        self.logs_reader : UserLogsORM = None  # Manager queries run on read only connections
+        self.uid_reader : UserId = None
+        self.ingest : IngestPipeline = None
+        self.admission : AdmissionController = None
         self.server_comm : server = None
+        self.session_tickets : SessionTicketCache = SessionTicketCache()
 
     def start(self):
         """Start the server with configured settings"""
         self._load_configuration()
         self._initialize_databases()
+        self.liveness.start()
         self._setup_keyboard_shortcuts()
         self._run_server()
 
@@ -66,10 +109,10 @@ class SilentNetServer:
         """Load server configuration from command line or use defaults"""
         if len(sys.argv) == 4:
             if sys.argv[1].isnumeric() and sys.argv[2].isnumeric():
-                if 1 <= int(sys.argv[1]) <= 40:
+                if 1 <= int(sys.argv[1]) <= self.MAX_CLIENTS_LIMIT:
                     self.max_clients = int(sys.argv[1])
                 else:
-                    print("Warning: Max clients must be between 1 and 40")
+                    print(f"Warning: Max clients must be between 1 and {self.MAX_CLIENTS_LIMIT}")
                     print("Using default value instead")
 
                 if 1 <= int(sys.argv[2]) <= 5:
@@ -84,11 +127,48 @@ class SilentNetServer:
                 print("Using default values instead")
         else:
             print("Using default configuration values")
-            print("Usage: python server.py <max_clients:int> <safety:int> <password:str>\n\n")
+            print(f"Usage: python {os.path.basename(sys.argv[0])} <max_clients:int> <safety:int> <password:str>")
+            print(f"Optional environment: {LIVENESS_TIMEOUT_ENV}=<seconds:float> {SHUTDOWN_DEADLINE_ENV}=<seconds:float>\n\n")
+
+        # Manager's settings only last for its session
+        self.default_max_clients, self.default_safety = self.max_clients, self.safety
+
+        # Timings are read from the environment, they are rarely changed and would clash with the optional shards argument
+        self.liveness_timeout = self._load_seconds(LIVENESS_TIMEOUT_ENV, self.LIVENESS_TIMEOUT)
+        self.shutdown_deadline = self._load_seconds(SHUTDOWN_DEADLINE_ENV, self.SHUTDOWN_DEADLINE)
 
         print(f"Server running with configuration:\nMax clients: {self.max_clients}\n"
-              f"Safety: {self.safety}\nPassword: {self.password}\n\n"
-              "Press 'q' to quit server\nPress 'e' to erase all logs\n")
+              f"Safety: {self.safety}\nPassword: {self.password}\n"
+              f"Liveness timeout: {self.liveness_timeout}s\nShutdown deadline: {self.shutdown_deadline}s\n\n"
+              "Press 'q' to quit server\nPress 'e' to erase all logs\nPress 's' to show ingest stats\n")
+
+    @staticmethod
+    def _load_seconds(name : str, default : float) -> float:
+        """
+            Reads a positive amount of seconds from an environment variable
+
+            INPUT: name, default
+            OUTPUT: Seconds in the variable, default if it is not set or not valid
+
+            @name -> Name of the environment variable
+            @default -> Seconds used when the variable is not set
+        """
+
+        value = os.environ.get(name)
+        if value is None:
+            return default
+
+        try:
+            seconds = float(value)
+        except ValueError:
+            seconds = 0
+
+        if 0 < seconds < float("inf"):
+            return seconds
+
+        print(f"Warning: {name} must be a positive amount of seconds")
+        print("Using default value instead")
+        return default
 
     def _initialize_databases(self):
         """Initialize database connections"""
@@ -99,10 +179,29 @@ class SilentNetServer:
         self.log_data_base = UserLogsORM(conn1, cursor1, UserLogsORM.USER_LOGS_NAME)
         self.uid_data_base = UserId(conn2, cursor2, UserId.USER_ID_NAME)
 
+        # With WAL the writer gets a connection of its own, so its batches do not wait for the global lock
+        if DBHandler.WAL:
+            conn3, cursor3 = DBHandler.connect_DB(db_path)
+            self.ingest_data_base = LogsWriterORM(conn3, cursor3, UserLogsORM.USER_LOGS_NAME)
+        else:
+            self.ingest_data_base = self.log_data_base
+
+        # Client logs are written by a single batching writer, handlers only queue them
+        self.ingest = IngestPipeline(self.ingest_data_base)
+        self.ingest.start()
+
+        self.admission = AdmissionController(self.ingest)
+
+        # Managers read from their own connections so their queries do not wait for ingest
+        self.read_pools = [ReadPool(db_path)]
+        self.logs_reader = UserLogsReader(self.read_pools[0], UserLogsORM.USER_LOGS_NAME)
+        self.uid_reader = UserIdReader(self.read_pools[0], UserId.USER_ID_NAME)
+
     def _setup_keyboard_shortcuts(self):
         """Setup keyboard shortcuts for server control"""
         on_press_key('q', lambda _: self.quit_server())
         on_press_key('e', lambda _: self.erase_all_logs())
+        on_press_key('s', lambda _: self.print_stats())
 
     def _run_server(self):
         """Main server loop to accept and handle client connections"""
@@ -118,19 +217,26 @@ class SilentNetServer:
         try:
             while self.proj_run:
                 try:
-                    if len(self.clients_connected) < self.max_clients or not self.manager_connected:
+                    if len(self.registry) < self.max_clients or self.managers_connected < self.MAX_MANAGERS:
+                        # Connections wait in the listen backlog while ingest is overloaded
+                        # Or while too many connections are still in their handshake
+                        if not self.admission.admit() or \
+                           not self.admission.admit_handshake(self.registry.unauthenticated(), self.MAX_UNAUTHENTICATED):
+                            sleep(ACCEPT_RETRY)
+                            continue
+
                         client = self.server_comm.recv_client()
-                        client_thread = threading.Thread(target=self._handle_client_connection, args=(client,))
-                        
-                        with self.clients_recv_lock:
-                            self.clients_connected.append((client_thread, client))
+                        client_thread = threading.Thread(target=self._handle_client_connection, args=(client,), daemon=True)
                         
+                        self.registry.add(client, client_thread)
+                        self._start_handshake(client)
                         client_thread.start()
-                        
-                        if len(self.clients_connected) >= self.max_clients:
-                            self.clients_recv_event.clear()
                     else:
-                        self.clients_recv_event.wait()
+                        with self.clients_recv_lock:
+                            self.clients_recv_event.clear()
+
+                        # Set again when a client disconnects, the timeout covers a missed wake up
+                        self.clients_recv_event.wait(1)
                 except timeout:
                     pass
                 except OSError:
@@ -155,25 +261,37 @@ class SilentNetServer:
             return
 
         msg_type = data[0].decode()
-        if len(self.clients_connected) > self.max_clients and msg_type == MessageParser.CLIENT_MSG_AUTH:
+        if len(self.registry) >= self.max_clients and msg_type == MessageParser.CLIENT_MSG_AUTH:
             self._remove_disconnected_client(client)
             return
 
-        if msg_type == MessageParser.MANAGER_MSG_PASSWORD and self.manager_connected:
+        manager_msg = msg_type in (MessageParser.MANAGER_MSG_PASSWORD, MessageParser.MANAGER_RESUME_SESSION)
+        if manager_msg and self.managers_connected >= self.MAX_MANAGERS:
             client.protocol_send(MessageParser.MANAGER_ALREADY_CONNECTED, encrypt=False)
             self._remove_disconnected_client(client)
             return
 
-        if self._determine_client_type(client, msg_type, data[1] if len(data) > 1 else b''):
-            self.manager_connected = False
+        self._determine_client_type(client, msg_type, data[1] if len(data) > 1 else b'')
 
         if self.proj_run:
             self._remove_disconnected_client(client)
 
+    def _start_handshake(self, client):
+        """Give a new connection until the handshake deadline to authenticate"""
+        client.set_timeout(self.HANDSHAKE_DEADLINE)
+        self.liveness.schedule(client, self.HANDSHAKE_DEADLINE, client.shutdown)
+
+    def _authenticated(self, client):
+        """Client passed its handshake, it now counts toward max clients"""
+        self.liveness.cancel(client)
+        self.registry.authenticate(client)
+
     def _determine_client_type(self, client, msg_type, msg):
         """Determine if client is manager or employee and handle accordingly"""
         if msg_type == MessageParser.MANAGER_MSG_PASSWORD:
             return self._handle_manager_connection(client, msg)
+        elif msg_type == MessageParser.MANAGER_RESUME_SESSION:
+            return self._handle_manager_resume(client, msg)
         elif msg_type == MessageParser.CLIENT_MSG_AUTH:
             self._handle_employee_connection(client, msg)
         return False
@@ -181,6 +299,9 @@ class SilentNetServer:
     def _handle_manager_connection(self, client, msg):
         """Handle manager authentication and connection"""
         ret_msg_type = MessageParser.MANAGER_INVALID_CONN
+        if not client.negotiate_framing(msg):
+            return False
+
         success = client.exchange_keys()
         if not success:
             return False
@@ -192,87 +313,184 @@ class SilentNetServer:
         msg = msg[MessageParser.PROTOCOL_DATA_INDEX - 1].decode()
         if msg == self.password:
             ret_msg_type = MessageParser.MANAGER_VALID_CONN
-            self.manager_connected = True
 
         sleep(uniform(0, 1))  # Prevent timing attack
-        sent = client.protocol_send(ret_msg_type)
+        if ret_msg_type == MessageParser.MANAGER_VALID_CONN:
+            sent = client.protocol_send(ret_msg_type, self.session_tickets.issue(client.export_session()), self.session_tickets.lifetime)
+        else:
+            sent = client.protocol_send(ret_msg_type)
+
         if sent == 0:
             return False
 
         if ret_msg_type == MessageParser.MANAGER_VALID_CONN:
-            ManagerHandler(self, client).process_requests()
+            self._serve_manager(client)
         
         return True
 
+    def _handle_manager_resume(self, client, msg):
+        """Resume a manager session with a ticket, skipping key exchange and password"""
+        try:
+            ticket, client_random = MessageParser.protocol_message_deconstruct(msg)
+            ticket, client_random = ticket.decode(), client_random.decode()
+        except ValueError:
+            return False
+
+        session = self.session_tickets.redeem(ticket)
+        if session is None:
+            client.protocol_send(MessageParser.MANAGER_INVALID_CONN, encrypt=False)
+            return False
+
+        server_random = secrets.token_hex(16)
+        sent = client.protocol_send(MessageParser.MANAGER_RESUME_SESSION, server_random, encrypt=False, compress=False)
+        if sent == 0:
+            return False
+
+        client.restore_session(session, (client_random + server_random).encode(), initiator=False)
+
+        # Tickets are single use, hand out a new one for the next resumption
+        sent = client.protocol_send(MessageParser.MANAGER_VALID_CONN, self.session_tickets.issue(client.export_session()), self.session_tickets.lifetime)
+        if sent == 0:
+            return True
+
+        self._serve_manager(client)
+        return True
+
+    def _serve_manager(self, client):
+        """Serve an authenticated manager, settings return to default once the last manager leaves"""
+        self._authenticated(client)
+
+        with self.managers_lock:
+            self.managers_connected += 1
+
+        try:
+            ManagerHandler(self, client).process_requests()
+        finally:
+            with self.managers_lock:
+                self.managers_connected -= 1
+
+                if self.managers_connected == 0:
+                    self.max_clients = self.default_max_clients
+                    self.safety = self.default_safety
+
     def _handle_employee_connection(self, client, msg):
         """Handle employee authentication and connection"""
-        id = -1
-        
         try:
             mac, hostname = MessageParser.protocol_message_deconstruct(msg)
             mac, hostname = mac.decode(), hostname.decode()
             logged, id = self.uid_data_base.insert_data(mac, hostname)
-
-            with self.ids_lock:
-                self.ids_connected.append(id)
             
             client.set_address(mac)
             if not logged:
                 self.log_data_base.client_setup_db(id)
             
-            ClientHandler(self, client, id).process_data()
+            handler = ClientHandler(self, client, id)
 
         except Exception:
             print(f"Rejecting client {client.get_ip()} due to invalid authentication")
             client.close()
+            return
 
-            if id in self.ids_connected:
-                with self.ids_lock:
-                    self.ids_connected.remove(id)
+        handler.process_data()
 
     def _remove_disconnected_client(self, client):
-        """Remove disconnected client from connected clients list"""
+        """Remove disconnected client from connected clients"""
         if not client:
             return
         
-        with self.clients_recv_lock:
-            for index in range(len(self.clients_connected)):
-                _, client_object = self.clients_connected[index]
-                
-                if client_object == client:
-                    del self.clients_connected[index]
-                    break
-
+        self.liveness.cancel(client)
+        self.registry.remove(client)
         client.close()
         client = None
 
         with self.clients_recv_lock:
-            if len(self.clients_connected) < self.max_clients:
+            if len(self.registry) < self.max_clients:
                 self.clients_recv_event.set()
         
 
     def erase_all_logs(self):
         """Erase all logs from the database"""
-        with DBHandler._lock:
+        with self.deleting_logs():
             self.log_data_base.delete_all_records_DB()
             clients = self.uid_data_base.get_clients()
 
-            for id, _ in clients:
-                self.log_data_base.client_setup_db(id)
+            with self.log_data_base.transaction():
+                for id, _ in clients:
+                    self.log_data_base.client_setup_db(id)
         
         print("\nErased all logs")
 
+    @contextmanager
+    def deleting_logs(self):
+        """Write queued logs, then hold off every database writer while logs are deleted"""
+        # Queued logs of deleted clients must not be written after their records are gone
+        self.ingest.flush()
+
+        with self.ingest_data_base.lock, DBHandler._lock:
+            yield
+
+    def print_stats(self):
+        """Print ingest and admission counters"""
+        print(f"\nConnections: {len(self.registry)}, employees connected: {self.registry.agents()}")
+        print("Ingest stats:")
+        for name, value in self.admission.stats().items():
+            print(f"  {name}: {value}")
+
+    def agent_stats(self, id):
+        """Throughput stats of a connected employee, None if it is not connected"""
+        return self.registry.agent_stats(id, self.ingest)
+
     def quit_server(self):
         """Shut down the server gracefully"""
         self.server_comm.close()
         self.proj_run = False
 
     def _cleanup(self):
-        """Clean up server resources before shutdown"""
+        """Shut down within the shutdown deadline, then report how long every phase took"""
+        if self.shutdown_report is None:
+            self.shutdown_report = ShutdownReport(self.shutdown_deadline)
+        report = self.shutdown_report
 
-        with self.clients_recv_lock:
-            for client_thread, _ in self.clients_connected:
-                client_thread.join()
+        self.liveness.stop()
+        self._stop_connections(report)
+
+        with report.phase("ingest drain"):
+            unwritten = self.ingest.stop(report.remaining())
+
+        if unwritten:
+            print(f"Warning: {unwritten} queued log submissions were not written before the shutdown deadline")
+
+        with report.phase("databases"):
+            self._close_databases()
+
+        report.print()
+
+    def _stop_connections(self, report):
+        """Stop accepting and wake every handler at once, then wait for them until the deadline"""
+        with report.phase("accept"):
+            self.server_comm.close()
+
+        with report.phase("handlers"):
+            connections = self.registry.connections()
+
+            # Employee handlers wait for messages without a timeout
+            for _, client in connections:
+                client.shutdown()
+
+            for client_thread, _ in connections:
+                client_thread.join(report.remaining())
+
+        running = sum(client_thread.is_alive() for client_thread, _ in connections)
+        if running:
+            print(f"Warning: {running} connection handlers did not finish before the shutdown deadline")
+
+    def _close_databases(self):
+        """Close database connections, the ingest pipeline must be stopped first"""
+        for pool in self.read_pools:
+            pool.close()
+
+        if self.ingest_data_base is not self.log_data_base:
+            DBHandler.close_DB(self.ingest_data_base.cursor, self.ingest_data_base.conn)
 
         DBHandler.close_DB(self.log_data_base.cursor, self.log_data_base.conn)
         DBHandler.close_DB(self.uid_data_base.cursor, self.uid_data_base.conn)
@@ -283,8 +501,9 @@ class SilentNetServer:
 
 class ClientHandler:
     """Handles communication with employee clients"""
-    
-    TIMEOUT_MAX = 10
+
+    # A handler lives as long as its agent, slots keep it small
+    __slots__ = ("server", "client", "id", "processManager", "stats")
 
     def __init__(self, server : SilentNetServer, client : client , id : int):
         self.server : SilentNetServer = server
@@ -293,50 +512,41 @@ class ClientHandler:
 
         # Dictionary for repeated processes
         self.processManager : process_limit.ProcessDebouncer = process_limit.ProcessDebouncer()
-        
-        # Count the times of timeout
-        self.timeout_cnt : int = 0
+
+        # Mark client as connected, its stats also find the noisy clients
+        server._authenticated(client)
+        self.stats : ConnectionStats = server.registry.connect_agent(id, client)
 
     def process_data(self):
         """Process data received from employee client"""
         print(f"\nEmployee connected: {self.client.get_ip()}")
+        self._watch_liveness()
         
         while self.server.proj_run:
             try:
                 data = self.client.protocol_recv(MessageParser.PROTOCOL_DATA_INDEX, decrypt=False, decompress=False)
                 
-                if data == b'ERR':
-                    self.timeout_cnt += 1
-                    
-                    # Client is offline
-                    if self.timeout_cnt > self.TIMEOUT_MAX:
-                        break
-                    else:
-                        continue
-                else:
-                    self.timeout_cnt = 0
-                
                 if data == b'' or len(data) != 2:
                     break
 
-                log_type, log_params = data[0], data[1]
-                log_type = log_type.decode()
+                # A batch message is ingested as one unit
+                if data[0].decode() == MessageParser.CLIENT_MSG_BATCH:
+                    records = MessageParser.protocol_batch_deconstruct(data[1])
+                else:
+                    records = [data]
 
-                # Ignore process which are usually not used by the user
-                if log_type == MessageParser.CLIENT_PROCESS_OPEN:
-                    log_params = log_params.decode()
+                self._count_messages(len(records))
+                logs, valid = self._collect_logs(records)
 
-                    if log_params in process_filter.ignored_processes:
-                        continue
+                if logs:
+                    self.server.ingest.submit(self.id, logs)
 
-                    if not self.processManager.should_log(log_params):
-                        continue
+                    delay = self._read_delay()
+                    if delay:
+                        sleep(delay)
 
-                if log_type in MessageParser.CLIENT_ALL_MSG:
-                    self.server.log_data_base.insert_data(self.id, log_type, log_params)
-                else:
-                    if self._handle_unsafe_message():
-                        break
+                if not valid and self._handle_unsafe_message():
+                    break
             
             except Exception as e:
                 print(f"Error from client {self.client.get_address()}: {e}")
@@ -347,12 +557,65 @@ class ClientHandler:
 
         self._cleanup_disconnection()
 
+    def _watch_liveness(self):
+        """Block on receive without a timeout, the liveness wheel keeps client's deadline instead"""
+        self.client.set_timeout(None)
+        self.server.liveness.schedule(self.stats, self.server.liveness_timeout, self._check_liveness)
+
+    def _check_liveness(self):
+        """Deadline of client passed, disconnect it unless it sent a message since it was set"""
+        remaining = self.server.liveness_timeout - (time() - self.stats.last_seen)
+
+        if remaining > 0:
+            self.server.liveness.schedule(self.stats, remaining, self._check_liveness)
+        else:
+            print(f"\nEmployee {self.client.get_ip()} is offline")
+            self.client.shutdown()
+
+    def _count_messages(self, messages):
+        """Count messages received from client"""
+        self.stats.seen(messages)
+        self.server.admission.record(messages)
+
+    def _read_delay(self):
+        """Returns for how long to stop reading from client"""
+        return self.server.admission.read_delay(self.stats.meter.rate(), self.server.registry.agents())
+
+    def _collect_logs(self, records):
+        """Filter received records into logs to store, also returns whether all records were valid"""
+        logs = []
+        valid = True
+
+        for record in records:
+            if len(record) != 2:
+                valid = False
+                continue
+
+            log_type, log_params = record[0].decode(), record[1]
+
+            # Ignore process which are usually not used by the user
+            if log_type == MessageParser.CLIENT_PROCESS_OPEN:
+                log_params = log_params.decode()
+
+                if log_params in process_filter.ignored_processes:
+                    continue
+
+                if not self.processManager.should_log(log_params):
+                    continue
+
+            if log_type in MessageParser.CLIENT_ALL_MSG:
+                logs.append((log_type, log_params))
+            else:
+                valid = False
+
+        return logs, valid
+
     def _handle_unsafe_message(self):
         """Handle unsafe/invalid messages from client"""
         disconnect = self.client.unsafe_msg_cnt_inc(self.server.safety)
 
         if disconnect:
-            with DBHandler._lock:
+            with self.server.deleting_logs():
                 self.server.log_data_base.delete_id_records_DB(self.id)
                 self.server.uid_data_base.delete_user(self.id)
             print("Disconnecting employee due to unsafe message count")
@@ -361,13 +624,11 @@ class ClientHandler:
 
     def _cleanup_disconnection(self):
         """Clean up when client disconnects"""
+        self.server.liveness.cancel(self.stats)
         self.client.close()
 
-        # Remove from list of currently connected macs
-        # In order to sign to manager that the client is not connected anymore
-        if self.server.proj_run and self.id in self.server.ids_connected:
-            with self.server.ids_lock:
-                self.server.ids_connected.remove(self.id)
+        # Sign to manager that the client is not connected anymore
+        self.server.registry.disconnect_agent(self.id, self.stats)
         
         print(f"\nEmployee disconnected: {self.client.get_ip()}")
 
@@ -428,10 +689,6 @@ class ManagerHandler:
                 if self._handle_unsafe_message():
                     return
 
-        # Return to default settings
-        self.server.max_clients = 5
-        self.server.safety = 5
-        
         print(f"\nManager disconnected: {self.client.get_ip()}")
 
     def _handle_settings_update(self, msg_params):
@@ -440,19 +697,19 @@ class ManagerHandler:
         self.server.max_clients, self.server.safety = int(new_max_clients), int(new_safety)
 
         with self.server.clients_recv_lock:
-            if len(self.server.clients_connected) >= self.server.max_clients:
+            if len(self.server.registry) >= self.server.max_clients:
                 self.server.clients_recv_event.clear()
             else:
                 self.server.clients_recv_event.set()
 
     def _get_client_list(self):
         """Get list of all clients for manager"""
-        clients = self.server.uid_data_base.get_clients()
+        clients = self.server.uid_reader.get_clients()
         ret_msg = []
 
         for id, hostname in clients:
-            active_percent = self.server.log_data_base.get_active_precentage(id)
-            is_connected = 1 if id in self.server.ids_connected else 0
+            active_percent = self.server.logs_reader.get_active_precentage(id)
+            is_connected = 1 if self.server.registry.is_connected(id) else 0
             ret_msg.append(f"{hostname},{active_percent},{is_connected}")
 
         return ret_msg, MessageParser.MANAGER_GET_CLIENTS
@@ -460,21 +717,21 @@ class ManagerHandler:
     def _get_client_data(self, msg_params):
         """Get detailed stats for a specific client"""
         client_name = msg_params.decode()
-        if not self.server.uid_data_base.check_user_existence(client_name):
+        if not self.server.uid_reader.check_user_existence(client_name):
             return [], MessageParser.MANAGER_CLIENT_NOT_FOUND
 
         return [self._get_employee_stats(client_name)], MessageParser.MANAGER_GET_CLIENTS
 
     def _get_employee_stats(self, client_name):
         """Generate statistics for a specific employee"""
-        id = self.server.uid_data_base.get_id_by_hostname(client_name)
+        id = self.server.uid_reader.get_id_by_hostname(client_name)
         
-        process_cnt = self.server.log_data_base.get_process_count(id)
-        inactive_times, inactive_after_last = self.server.log_data_base.get_inactive_times(id)
-        words_per_min = int(self.server.log_data_base.get_wpm(id, inactive_times, inactive_after_last))
+        process_cnt = self.server.logs_reader.get_process_count(id)
+        inactive_times = self.server.logs_reader.get_inactive_times(id)
+        words_per_min = int(self.server.logs_reader.get_wpm(id))
 
-        core_usage, cpu_usage = self.server.log_data_base.get_cpu_usage(id)
-        ip_cnt = self.server.log_data_base.get_reached_out_ips(id)
+        core_usage, cpu_usage = self.server.logs_reader.get_cpu_usage(id)
+        ip_cnt = self.server.logs_reader.get_reached_out_ips(id)
 
         data = {
             "processes": {
@@ -483,7 +740,7 @@ class ManagerHandler:
             },
             "inactivity": {
                 "labels": [i[0] for i in inactive_times],
-                "data": [int(i[1]) for i in inactive_times if len(i) == 2]
+                "data": [i[1] for i in inactive_times]
             },
             "wpm": words_per_min,
             "cpu_usage": {
@@ -496,7 +753,8 @@ class ManagerHandler:
             "ips": {
                 "labels": [i[0].decode() for i in ip_cnt],
                 "data": [i[1] for i in ip_cnt]
-            }
+            },
+            "connection": self.server.agent_stats(id)
         }
         
         return json.dumps(data)
@@ -519,14 +777,14 @@ class ManagerHandler:
         id = self.server.uid_data_base.get_id_by_hostname(client_name)
         mac = self.server.uid_data_base.get_mac_by_id(id)
 
-        with DBHandler._lock:
+        with self.server.deleting_logs():
         
             # Delete client stats
             self.server.log_data_base.delete_id_records_DB(id)
 
             # If client is currently connected we need to keep his default
             # Logs in the logging table
-            if id in self.server.ids_connected:
+            if self.server.registry.is_connected(id):
                 self.server.log_data_base.client_setup_db(id)
             
             # If the client is not connected during its deletion then we completely
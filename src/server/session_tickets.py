@@ -0,0 +1,116 @@
+#   'Silent net' manager session tickets
+#
+#       Issues and redeems tickets which let a manager
+#       Resume its session without a key exchange and password
+#
+#   Omer Kfir (C)
+
+import os
+import struct
+import threading
+from time import time
+from typing import Optional
+from collections import OrderedDict
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+__author__ = "Omer Kfir"
+
+TICKET_LIFETIME = 15 * 60 # seconds
+MAX_TICKETS = 32
+
+
+class SessionTicketCache:
+    """
+        Bounded cache of resumable manager sessions
+        Tickets are encrypted with a key which lives only in this process and can be redeemed once
+    """
+
+    TICKET_ID_LEN = 16
+    NONCE_LEN = 12
+    TICKET_FORMAT = struct.Struct(f"!{TICKET_ID_LEN}sd")
+
+    def __init__(self, lifetime : int = TICKET_LIFETIME, max_tickets : int = MAX_TICKETS):
+        """
+            Initialize an empty ticket cache
+
+            INPUT: lifetime, max_tickets
+            OUTPUT: None
+
+            @lifetime -> Seconds a ticket stays valid
+            @max_tickets -> Max amount of tickets kept, oldest are evicted first
+        """
+
+        self.lifetime = lifetime
+        self.max_tickets = max_tickets
+
+        self.__aead = AESGCM(AESGCM.generate_key(bit_length=256))
+        self.__sessions : OrderedDict = OrderedDict() # Ticket id -> (expiry, session state)
+        self.__lock = threading.Lock()
+
+    def __evict_expired(self, now : float) -> None:
+        """
+            Removes expired tickets, must be called while holding the lock
+
+            INPUT: now
+            OUTPUT: None
+        """
+
+        # Tickets are inserted in expiry order so expired ones are at the start
+        while self.__sessions:
+            ticket_id, (expiry, _) = next(iter(self.__sessions.items()))
+            if expiry > now:
+                break
+
+            del self.__sessions[ticket_id]
+
+    def issue(self, session : dict) -> str:
+        """
+            Stores a session and returns the ticket for it
+
+            INPUT: session
+            OUTPUT: Ticket (hex string)
+
+            @session -> Session state created by client.export_session
+        """
+
+        now = time()
+        ticket_id = os.urandom(self.TICKET_ID_LEN)
+        expiry = now + self.lifetime
+
+        with self.__lock:
+            self.__evict_expired(now)
+            self.__sessions[ticket_id] = (expiry, session)
+
+            while len(self.__sessions) > self.max_tickets:
+                self.__sessions.popitem(last=False)
+
+        nonce = os.urandom(self.NONCE_LEN)
+        return (nonce + self.__aead.encrypt(nonce, self.TICKET_FORMAT.pack(ticket_id, expiry), None)).hex()
+
+    def redeem(self, ticket : str) -> Optional[dict]:
+        """
+            Returns the session of a ticket and invalidates the ticket
+
+            INPUT: ticket
+            OUTPUT: Session state (None if ticket is invalid, expired or evicted)
+
+            @ticket -> Ticket returned by issue
+        """
+
+        try:
+            raw = bytes.fromhex(ticket)
+            plain = self.__aead.decrypt(raw[:self.NONCE_LEN], raw[self.NONCE_LEN:], None)
+            ticket_id, expiry = self.TICKET_FORMAT.unpack(plain)
+        except (ValueError, InvalidTag, struct.error):
+            return None
+
+        now = time()
+        with self.__lock:
+            self.__evict_expired(now)
+            entry = self.__sessions.pop(ticket_id, None)
+
+        if entry is None or entry[0] <= now:
+            return None
+
+        return entry[1]
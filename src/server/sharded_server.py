@@ -0,0 +1,542 @@
+"""
+'Silent net' sharded server
+
+Spreads agent ingest over several worker processes so it is not limited by one GIL and one database lock.
+The main process accepts connections, authenticates agents and serves the manager.
+Every authenticated agent is handed to the worker which owns its shard (client id % shards),
+Each worker writes to its own logs database, the clients table stays in the main database.
+Manager queries are routed to the shard of the client, whole table operations go to every shard.
+
+Usage: python sharded_server.py <max_clients:int> <safety:int> <password:str> [shards:int]
+Omer Kfir (C)
+"""
+
+import multiprocessing
+import traceback
+from itertools import count
+from contextlib import contextmanager, ExitStack
+from time import monotonic
+
+from server import *
+from DB import LogsShardORM, LogsWriterORM, ReadPool, UserLogsReader, UserIdReader
+from ingest import INGEST_QUEUE_MAX
+
+__author__ = "Omer Kfir"
+
+LOAD_REPORT_INTERVAL = 0.1 # seconds between reports of a worker's ingest depth and lag
+
+# Start workers the same way on every platform, forked children would inherit open databases
+mp_context = multiprocessing.get_context("spawn")
+
+
+def shard_db_path(db_path : str, index : int) -> str:
+    """
+        Returns the path of a shard's logs database
+
+        INPUT: db_path, index
+        OUTPUT: Path
+
+        @db_path -> Path of the main database
+        @index -> Shard index
+    """
+
+    name, ext = os.path.splitext(db_path)
+    return f"{name}.shard{index}{ext}"
+
+
+class ShardedLogs:
+    """
+        Logs table spread over several shard databases
+        Offers the UserLogsORM methods used by the main process
+    """
+
+    def __init__(self, shards : list[LogsShardORM]):
+        self.shards = shards
+
+    def shard(self, id : int) -> LogsShardORM:
+        """Returns the shard which owns a client's logs"""
+        return self.shards[id % len(self.shards)]
+
+    def client_setup_db(self, id : int) -> None:
+        self.shard(id).client_setup_db(id)
+
+    def delete_id_records_DB(self, id : int) -> None:
+        self.shard(id).delete_id_records_DB(id)
+
+    def delete_all_records_DB(self) -> None:
+        for shard in self.shards:
+            shard.delete_all_records_DB()
+
+    @contextmanager
+    def transaction(self):
+        """Groups the statements of the block into one commit on every shard"""
+        with ExitStack() as stack:
+            for shard in self.shards:
+                stack.enter_context(shard.transaction())
+            yield
+
+    def get_process_count(self, id : int):
+        return self.shard(id).get_process_count(id)
+
+    def get_inactive_times(self, id : int, start : str = None, end : str = None):
+        return self.shard(id).get_inactive_times(id, start, end)
+
+    def get_wpm(self, id : int):
+        return self.shard(id).get_wpm(id)
+
+    def get_cpu_samples(self, id : int, start : str = None, end : str = None):
+        return self.shard(id).get_cpu_samples(id, start, end)
+
+    def get_cpu_usage(self, id : int):
+        return self.shard(id).get_cpu_usage(id)
+
+    def get_active_precentage(self, id : int):
+        return self.shard(id).get_active_precentage(id)
+
+    def get_reached_out_ips(self, id : int):
+        return self.shard(id).get_reached_out_ips(id)
+
+    def close(self) -> None:
+        for shard in self.shards:
+            DBHandler.close_DB(shard.cursor, shard.conn)
+            shard.conn, shard.cursor = None, None
+
+
+class ShardPool:
+    """
+        Worker processes which own the shards, used by the main process in place of its ingest pipeline
+    """
+
+    def __init__(self, shards : int, db_path : str, safety : int, liveness_timeout : float):
+        """
+            Initialize the pool, workers start with start()
+
+            INPUT: shards, db_path, safety, liveness_timeout
+            OUTPUT: None
+
+            @shards -> Amount of worker processes
+            @db_path -> Path of the main database
+            @safety -> Unsafe message limit of agents
+            @liveness_timeout -> Seconds without a message before an agent is considered offline
+        """
+
+        self.db_path = db_path
+        self.safety = safety
+        self.liveness_timeout = liveness_timeout
+
+        self.__workers : list = [] # List of (process, pipe, pipe lock)
+        self.__shards = shards
+
+        # Ingest depth and writer lag of every worker, written by the workers
+        self.__loads : list = [mp_context.Array('d', 2, lock=False) for _ in range(shards)]
+        self.queue_max : int = INGEST_QUEUE_MAX * shards
+
+        # Id and hand off token of agents which disconnected from a worker
+        self.disconnected : multiprocessing.Queue = mp_context.Queue()
+
+    def start(self) -> None:
+        """Starts every worker process"""
+        for index in range(self.__shards):
+            pipe, worker_pipe = mp_context.Pipe()
+            process = mp_context.Process(target=run_shard, name=f"shard-{index}",
+                                         args=(shard_db_path(self.db_path, index), self.db_path, self.safety,
+                                               self.liveness_timeout, worker_pipe, self.disconnected, self.__loads[index]))
+            process.start()
+            self.__workers.append((process, pipe, threading.Lock()))
+
+    def __request(self, index : int, command : tuple, answer : bool = False):
+        """Sends a command to a worker, waits for its answer if needed"""
+        _, pipe, lock = self.__workers[index]
+
+        with lock:
+            pipe.send(command)
+            return pipe.recv() if answer else None
+
+    def hand_off(self, id : int, client : client, logged : bool, token : int) -> None:
+        """
+            Hands an authenticated agent to the worker which owns its shard
+
+            INPUT: id, client, logged, token
+            OUTPUT: None
+
+            @id -> Id of client
+            @client -> Agent connection, the main process may close its copy afterwards
+            @logged -> Whether client's basic logs already exist
+            @token -> Number of the hand off, the worker reports it back with the disconnect
+        """
+
+        self.__request(id % self.__shards, ("client", client.get_socket(), id, client.get_address(), logged, token))
+
+    def depth(self) -> int:
+        """Returns the amount of submissions queued in every worker"""
+        return int(sum(load[0] for load in self.__loads))
+
+    def writer_lag(self) -> float:
+        """Returns the lag of the worker which is furthest behind"""
+        return max(load[1] for load in self.__loads)
+
+    def agent_stats(self, id : int):
+        """Returns the stats of an agent served by a worker"""
+        return self.__request(id % self.__shards, ("stats", id), answer=True)
+
+    def flush(self) -> None:
+        """Waits until every worker wrote its queued logs"""
+        for index in range(len(self.__workers)):
+            self.__request(index, ("flush",), answer=True)
+
+    def stop(self, timeout : float = None) -> int:
+        """
+            Stops every worker at once, they write their queued logs first
+
+            INPUT: timeout
+            OUTPUT: Amount of submissions which were not written
+
+            @timeout -> Max seconds to wait for the workers (None to wait forever)
+        """
+
+        deadline = monotonic() + timeout if timeout is not None else None
+        remaining = lambda: max(deadline - monotonic(), 0) if deadline is not None else None
+
+        for _, pipe, lock in self.__workers:
+            with lock:
+                pipe.send(("stop", timeout))
+
+        unwritten = 0
+        for process, pipe, lock in self.__workers:
+            with lock:
+                if pipe.poll(remaining()):
+                    unwritten += pipe.recv()
+
+            process.join(remaining())
+            if process.is_alive():
+                print(f"Warning: {process.name} did not stop before the shutdown deadline")
+                process.terminate()
+                process.join()
+
+            pipe.close()
+
+        self.__workers = []
+        self.disconnected.put(None)
+        return unwritten
+
+
+class ShardedSilentNetServer(SilentNetServer):
+    """Server which accepts connections and hands agents to shard worker processes"""
+
+    def __init__(self):
+        """Initialize server with default configuration"""
+        super().__init__()
+        self.shards : int = os.cpu_count() or 1
+
+        # Agents served by a worker stay registered until it reports their disconnect
+        self.handed_off : dict[int, ConnectionStats] = {} # Hand off token -> stats of the agent
+        self.handed_off_lock : threading.Lock = threading.Lock()
+        self.handoff_tokens = count()
+
+    def _load_configuration(self):
+        """Load server configuration, an optional last argument is the amount of shards"""
+        if len(sys.argv) == 5:
+            if sys.argv[4].isnumeric() and int(sys.argv[4]) >= 1:
+                self.shards = int(sys.argv[4])
+            else:
+                print("Warning: Shards must be a positive number\nUsing default value instead")
+
+            sys.argv = sys.argv[:4]
+
+        # Every worker serves as many agents as the threaded server
+        self.MAX_CLIENTS_LIMIT = SilentNetServer.MAX_CLIENTS_LIMIT * self.shards
+
+        super()._load_configuration()
+        print(f"Shards: {self.shards}\n")
+
+    def _initialize_databases(self):
+        """Open the clients table and every shard, then start the shard workers"""
+        db_path = os.path.join(os.path.dirname(__file__), UserId.DB_NAME)
+
+        conn, cursor = DBHandler.connect_DB(db_path)
+        self.uid_data_base = UserId(conn, cursor, UserId.USER_ID_NAME)
+
+        # Main process only reads shards for the manager and writes them on deletions
+        shards = []
+        for index in range(self.shards):
+            conn, cursor = DBHandler.connect_DB(shard_db_path(db_path, index))
+            shards.append(LogsShardORM(conn, cursor, UserLogsORM.USER_LOGS_NAME))
+        self.log_data_base = ShardedLogs(shards)
+
+        # Manager queries run on read only connections of every shard
+        self.read_pools = [ReadPool(db_path)] + [ReadPool(shard_db_path(db_path, index)) for index in range(self.shards)]
+        self.uid_reader = UserIdReader(self.read_pools[0], UserId.USER_ID_NAME)
+        self.logs_reader = ShardedLogs([UserLogsReader(pool, UserLogsORM.USER_LOGS_NAME) for pool in self.read_pools[1:]])
+
+        self.ingest = ShardPool(self.shards, db_path, self.safety, self.liveness_timeout)
+        self.ingest.start()
+
+        self.admission = AdmissionController(self.ingest)
+
+        threading.Thread(target=self._collect_disconnections, daemon=True).start()
+
+    def _collect_disconnections(self):
+        """Removes agents which disconnected from a worker from the registry"""
+        while True:
+            report = self.ingest.disconnected.get()
+            if report is None:
+                break
+
+            id, token = report
+            with self.handed_off_lock:
+                stats = self.handed_off.pop(token, None)
+
+            if stats is None:
+                continue
+
+            # A newer connection of the same agent is kept
+            self.registry.disconnect_agent(id, stats)
+            self.registry.remove(stats.client)
+
+            with self.clients_recv_lock:
+                if len(self.registry) < self.max_clients:
+                    self.clients_recv_event.set()
+
+    def _is_handed_off(self, client) -> bool:
+        """Returns whether a connection is served by a worker"""
+        with self.handed_off_lock:
+            return any(stats.client is client for stats in self.handed_off.values())
+
+    def _handle_employee_connection(self, client, msg):
+        """Authenticate an employee and hand it to the worker of its shard"""
+        stats, token = None, None
+
+        try:
+            mac, hostname = MessageParser.protocol_message_deconstruct(msg)
+            mac, hostname = mac.decode(), hostname.decode()
+            logged, id = self.uid_data_base.insert_data(mac, hostname)
+
+            stats = self.registry.connect_agent(id, client)
+
+            client.set_address(mac)
+            self._authenticated(client)
+
+            # Registered before the hand off, the worker may report the disconnect right away
+            token = next(self.handoff_tokens)
+            with self.handed_off_lock:
+                self.handed_off[token] = stats
+
+            self.ingest.hand_off(id, client, logged, token)
+            print(f"\nEmployee {client.get_ip()} handed to shard {id % self.shards}")
+
+        except Exception:
+            print(f"Rejecting client {client.get_ip()} due to invalid authentication")
+            client.close()
+
+            if token is not None:
+                with self.handed_off_lock:
+                    self.handed_off.pop(token, None)
+
+            if stats is not None:
+                self.registry.disconnect_agent(stats.id, stats)
+
+    def _remove_disconnected_client(self, client):
+        """Close the main process' copy of the connection, a handed off agent stays counted until its worker reports it"""
+        if client and self._is_handed_off(client):
+            self.liveness.cancel(client)
+            client.close()
+            return
+
+        super()._remove_disconnected_client(client)
+
+    def agent_stats(self, id):
+        """Throughput stats of a connected employee, kept by the worker which serves it"""
+        if not self.registry.is_connected(id):
+            return None
+
+        return self.ingest.agent_stats(id)
+
+    @contextmanager
+    def deleting_logs(self):
+        """Write queued logs of every shard, the workers write from their own processes"""
+        self.ingest.flush()
+
+        with DBHandler._lock:
+            yield
+
+    def _close_databases(self):
+        """Close database connections, the shard workers must be stopped first"""
+        for pool in self.read_pools:
+            pool.close()
+
+        self.log_data_base.close()
+        DBHandler.close_DB(self.uid_data_base.cursor, self.uid_data_base.conn)
+        self.uid_data_base.conn, self.uid_data_base.cursor = None, None
+
+
+class ShardWorker:
+    """
+        Serves the agents of one shard inside a worker process
+        Takes the place of the server for ClientHandler
+    """
+
+    def __init__(self, shard_path : str, db_path : str, safety : int, liveness_timeout : float, disconnected, load):
+        self.proj_run : bool = True
+        self.safety : int = safety
+        self.disconnected = disconnected
+
+        self.registry : ConnectionRegistry = ConnectionRegistry()
+        self.liveness : TimerWheel = TimerWheel()
+        self.liveness_timeout : float = liveness_timeout
+        self.liveness.start()
+
+        conn, cursor = DBHandler.connect_DB(shard_path)
+        self.log_data_base = LogsShardORM(conn, cursor, UserLogsORM.USER_LOGS_NAME)
+
+        # Clients table is only written here when an unsafe agent is deleted
+        conn, cursor = DBHandler.connect_DB(db_path)
+        self.uid_data_base = UserId(conn, cursor, UserId.USER_ID_NAME)
+
+        # With WAL the writer of the shard gets a connection of its own
+        if DBHandler.WAL:
+            conn, cursor = DBHandler.connect_DB(shard_path)
+            self.ingest_data_base = LogsWriterORM(conn, cursor, UserLogsORM.USER_LOGS_NAME)
+        else:
+            self.ingest_data_base = self.log_data_base
+
+        self.ingest = IngestPipeline(self.ingest_data_base)
+        self.ingest.start()
+
+        # Agents of this shard are slowed down by its own ingest, the main process defers accepts by every shard
+        self.admission = AdmissionController(self.ingest)
+
+        self.load = load
+        threading.Thread(target=self._report_load, daemon=True).start()
+
+    def _report_load(self) -> None:
+        """Publishes ingest depth and writer lag to the main process"""
+        while self.proj_run:
+            self.load[0], self.load[1] = self.ingest.depth(), self.ingest.writer_lag()
+            sleep(LOAD_REPORT_INTERVAL)
+
+        self.load[0], self.load[1] = 0, 0
+
+    def serve(self, sock, id : int, mac : str, logged : bool, token : int) -> None:
+        """Starts serving an agent handed over by the main process"""
+        agent = client(sock)
+        agent.set_address(mac)
+
+        if not logged:
+            self.log_data_base.client_setup_db(id)
+
+        handler = threading.Thread(target=ShardClientHandler(self, agent, id, token).process_data, daemon=True)
+        self.registry.add(agent, handler, authenticated=True)
+        handler.start()
+
+    def _authenticated(self, client) -> None:
+        """Agents were authenticated by the main process before they were handed over"""
+        pass
+
+    deleting_logs = SilentNetServer.deleting_logs
+
+    def stop(self, timeout : float = None) -> int:
+        """
+            Stops every agent handler, writes queued logs and closes the databases
+
+            INPUT: timeout
+            OUTPUT: Amount of submissions which were not written
+
+            @timeout -> Max seconds to wait for handlers and queued logs (None to wait forever)
+        """
+
+        deadline = monotonic() + timeout if timeout is not None else None
+        remaining = lambda: max(deadline - monotonic(), 0) if deadline is not None else None
+
+        self.proj_run = False
+        self.liveness.stop()
+
+        connections = self.registry.connections()
+        for _, agent in connections:
+            agent.shutdown()
+
+        for handler, _ in connections:
+            handler.join(remaining())
+
+        unwritten = self.ingest.stop(remaining())
+        if self.ingest_data_base is not self.log_data_base:
+            DBHandler.close_DB(self.ingest_data_base.cursor, self.ingest_data_base.conn)
+
+        DBHandler.close_DB(self.log_data_base.cursor, self.log_data_base.conn)
+        DBHandler.close_DB(self.uid_data_base.cursor, self.uid_data_base.conn)
+        return unwritten
+
+
+class ShardClientHandler(ClientHandler):
+    """Handles an employee client inside a shard worker"""
+
+    __slots__ = ("token",)
+
+    def __init__(self, server : ShardWorker, client : client, id : int, token : int):
+        super().__init__(server, client, id)
+        self.token : int = token # Hand off of the main process this connection belongs to
+
+    def _cleanup_disconnection(self):
+        """Clean up when client disconnects and tell the main process"""
+        super()._cleanup_disconnection()
+        self.server.registry.remove(self.client)
+        self.server.disconnected.put((self.id, self.token))
+
+
+def run_shard(shard_path : str, db_path : str, safety : int, liveness_timeout : float, pipe, disconnected, load) -> None:
+    """
+        Worker process entry, serves commands of the main process until told to stop
+
+        INPUT: shard_path, db_path, safety, liveness_timeout, pipe, disconnected, load
+        OUTPUT: None
+
+        @shard_path -> Path of the shard's logs database
+        @db_path -> Path of the main database (clients table)
+        @safety -> Unsafe message limit of agents
+        @liveness_timeout -> Seconds without a message before an agent is considered offline
+        @pipe -> Command pipe to the main process
+        @disconnected -> Queue of id and hand off token of agents which disconnected
+        @load -> Shared array the worker reports its ingest depth and writer lag in
+    """
+
+    worker = ShardWorker(shard_path, db_path, safety, liveness_timeout, disconnected, load)
+
+    while True:
+        try:
+            command = pipe.recv()
+        except (EOFError, KeyboardInterrupt):
+            worker.stop()
+            return
+
+        try:
+            if command[0] == "client":
+                worker.serve(*command[1:])
+            elif command[0] == "stats":
+                pipe.send(worker.registry.agent_stats(command[1], worker.ingest))
+            elif command[0] == "flush":
+                worker.ingest.flush()
+                pipe.send(True)
+            elif command[0] == "stop":
+                pipe.send(worker.stop(command[1]))
+                return
+        except Exception as e:
+            print(f"Error in shard worker: {e}")
+            print(traceback.format_exc())
+
+            if command[0] == "stop":
+                pipe.send(0)
+                return
+            elif command[0] == "client":
+                # The agent was never served, the main process still counts it
+                disconnected.put((command[2], command[5]))
+            else:
+                pipe.send(False)
+
+
+def main():
+    """Main entry point for the sharded server"""
+    server = ShardedSilentNetServer()
+    server.start()
+
+
+if __name__ == "__main__":
+    main()
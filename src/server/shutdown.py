@@ -0,0 +1,69 @@
+#   'Silent net' shutdown report
+#
+#       Shutdown runs in phases under one deadline
+#       Every phase is timed and printed once the server is down
+#
+#   Omer Kfir (C)
+
+from contextlib import contextmanager
+from time import monotonic
+
+__author__ = "Omer Kfir"
+
+
+class ShutdownReport:
+    """
+        Deadline of a shutdown and how long each of its phases took
+    """
+
+    def __init__(self, deadline : float):
+        """
+            Starts the shutdown clock
+
+            INPUT: deadline
+            OUTPUT: None
+
+            @deadline -> Seconds the whole shutdown may take
+        """
+
+        self.started : float = monotonic()
+        self.deadline : float = self.started + deadline
+        self.phases : list[tuple[str, float]] = []
+
+    def remaining(self) -> float:
+        """
+            Returns how many seconds are left until the deadline
+
+            INPUT: None
+            OUTPUT: Seconds (0 once the deadline passed)
+        """
+
+        return max(self.deadline - monotonic(), 0.0)
+
+    @contextmanager
+    def phase(self, name : str):
+        """
+            Times a phase of the shutdown
+
+            INPUT: name
+            OUTPUT: Context manager
+
+            @name -> Name of the phase
+        """
+
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.phases.append((name, monotonic() - start))
+
+    def print(self) -> None:
+        """
+            Prints how long every phase took
+
+            INPUT: None
+            OUTPUT: None
+        """
+
+        phases = ", ".join(f"{name} {took:.3f}s" for name, took in self.phases)
+        print(f"Shutdown took {monotonic() - self.started:.3f}s ({phases})")
@@ -0,0 +1,145 @@
+#   'Silent net' timer wheel
+#
+#       Hashed timer wheel for connection deadlines
+#       A single thread advances the wheel once a tick, so idle
+#       Connections cost nothing until their deadline comes
+#
+#   Omer Kfir (C)
+
+import threading
+
+__author__ = "Omer Kfir"
+
+WHEEL_TICK = 1.0 # seconds, resolution of every deadline
+WHEEL_SLOTS = 64
+
+
+class TimerWheel:
+    """
+        Timers keyed by an owner, each owner has at most one pending timer
+    """
+
+    def __init__(self, tick : float = WHEEL_TICK, slots : int = WHEEL_SLOTS):
+        """
+            Initialize the wheel, it starts turning with start()
+
+            INPUT: tick, slots
+            OUTPUT: None
+
+            @tick -> Seconds between two slots
+            @slots -> Amount of slots, deadlines further than a full turn wait for more turns
+        """
+
+        self.tick = tick
+
+        self.__slots : list[dict] = [{} for _ in range(slots)] # Key -> (turns left, callback)
+        self.__timers : dict = {} # Key -> index of its slot
+        self.__cursor : int = 0
+
+        self.__lock = threading.Lock()
+        self.__stop_event = threading.Event()
+        self.__thread : threading.Thread = None
+
+    def __len__(self) -> int:
+        return len(self.__timers)
+
+    def start(self) -> None:
+        """
+            Starts the wheel thread
+
+            INPUT: None
+            OUTPUT: None
+        """
+
+        self.__stop_event.clear()
+        self.__thread = threading.Thread(target=self.__turn, name="timer-wheel", daemon=True)
+        self.__thread.start()
+
+    def stop(self) -> None:
+        """
+            Stops the wheel thread, pending timers never fire
+
+            INPUT: None
+            OUTPUT: None
+        """
+
+        if self.__thread is None:
+            return
+
+        self.__stop_event.set()
+        self.__thread.join()
+        self.__thread = None
+
+    def schedule(self, key, delay : float, callback) -> None:
+        """
+            Sets the timer of a key, replacing its pending one
+
+            INPUT: key, delay, callback
+            OUTPUT: None
+
+            @key -> Owner of the timer (hashable)
+            @delay -> Seconds until it fires, it never fires early but may fire up to a tick late
+            @callback -> Function called without arguments on the wheel thread, must not block
+        """
+
+        # Part of the current tick already passed, so one more tick makes sure the delay is met
+        ticks = max(1, -int(-delay // self.tick)) + 1
+        turns, offset = divmod(ticks - 1, len(self.__slots))
+
+        with self.__lock:
+            self.__remove(key)
+
+            index = (self.__cursor + offset + 1) % len(self.__slots)
+            self.__slots[index][key] = (turns, callback)
+            self.__timers[key] = index
+
+    def cancel(self, key) -> bool:
+        """
+            Cancels the pending timer of a key
+
+            INPUT: key
+            OUTPUT: Boolean value which indicates whether a timer was pending
+        """
+
+        with self.__lock:
+            return self.__remove(key)
+
+    def __remove(self, key) -> bool:
+        """ Removes the timer of a key, lock must be held """
+
+        index = self.__timers.pop(key, None)
+        if index is None:
+            return False
+
+        del self.__slots[index][key]
+        return True
+
+    def __turn(self) -> None:
+        """
+            Wheel thread, fires the timers of a slot every tick
+
+            INPUT: None
+            OUTPUT: None
+        """
+
+        while not self.__stop_event.wait(self.tick):
+            expired = []
+
+            with self.__lock:
+                self.__cursor = (self.__cursor + 1) % len(self.__slots)
+                slot = self.__slots[self.__cursor]
+
+                for key, (turns, callback) in list(slot.items()):
+                    if turns:
+                        slot[key] = (turns - 1, callback)
+                    else:
+                        del slot[key]
+                        del self.__timers[key]
+                        expired.append(callback)
+
+            # Callbacks may schedule again, so they run without the lock
+            for callback in expired:
+                try:
+                    callback()
+                except Exception as e:
+                    print(f"Error in timer callback: {e}")
@@ -0,0 +1,246 @@
+#   'Silent net' asyncio protocol layer
+#
+#       Protocol clients over asyncio streams, used by the
+#       asyncio server mode to serve many agents in one thread
+#       Framing, packing and unpacking are shared with protocol.client
+#
+#   Omer Kfir (C)
+
+import socket
+import asyncio
+import concurrent.futures
+from typing import Optional, Union
+from protocol import client
+
+__author__ = "Omer Kfir"
+
+
+class AsyncClient(client):
+    """
+        Client served by asyncio streams, receive and send are coroutines
+    """
+
+    __slots__ = ("__reader", "__writer", "__loop", "__timeout")
+
+    def __init__(self, reader : asyncio.StreamReader, writer : asyncio.StreamWriter):
+        """
+            Wrap connected asyncio streams
+
+            INPUT: reader, writer
+            OUTPUT: None
+
+            @reader -> Stream reader of the connection
+            @writer -> Stream writer of the connection
+        """
+
+        super().__init__(writer.get_extra_info("socket"))
+
+        self.__reader = reader
+        self.__writer = writer
+        self.__loop = asyncio.get_running_loop()
+        self.__timeout = None
+
+    def set_timeout(self, time : Optional[float]) -> None:
+        """
+            Sets a timeout for waiting on a new message
+
+            INPUT: time
+            OUTPUT: None
+
+            @time -> Amount of timeout time (None to wait forever)
+        """
+
+        self.__timeout = time
+
+    async def recv_frame(self) -> tuple[int, Union[bytes, memoryview]]:
+        """
+            Recevies a frame from connected side
+
+            INPUT: None
+            OUTPUT: Tuple of frame flags and received message (b'' if connection closed)
+        """
+
+        try:
+            # Waiting for a header is cancel safe, nothing is consumed until the whole header arrived
+            header = await asyncio.wait_for(self.__reader.readexactly(self.header_len()), self.__timeout)
+            data_len, flags = self.parse_header(header)
+
+            if data_len == -1:
+                print(f"\nConnection forcibly closed by {self.get_ip()}")
+                return flags, b''
+
+            data = await self.__reader.readexactly(data_len)
+
+        except asyncio.IncompleteReadError:
+            print(f"\nConnection forcibly closed by {self.get_ip()}")
+            return self.FRAME_FLAG_NONE, b''
+
+        self.add_traffic(len(header) + data_len, 0)
+        self.log("Receive", data)
+        return flags, data
+
+    async def protocol_recv(self, part_split : int = -1, decrypt : bool = True, decompress : bool = True) -> list[bytes]:
+        """
+            Recevies data from connected side and splits it by protocol
+
+            INPUT: part_split, decrypt, decompress
+            OUTPUT: List of byte streams (b'ERR' on timeout, b'' if connection closed)
+
+            @part_split -> Number of fields to seperate from start of message
+            @decrypt -> Boolean to sign if to decrypt
+            @decompress -> Boolean to sign if to decompress data
+        """
+
+        try:
+            flags, data = await self.recv_frame()
+            if data == b'':
+                return data
+
+            return self.unpack_message(flags, data, part_split, decrypt, decompress)
+
+        except socket.timeout:
+            return b'ERR'
+
+        except OSError:
+            return b''
+
+        except Exception as e:
+            print(e)
+            return b''
+
+    async def protocol_send(self, msg_type, *args, encrypt : bool = True, compress : bool = True) -> int:
+        """
+            Sends a message constructed by protocol
+
+            INPUT: msg_type, *args (Uknown amount of arguments)
+            OUTPUT: Number 1/0 which representes if message was sent successfully
+        """
+
+        return await self.protocol_send_many([(msg_type, *args)], encrypt=encrypt, compress=compress)
+
+    async def protocol_send_many(self, messages : list[tuple], encrypt : bool = True, compress : bool = True) -> int:
+        """
+            Sends several messages constructed by protocol in a single write
+
+            INPUT: messages, encrypt, compress
+            OUTPUT: Number 1/0 which representes if messages were sent successfully
+
+            @messages -> List of tuples, each is message type followed by its arguments
+        """
+
+        try:
+            # Nothing is awaited between packing and writing, so coroutines sharing the connection
+            # Write their frames in the order the compression streams and nonces were used
+            buffers = self.frame_buffers(self.pack_frames(messages, encrypt, compress))
+            self.__writer.writelines(buffers)
+            await self.__writer.drain()
+            self.add_traffic(0, sum(len(buf) for buf in buffers))
+
+            for data in buffers[1::2]:
+                self.log("Sent", data)
+            return 1
+
+        except OSError:
+            return 0
+
+        except Exception as e:
+            print(e)
+            return 0
+
+    def to_blocking(self) -> client:
+        """
+            Returns a blocking client over the same streams, to be used from a worker thread
+            Must only be called while no coroutine is reading from the connection
+
+            INPUT: None
+            OUTPUT: Protocol client
+        """
+
+        blocking = client(StreamSocket(self.__reader, self.__writer, asyncio.get_running_loop()))
+        blocking.set_framing(self.get_framing())
+
+        return blocking
+
+    def close(self) -> None:
+        """
+            Closes the connection
+
+            INPUT: None
+            OUTPUT: None
+        """
+
+        self.__writer.close()
+
+    def shutdown(self) -> None:
+        """
+            Closes the connection from any thread, its pending receive ends
+
+            INPUT: None
+            OUTPUT: None
+        """
+
+        self.__loop.call_soon_threadsafe(self.__writer.close)
+
+
+class StreamSocket:
+    """
+        Blocking socket interface over asyncio streams
+        Lets code written for blocking sockets run in a worker thread while the event loop owns the connection
+    """
+
+    READ_MAX_LEN = (1024 * 4)
+
+    def __init__(self, reader : asyncio.StreamReader, writer : asyncio.StreamWriter, loop : asyncio.AbstractEventLoop):
+        """
+            Wrap asyncio streams owned by 'loop'
+
+            INPUT: reader, writer, loop
+            OUTPUT: None
+        """
+
+        self.__reader = reader
+        self.__writer = writer
+        self.__loop = loop
+        self.__timeout = None
+
+        # A read which timed out keeps running, its data is used by the next recv
+        self.__pending = None
+        self.__leftover = b''
+
+    def settimeout(self, time : Optional[float]) -> None:
+        self.__timeout = time
+
+    def getpeername(self):
+        return self.__writer.get_extra_info("peername")
+
+    def recv_into(self, buffer, nbytes : int = 0) -> int:
+        nbytes = nbytes or len(buffer)
+
+        if not self.__leftover:
+            if self.__pending is None:
+                self.__pending = asyncio.run_coroutine_threadsafe(self.__reader.read(self.READ_MAX_LEN), self.__loop)
+
+            try:
+                self.__leftover = self.__pending.result(self.__timeout)
+            except concurrent.futures.TimeoutError:
+                raise socket.timeout("timed out")
+
+            self.__pending = None
+            if not self.__leftover:
+                return 0
+
+        amount = min(nbytes, len(self.__leftover))
+        buffer[:amount] = self.__leftover[:amount]
+        self.__leftover = self.__leftover[amount:]
+
+        return amount
+
+    def sendall(self, data : Union[bytes, memoryview]) -> None:
+        asyncio.run_coroutine_threadsafe(self.__write(data), self.__loop).result()
+
+    async def __write(self, data : Union[bytes, memoryview]) -> None:
+        self.__writer.write(data)
+        await self.__writer.drain()
+
+    def close(self) -> None:
+        self.__loop.call_soon_threadsafe(self.__writer.close)
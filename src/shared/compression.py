@@ -0,0 +1,249 @@
+#   Compression Handler Module
+#
+#       Contains the compression codecs known to the protocol
+#       And per connection compression streams used
+#       By connections which negotiated v2 framing
+#
+#   Author: Omer Kfir (C)
+
+import zlib
+from typing import Optional, Union
+
+# Optional codecs, only offered when installed
+try:
+    import lz4.block as lz4_block
+except ImportError:
+    lz4_block = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+__author__ = "Omer Kfir"
+
+# Messages shorter than this are sent as is, compressing them only adds overhead
+COMPRESS_MIN_LEN = 64
+
+# Every sync flushed block ends with this marker, it is stripped before sending
+SYNC_FLUSH_TAIL = b"\x00\x00\xff\xff"
+
+# Largest message a frame may decompress to, same as the largest v2 frame
+# A frame inflating past it fails the connection instead of filling the memory
+DECOMPRESS_MAX_LEN = (1024 * 1024 * 16)
+
+# lz4 blocks start with their decompressed size
+LZ4_SIZE_LEN = 4
+
+CODEC_ZLIB = "zlib"
+CODEC_LZ4 = "lz4"
+CODEC_ZSTD = "zstd"
+CODEC_NONE = "none"
+
+# Codecs ordered from fastest to slowest, negotiation picks the first both sides have
+# The none codec is never negotiated, it has to be chosen explicitly
+CODEC_PREFERENCE = (CODEC_LZ4, CODEC_ZSTD, CODEC_ZLIB)
+CODEC_DEFAULT = CODEC_ZLIB
+
+
+class ZlibCodec:
+    """
+        Persistent raw deflate streams, messages are sync flushed
+        Both sides must process the compressed messages in the same order they were sent
+    """
+
+    def __init__(self, zdict: Optional[bytes] = None, level: int = zlib.Z_DEFAULT_COMPRESSION):
+        """
+            Initialize zlib streams
+
+            INPUT: zdict, level
+            OUTPUT: None
+
+            @zdict -> Preset dictionary, both sides must use the same one
+            @level -> zlib compression level
+        """
+
+        # Raw deflate streams, the stream itself replaces zlib's per message header and checksum
+        if zdict:
+            self.compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=zdict)
+            self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=zdict)
+        else:
+            self.compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+            self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+
+    def compress(self, data: Union[bytes, memoryview]) -> bytes:
+        compressed = self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+        if compressed.endswith(SYNC_FLUSH_TAIL):
+            compressed = compressed[:-len(SYNC_FLUSH_TAIL)]
+
+        return compressed
+
+    def decompress(self, data: Union[bytes, memoryview]) -> bytes:
+        decompressed = self.decompressor.decompress(data, DECOMPRESS_MAX_LEN)
+        if not self.decompressor.unconsumed_tail:
+            # A max length of 0 is unbounded, one byte past the limit is enough to tell
+            decompressed += self.decompressor.decompress(SYNC_FLUSH_TAIL, DECOMPRESS_MAX_LEN + 1 - len(decompressed))
+
+        if self.decompressor.unconsumed_tail or len(decompressed) > DECOMPRESS_MAX_LEN:
+            raise ValueError("Decompressed message is too long")
+
+        return decompressed
+
+
+class Lz4Codec:
+    """
+        lz4 block compression, every message is compressed on its own
+    """
+
+    def __init__(self, zdict: Optional[bytes] = None):
+        self.zdict = zdict or b""
+
+    def compress(self, data: Union[bytes, memoryview]) -> bytes:
+        return lz4_block.compress(data, dict=self.zdict)
+
+    def decompress(self, data: Union[bytes, memoryview]) -> bytes:
+        size = int.from_bytes(data[:LZ4_SIZE_LEN], "little")
+        if size > DECOMPRESS_MAX_LEN:
+            raise ValueError("Decompressed message is too long")
+
+        return lz4_block.decompress(data[LZ4_SIZE_LEN:], uncompressed_size=size, dict=self.zdict)
+
+
+class ZstdCodec:
+    """
+        zstd compression, every message is a separate zstd frame
+    """
+
+    def __init__(self, zdict: Optional[bytes] = None, level: int = 3):
+        # Raw content dictionaries need no training and match zlib's preset dictionary
+        if zdict:
+            zdict = zstandard.ZstdCompressionDict(zdict, dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+            self.compressor = zstandard.ZstdCompressor(level=level, dict_data=zdict)
+            self.decompressor = zstandard.ZstdDecompressor(dict_data=zdict)
+        else:
+            self.compressor = zstandard.ZstdCompressor(level=level)
+            self.decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data: Union[bytes, memoryview]) -> bytes:
+        return self.compressor.compress(data)
+
+    def decompress(self, data: Union[bytes, memoryview]) -> bytes:
+        # max_output_size only applies to frames which do not state their size
+        if zstandard.frame_content_size(data) > DECOMPRESS_MAX_LEN:
+            raise ValueError("Decompressed message is too long")
+
+        return self.decompressor.decompress(data, max_output_size=DECOMPRESS_MAX_LEN)
+
+
+class NoneCodec:
+    """
+        Sends data as is
+    """
+
+    def __init__(self, zdict: Optional[bytes] = None):
+        pass
+
+    def compress(self, data: Union[bytes, memoryview]) -> bytes:
+        return data
+
+    def decompress(self, data: Union[bytes, memoryview]) -> bytes:
+        return data
+
+
+CODECS = {
+    CODEC_ZLIB: ZlibCodec,
+    CODEC_LZ4: Lz4Codec,
+    CODEC_ZSTD: ZstdCodec,
+    CODEC_NONE: NoneCodec,
+}
+
+
+def available_codecs() -> list[str]:
+    """
+        Returns names of codecs which can be used on this machine, fastest first
+
+        INPUT: None
+        OUTPUT: List of codec names
+    """
+
+    missing = set()
+    if lz4_block is None:
+        missing.add(CODEC_LZ4)
+    if zstandard is None:
+        missing.add(CODEC_ZSTD)
+
+    return [codec for codec in CODEC_PREFERENCE if codec not in missing]
+
+
+def choose_codec(offered: list[str]) -> str:
+    """
+        Picks the fastest codec offered by the other side which is also available here
+
+        INPUT: offered
+        OUTPUT: Codec name (zlib if nothing in common)
+
+        @offered -> Codec names offered by the other side
+    """
+
+    for codec in available_codecs():
+        if codec in offered:
+            return codec
+
+    return CODEC_DEFAULT
+
+
+class CompressionHandler:
+    """
+        Handles compression of a single connection with a negotiated codec
+        Streams carry state from one message to the next, so messages must be compressed
+        In the order they are sent and decompressed in the order they are received
+        Not thread safe, the connection serializes its sends and its receives
+    """
+
+    def __init__(self, codec: str = CODEC_DEFAULT, zdict: Optional[bytes] = None,
+                 threshold: int = COMPRESS_MIN_LEN):
+        """
+            Initialize compression handler
+
+            INPUT: codec, zdict, threshold
+            OUTPUT: None
+
+            @codec -> Name of codec to use (one of CODECS)
+            @zdict -> Preset dictionary, both sides must use the same one
+            @threshold -> Minimal message length to be compressed
+        """
+
+        if codec != CODEC_NONE and codec not in available_codecs():
+            raise ValueError(f"Compression codec {codec} is not available")
+
+        self.codec_name = codec
+        self.codec = CODECS[codec](zdict=zdict)
+        self.threshold = threshold if codec != CODEC_NONE else float("inf")
+
+    def compress(self, data: Union[bytes, memoryview]) -> tuple[bytes, bool]:
+        """
+            Compresses a message if it is long enough
+
+            INPUT: data
+            OUTPUT: Tuple of message to send and whether it was compressed
+
+            @data -> Message to compress
+        """
+
+        if len(data) < self.threshold:
+            return data, False
+
+        return self.codec.compress(data), True
+
+    def decompress(self, data: Union[bytes, memoryview]) -> bytes:
+        """
+            Decompresses a message compressed by the other side
+
+            INPUT: data
+            OUTPUT: Decompressed message (bytes)
+
+            @data -> Compressed message
+        """
+
+        return self.codec.decompress(data)
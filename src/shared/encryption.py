@@ -1,27 +1,87 @@
 #   Encryption Handler Module
 #
 #       Contains classes for handling encryption tasks such as
-#       Diffie-Hellman key exchange and AES encryption/decryption
+#       Diffie-Hellman / X25519 key exchange and AES encryption/decryption (CBC and GCM)
 #
 #   Author: Omer Kfir (C)
 
 import hashlib
+import secrets
 from typing import Optional, Union
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import pad, unpad
 from Crypto.Random import get_random_bytes
-from cryptography.hazmat.primitives.asymmetric import dh
-from random import randint
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey, X25519PublicKey
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
 __author__ = "Omer Kfir"
 
 DEBUG_FLAG = False
 
+# Symmetric ciphers, ordered by preference
+CIPHER_AES_GCM = "aes-gcm"
+CIPHER_AES_CBC = "aes-cbc"
+CIPHER_PREFERENCE = (CIPHER_AES_GCM, CIPHER_AES_CBC)
+CIPHER_DEFAULT = CIPHER_AES_CBC
+
+# Key exchange methods, ordered by preference
+KEX_X25519 = "x25519"
+KEX_DH = "dh"
+KEX_PREFERENCE = (KEX_X25519, KEX_DH)
+KEX_DEFAULT = KEX_DH
+
+# 2048-bit MODP group 14 from RFC 3526, generator 2
+DH_GROUP_PRIME = int(
+    "FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74020BBEA63B139B22514A08798E3404DD"
+    "EF9519B3CD3A431B302B0A6DF25F14374FE1356D6D51C245E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED"
+    "EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3DC2007CB8A163BF0598DA48361C55D39A69163FA8FD24CF5F"
+    "83655D23DCA3AD961C62F356208552BB9ED529077096966D670C354E4ABC9804F1746C08CA18217C32905E462E36CE3B"
+    "E39E772C180E86039B2783A2EC07A28FB5C55DF06F4C52C9DE2BCBF6955817183995497CEA956AE515D2261898FA0510"
+    "15728E5A8AACAA68FFFFFFFFFFFFFFFF", 16)
+DH_GROUP_BASE = 2
+
+def choose_cipher(offered: list[str]) -> str:
+    """
+        Picks the preferred cipher offered by the other side
+
+        INPUT: offered
+        OUTPUT: Cipher name (CIPHER_DEFAULT if nothing in common)
+
+        @offered -> Cipher names offered by the other side
+    """
+
+    for cipher in CIPHER_PREFERENCE:
+        if cipher in offered:
+            return cipher
+
+    return CIPHER_DEFAULT
+
+
+def choose_kex(offered: list[str]) -> str:
+    """
+        Picks the preferred key exchange method offered by the other side
+
+        INPUT: offered
+        OUTPUT: Key exchange name (KEX_DEFAULT if nothing in common)
+
+        @offered -> Key exchange names offered by the other side
+    """
+
+    for kex in KEX_PREFERENCE:
+        if kex in offered:
+            return kex
+
+    return KEX_DEFAULT
+
+
 class DiffieHellman:
     """
         Handles Diffie-Hellman key exchange
     """
 
+    # Private exponents are twice the bits of the group's security level
+    PRIVATE_KEY_BITS = 256
+
     def __init__(self, prime: int, base: int):
         """
             Initialize Diffie-Hellman with prime and base
@@ -36,12 +96,13 @@ class DiffieHellman:
         self.prime = prime
         self.base = base
         
+        # Use the fixed group instead of generating parameters on every login
         if self.prime == 0 or self.base == 0:
-            parameters = dh.generate_parameters(generator=2, key_size=512)
-            self.prime = parameters.parameter_numbers().p
-            self.base = parameters.parameter_numbers().g
+            self.prime = DH_GROUP_PRIME
+            self.base = DH_GROUP_BASE
             
         self.private_key = self._generate_private_key()
+        self.public_key = None
 
     def _generate_private_key(self) -> int:
         """
@@ -51,7 +112,8 @@ class DiffieHellman:
             OUTPUT: Private key (int)
         """
 
-        return randint(2, self.prime - 2)
+        upper = min(self.prime - 3, 2 ** self.PRIVATE_KEY_BITS)
+        return secrets.randbelow(upper) + 2
 
     def get_public_key(self) -> int:
         """
@@ -61,7 +123,10 @@ class DiffieHellman:
             OUTPUT: Public key (int)
         """
 
-        return pow(self.base, self.private_key, self.prime)
+        if self.public_key is None:
+            self.public_key = pow(self.base, self.private_key, self.prime)
+
+        return self.public_key
 
     def get_shared_secret(self, other_public_key: int) -> int:
         """
@@ -73,9 +138,52 @@ class DiffieHellman:
             @other_public_key -> The other party's public key
         """
 
+        # Reject keys which would force the secret into a tiny subgroup
+        if not 1 < other_public_key < self.prime - 1:
+            raise ValueError("Invalid Diffie-Hellman public key")
+
         return pow(other_public_key, self.private_key, self.prime)
 
 
+class X25519Exchange:
+    """
+        Handles X25519 key exchange
+    """
+
+    def __init__(self):
+        """
+            Initialize X25519 with a fresh private key
+
+            INPUT: None
+            OUTPUT: None
+        """
+
+        self.private_key = X25519PrivateKey.generate()
+
+    def get_public_key(self) -> str:
+        """
+            Returns the public key
+
+            INPUT: None
+            OUTPUT: Public key (hex string)
+        """
+
+        return self.private_key.public_key().public_bytes_raw().hex()
+
+    def get_shared_secret(self, other_public_key: str) -> bytes:
+        """
+            Computes the shared secret using the other party's public key
+
+            INPUT: other_public_key
+            OUTPUT: Shared secret (bytes)
+
+            @other_public_key -> The other party's public key (hex string)
+        """
+
+        peer_key = X25519PublicKey.from_public_bytes(bytes.fromhex(other_public_key))
+        return self.private_key.exchange(peer_key)
+
+
 class AESHandler:
     """
         Handles AES encryption and decryption in CBC mode
@@ -120,9 +228,9 @@ class AESHandler:
             INPUT: encrypted_data
             OUTPUT: Decrypted data (bytes)
 
-            @encrypted_data -> Data to decrypt (bytes), first AES.block_size bytes are for iv
+            @encrypted_data -> Data to decrypt (bytes-like), first AES.block_size bytes are for iv
         """
-        if type(encrypted_data) is not bytes:
+        if isinstance(encrypted_data, str):
             encrypted_data = encrypted_data.encode()
 
         decrypt_cipher = AES.new(self.key, AES.MODE_CBC, encrypted_data[:AES.block_size])
@@ -131,6 +239,76 @@ class AESHandler:
         return unpad(plain_text, AES.block_size)
 
 
+class AESGCMHandler:
+    """
+        Handles AES encryption and decryption in GCM mode
+        Nonces are counters, each direction of a session has its own nonce prefix
+        Not thread safe, the connection serializes its sends and its receives
+    """
+
+    COUNTER_LEN = 8
+    TAG_LEN = 16
+
+    def __init__(self, key: bytes, send_prefix: bytes, recv_prefix: bytes):
+        """
+            Initialize AESGCMHandler with a session key
+
+            INPUT: key, send_prefix, recv_prefix
+            OUTPUT: None
+
+            @key -> AES key (bytes), must be unique to the session
+            @send_prefix -> Nonce prefix of sent messages (4 bytes)
+            @recv_prefix -> Nonce prefix of received messages (4 bytes)
+        """
+        self.key = key
+        self.send_prefix = send_prefix
+        self.recv_prefix = recv_prefix
+        self.send_counter = 0
+        self.recv_counter = 0
+
+        # Key schedule is built once for the whole session
+        self.aead = AESGCM(key)
+
+    def encrypt(self, data: Union[bytes, str], associated_data: Optional[bytes] = None) -> bytes:
+        """
+            Encrypts data using AES in GCM mode
+
+            INPUT: data, associated_data
+            OUTPUT: Encrypted data followed by its tag (bytes)
+
+            @data -> Data to encrypt (bytes or str)
+            @associated_data -> Data sent in the clear which the tag also authenticates
+        """
+        if isinstance(data, str):
+            data = data.encode()
+
+        nonce = self.send_prefix + self.send_counter.to_bytes(self.COUNTER_LEN, "big")
+        self.send_counter += 1
+
+        return self.aead.encrypt(nonce, data, associated_data)
+
+    def decrypt(self, encrypted_data: bytes, associated_data: Optional[bytes] = None) -> bytes:
+        """
+            Decrypts and authenticates data using AES in GCM mode
+            Messages must be decrypted in the order they were encrypted
+
+            INPUT: encrypted_data, associated_data
+            OUTPUT: Decrypted data (bytes)
+
+            @encrypted_data -> Data to decrypt (bytes-like), last TAG_LEN bytes are the tag
+            @associated_data -> Data received in the clear, must be what the other side encrypted with
+        """
+        if isinstance(encrypted_data, str):
+            encrypted_data = encrypted_data.encode()
+
+        nonce = self.recv_prefix + self.recv_counter.to_bytes(self.COUNTER_LEN, "big")
+        plain_text = self.aead.decrypt(nonce, encrypted_data, associated_data)
+
+        # Only a message which passed authentication uses up its nonce
+        self.recv_counter += 1
+        return plain_text
+
+
 class EncryptionHandler:
     """
         Main class to handle all encryption tasks
@@ -147,7 +325,9 @@ class EncryptionHandler:
             @base -> Base number for DH
         """
         self.dh = DiffieHellman(prime, base)
+        self.x25519 = X25519Exchange()
         self.aes_handler = None
+        self.cipher = None
     
     def get_base_prime(self) -> tuple[int, int]:
         """
@@ -158,57 +338,136 @@ class EncryptionHandler:
         """
         return self.dh.base, self.dh.prime
 
-    def get_public_key(self) -> int:
+    def get_public_key(self, kex: str = KEX_DH) -> Union[int, str]:
         """
-            Returns the public key for Diffie-Hellman
+            Returns the public key of a key exchange method
 
-            INPUT: None
-            OUTPUT: Public key (int)
+            INPUT: kex
+            OUTPUT: Public key (int for Diffie-Hellman, hex string for X25519)
+
+            @kex -> Key exchange method (one of KEX_PREFERENCE)
         """
+        if kex == KEX_X25519:
+            return self.x25519.get_public_key()
+
         return self.dh.get_public_key()
 
-    def generate_shared_secret(self, other_public_key: int) -> None:
+    def generate_shared_secret(self, other_public_key: Union[int, str, bytes], cipher: str = CIPHER_DEFAULT,
+                               initiator: bool = True, kex: str = KEX_DH) -> None:
         """
-            Generates the shared secret and initializes AESHandler
+            Generates the shared secret and initializes the AES handler
 
-            INPUT: other_public_key
+            INPUT: other_public_key, cipher, initiator, kex
             OUTPUT: None
 
             @other_public_key -> The other party's public key
+            @cipher -> Agreed symmetric cipher (one of CIPHER_PREFERENCE)
+            @initiator -> Whether this side started the exchange (both sides must differ)
+            @kex -> Agreed key exchange method (one of KEX_PREFERENCE)
         """
-        shared_secret = self.dh.get_shared_secret(other_public_key)
+        if isinstance(other_public_key, bytes):
+            other_public_key = other_public_key.decode()
+
+        if kex == KEX_X25519:
+            shared_secret_bytes = self.x25519.get_shared_secret(other_public_key)
+        else:
+            shared_secret = self.dh.get_shared_secret(int(other_public_key))
+
+            # Ensure shared_secret is in bytes before hashing
+            shared_secret_bytes = shared_secret.to_bytes((shared_secret.bit_length() + 7) // 8, byteorder="little")
 
-        # Ensure shared_secret is in bytes before hashing
-        shared_secret_bytes = shared_secret.to_bytes((shared_secret.bit_length() + 7) // 8, byteorder="little")
         derived_key = hashlib.sha256(shared_secret_bytes).digest()
 
         # Use the derived key for AES
-        self.aes_handler = AESHandler(derived_key)
+        self.aes_handler = self.create_aes_handler(derived_key, cipher, initiator)
+        self.cipher = cipher
 
-    def encrypt(self, data: Union[bytes, str]) -> bytes:
+    def get_resumption_secret(self) -> bytes:
+        """
+            Derives a secret which allows resuming this session without a new key exchange
+
+            INPUT: None
+            OUTPUT: Resumption secret (bytes)
+        """
+        if self.aes_handler is None:
+            raise ValueError("Shared secret not generated")
+
+        return hashlib.sha256(b"resumption" + self.aes_handler.key).digest()
+
+    def resume_session(self, resumption_secret: bytes, salt: bytes, cipher: str, initiator: bool) -> None:
+        """
+            Initializes the AES handler from a previous session's resumption secret
+            A fresh salt from both sides makes sure a key is never used for two sessions
+
+            INPUT: resumption_secret, salt, cipher, initiator
+            OUTPUT: None
+
+            @resumption_secret -> Secret of the resumed session
+            @salt -> Random values of both sides
+            @cipher -> Cipher of the resumed session
+            @initiator -> Whether this side started the resumption
+        """
+        derived_key = hashlib.sha256(resumption_secret + salt).digest()
+
+        self.aes_handler = self.create_aes_handler(derived_key, cipher, initiator)
+        self.cipher = cipher
+
+    @staticmethod
+    def create_aes_handler(key: bytes, cipher: str, initiator: bool):
+        """
+            Creates the AES handler of an agreed cipher
+
+            INPUT: key, cipher, initiator
+            OUTPUT: AESHandler or AESGCMHandler
+
+            @key -> Session key
+            @cipher -> Agreed symmetric cipher
+            @initiator -> Whether this side started the exchange
+        """
+        if cipher == CIPHER_AES_GCM:
+            # Each direction gets its own nonce space
+            initiator_prefix, responder_prefix = b"\x00\x00\x00\x00", b"\x00\x00\x00\x01"
+            if initiator:
+                return AESGCMHandler(key, initiator_prefix, responder_prefix)
+            return AESGCMHandler(key, responder_prefix, initiator_prefix)
+
+        if cipher == CIPHER_AES_CBC:
+            return AESHandler(key)
+
+        raise ValueError(f"Unknown cipher {cipher}")
+
+    def encrypt(self, data: Union[bytes, str], associated_data: Optional[bytes] = None) -> bytes:
         """
             Encrypts data using AES
 
-            INPUT: data
+            INPUT: data, associated_data
             OUTPUT: Encrypted data (bytes)
 
             @data -> Data to encrypt (bytes or str)
+            @associated_data -> Data sent in the clear, authenticated with GCM (CBC authenticates nothing)
         """
         if self.aes_handler is None:
             raise ValueError("Shared secret not generated")
+
+        if self.cipher == CIPHER_AES_GCM:
+            return self.aes_handler.encrypt(data, associated_data)
         
         return self.aes_handler.encrypt(data)
 
-    def decrypt(self, encrypted_data: bytes) -> bytes:
+    def decrypt(self, encrypted_data: bytes, associated_data: Optional[bytes] = None) -> bytes:
         """
             Decrypts data using AES
 
-            INPUT: encrypted_data
+            INPUT: encrypted_data, associated_data
             OUTPUT: Decrypted data (bytes)
 
             @encrypted_data -> Data to decrypt (bytes)
+            @associated_data -> Data received in the clear, authenticated with GCM (CBC authenticates nothing)
         """
         if self.aes_handler is None:
             raise ValueError("Shared secret not generated")
+
+        if self.cipher == CIPHER_AES_GCM:
+            return self.aes_handler.decrypt(encrypted_data, associated_data)
         
         return self.aes_handler.decrypt(encrypted_data)
\ No newline at end of file
@@ -7,10 +7,14 @@
 #   Omer Kfir (C)
 
 import socket
-from encryption import EncryptionHandler
+import struct
+from encryption import EncryptionHandler, CIPHER_PREFERENCE, CIPHER_DEFAULT, choose_cipher, KEX_PREFERENCE, KEX_DEFAULT, KEX_X25519, KEX_DH, choose_kex
+from compression import CompressionHandler, available_codecs, choose_codec, DECOMPRESS_MAX_LEN
 from typing import Optional, Tuple, Union
 from random import randint
 import zlib
+import secrets
+import threading
 import traceback
 
 __author__ = "Omer Kfir"
@@ -20,11 +24,21 @@ DEBUG_FLAG = False
 
 class MessageParser:
     PROTOCOL_SEPARATOR = b"\x1f"
+    PROTOCOL_RECORD_SEPARATOR = b"\x1e"
+
+    # Options are sent as fields of "name=value", lists inside values are seperated by ","
+    PROTOCOL_OPTION_SEPARATOR = "="
+    PROTOCOL_LIST_SEPARATOR = ","
     PROTOCOL_DATA_INDEX = 1
 
     SIG_MSG_INDEX = 0
 
     ENCRYPTION_EXCHANGE = "EXH"
+    EXCHANGE_OPTION_CODEC = "codec"
+    EXCHANGE_OPTION_CIPHER = "cipher"
+    EXCHANGE_OPTION_KEX = "kex"
+    EXCHANGE_OPTION_KEY_SHARE = "share"
+    FRAMING_NEGOTIATION = "FRN"
 
     # Message types
     CLIENT_MSG_SIG = "C"
@@ -35,6 +49,9 @@ class MessageParser:
     CLIENT_CPU_USAGE = "CCU"
     CLIENT_IP_INTERACTION = "COT"
 
+    # Several client messages packed in one frame, records are seperated by PROTOCOL_RECORD_SEPARATOR
+    CLIENT_MSG_BATCH = "CBT"
+
     CLIENT_ALL_MSG = {CLIENT_MSG_SIG, CLIENT_MSG_AUTH, CLIENT_PROCESS_OPEN,
                       CLIENT_PROCESS_CLOSE, CLIENT_INPUT_EVENT, CLIENT_CPU_USAGE, CLIENT_IP_INTERACTION}
 
@@ -63,6 +80,9 @@ class MessageParser:
     MANAGER_VALID_CONN = "MVC"
     MANAGER_ALREADY_CONNECTED = "MAC"
 
+    # Manager resumes a previous session with a ticket instead of a password
+    MANAGER_RESUME_SESSION = "MRS"
+
     # Name of client not found
     MANAGER_CLIENT_NOT_FOUND = "MNF"
 
@@ -93,12 +113,8 @@ class MessageParser:
             @args -> The rest of the data to be sent in the message
         """
         
-        msg_buf = MessageParser.encode_str(msg_type)
-        
-        for argument in args:
-            msg_buf += MessageParser.PROTOCOL_SEPARATOR + MessageParser.encode_str(argument)
-        
-        return msg_buf
+        # Single join instead of concatenating, which copies the message again for every field
+        return MessageParser.PROTOCOL_SEPARATOR.join([MessageParser.encode_str(msg_type), *map(MessageParser.encode_str, args)])
         
     @staticmethod
     def protocol_message_deconstruct(msg : bytes, part_split : int = -1) -> list[bytes]:
@@ -113,14 +129,146 @@ class MessageParser:
         """
         
         if msg != b'':
+            # Frames may arrive as views into the socket's receive buffer
+            if isinstance(msg, memoryview):
+                msg = msg.tobytes()
+
             msg = msg.split(MessageParser.PROTOCOL_SEPARATOR, part_split)
         
         return msg
         
 
+    @staticmethod
+    def protocol_batch_construct(records : list[tuple]) -> bytes:
+        """
+            Constructs a batch message out of several messages
+            
+            INPUT: records
+            OUTPUT: Byte stream of the batch message
+            
+            @records -> List of tuples, each is message type followed by its arguments
+        """
+
+        batch = MessageParser.PROTOCOL_RECORD_SEPARATOR.join(
+            MessageParser.protocol_message_construct(*record) for record in records
+        )
+
+        return MessageParser.protocol_message_construct(MessageParser.CLIENT_MSG_BATCH, batch)
+
+    @staticmethod
+    def protocol_batch_deconstruct(batch : bytes) -> list[list[bytes]]:
+        """
+            Splits the data of a batch message into its records
+            
+            INPUT: batch
+            OUTPUT: List of records, each is a list of message type and message data
+            
+            @batch -> Data of a batch message (without the message type)
+        """
+
+        if isinstance(batch, memoryview):
+            batch = batch.tobytes()
+
+        return [
+            record.split(MessageParser.PROTOCOL_SEPARATOR, MessageParser.PROTOCOL_DATA_INDEX)
+            for record in batch.split(MessageParser.PROTOCOL_RECORD_SEPARATOR) if record
+        ]
+
+
+    @staticmethod
+    def protocol_options_construct(options : dict) -> list[str]:
+        """
+            Constructs option fields to be sent as message arguments
+            
+            INPUT: options
+            OUTPUT: List of option fields
+            
+            @options -> Dictionary of option names and values (lists are joined)
+        """
+
+        fields = []
+        for name, value in options.items():
+            if isinstance(value, (list, tuple)):
+                value = MessageParser.PROTOCOL_LIST_SEPARATOR.join(value)
+            
+            fields.append(f"{name}{MessageParser.PROTOCOL_OPTION_SEPARATOR}{value}")
+
+        return fields
+
+    @staticmethod
+    def protocol_options_deconstruct(fields : list[bytes]) -> dict[str, str]:
+        """
+            Deconstructs option fields of a message, fields which are not options are ignored
+            
+            INPUT: fields
+            OUTPUT: Dictionary of option names and values
+            
+            @fields -> Message fields
+        """
+
+        options = {}
+        for field in fields:
+            name, sep, value = MessageParser.encode_str(field).decode().partition(MessageParser.PROTOCOL_OPTION_SEPARATOR)
+            if sep:
+                options[name] = value
+
+        return options
+
+    @staticmethod
+    def compression_dictionary() -> bytes:
+        """
+            Builds a preset compression dictionary out of the protocol's vocabulary
+            Strings which appear most in messages are placed last (closest to compressed data)
+            
+            INPUT: None
+            OUTPUT: Byte stream of the dictionary
+        """
+
+        message_types = [
+            value for name, value in vars(MessageParser).items()
+            if name.startswith(("CLIENT_", "MANAGER_")) and isinstance(value, str) and len(value) == 3
+        ]
+
+        # Keys of the statistics sent to manager
+        stats_vocabulary = [
+            '{"processes": {"labels": [', '"inactivity": {"labels": [', '"wpm": ',
+            '"cpu_usage": {"labels": [', '"data": {"cores": [', '"usage": [[',
+            '"ips": {"labels": [', '], "data": [', ', "', '", "', '}}'
+        ]
+
+        vocabulary = MessageParser.PROTOCOL_SEPARATOR.join(MessageParser.encode_str(msg) for msg in sorted(message_types))
+        return vocabulary + "".join(stats_vocabulary).encode()
+
+
 class TCPsocket:
     MSG_LEN_LEN = 4
     CHUNK_MAX_LEN = (1024 * 4)
+    RECV_BUFFER_LEN = (1024 * 4)
+
+    # Frame formats
+    # Legacy -> ascii zero filled length (used by kernel agents)
+    # V2 -> 32 bit big endian length followed by a flags byte
+    FRAMING_LEGACY = 1
+    FRAMING_V2 = 2
+    FRAMING_VERSIONS = (FRAMING_LEGACY, FRAMING_V2)
+
+    # Seconds to wait for the framing answer, servers from before negotiation
+    # Never answer and drop connections whose key exchange does not start within 5 seconds
+    FRAMING_ANSWER_TIMEOUT = 2
+
+    # Max amount of buffers handed to a single sendmsg call
+    SEND_IOV_MAX = 1024
+
+    LEGACY_MAX_LEN = (10 ** MSG_LEN_LEN) - 1
+    V2_HEADER = struct.Struct("!IB")
+    V2_FLAGS = struct.Struct("!B") # Flags part of the header, authenticated as GCM associated data
+    V2_MAX_LEN = (1024 * 1024 * 16)
+
+    FRAME_FLAG_NONE = 0x00
+    FRAME_FLAG_COMPRESSED = 0x01
+
+    # The server keeps one of these per connection
+    __slots__ = ("__sock", "__ip", "__framing", "__recv_buf", "__recv_view", "__bytes_in", "__bytes_out")
 
     def __init__(self, sock: Optional[socket.socket] = None):
         """
@@ -133,6 +281,17 @@ class TCPsocket:
         """
         
         self.__ip = ""
+        self.__framing = self.FRAMING_LEGACY
+
+        # Reusable receive buffer, frames are read into it with recv_into
+        # Allocated on first receive, connections served by asyncio streams never need it
+        self.__recv_buf = bytearray()
+        self.__recv_view = memoryview(self.__recv_buf)
+
+        # Bytes received and sent, headers included
+        self.__bytes_in = 0
+        self.__bytes_out = 0
+
         if sock is None:
             self.__sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         
@@ -152,6 +311,31 @@ class TCPsocket:
 
         self.__sock.settimeout(time)
     
+    def set_framing(self, version : int) -> None:
+        """
+            Sets the frame format used on this socket
+            
+            INPUT: version
+            OUTPUT: None
+            
+            @version -> One of FRAMING_VERSIONS
+        """
+
+        if version not in self.FRAMING_VERSIONS:
+            raise ValueError(f"Unknown framing version {version}")
+
+        self.__framing = version
+
+    def get_framing(self) -> int:
+        """
+            Returns the frame format used on this socket
+            
+            INPUT: None
+            OUTPUT: Framing version
+        """
+
+        return self.__framing
+
     def get_ip(self) -> str:
         """
             Returns the IP of the socket
@@ -162,6 +346,37 @@ class TCPsocket:
         
         return self.__ip
     
+    def add_traffic(self, received : int, sent : int) -> None:
+        """
+            Counts bytes moved over the socket
+            
+            INPUT: received, sent
+            OUTPUT: None
+        """
+
+        self.__bytes_in += received
+        self.__bytes_out += sent
+
+    def get_traffic(self) -> tuple[int, int]:
+        """
+            Returns the amount of bytes received and sent
+            
+            INPUT: None
+            OUTPUT: Tuple of bytes received and bytes sent
+        """
+
+        return self.__bytes_in, self.__bytes_out
+
+    def get_socket(self) -> socket.socket:
+        """
+            Returns the underlying socket object, used to hand a connection to another process
+            
+            INPUT: None
+            OUTPUT: Socket object
+        """
+        
+        return self.__sock
+    
     def create_server_socket(self, bind_ip : str, bind_port : int, server_listen : int) -> None:
         """
             Prepare a server tcp socket
@@ -216,6 +431,20 @@ class TCPsocket:
 
         self.__sock.close()
 
+    def shutdown(self):
+        """
+            Shuts the connection down, a thread waiting on the socket wakes up
+            Can be called from any thread, the socket still has to be closed
+            
+            INPUT: None
+            OUTPUT: None
+        """
+
+        try:
+            self.__sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
     def log(self, prefix : str, data: Union[bytes, str], max_to_print: int=DEBUG_PRINT_LEN) -> None:
         """
             Prints 'max_to_print' amount of data from 'data'
@@ -232,6 +461,9 @@ class TCPsocket:
             return
         
         data_to_log = data[:max_to_print]
+        if isinstance(data_to_log, memoryview):
+            data_to_log = data_to_log.tobytes()
+
         if type(data_to_log) == bytes:
             try:
                 data_to_log = data_to_log.decode()
@@ -241,100 +473,249 @@ class TCPsocket:
         print(f"\n{prefix}({len(data)})>>>{data_to_log}")
 
 
-    def __recv_amount(self, size : int) -> bytes:
+    def __reserve_recv_buffer(self, size : int) -> None:
+        """
+            Makes sure the receive buffer can hold 'size' bytes
+            
+            INPUT: size
+            OUTPUT: None
+            
+            @size -> Amount of bytes the next read needs
+        """
+
+        if size <= len(self.__recv_buf):
+            return
+
+        # Views handed out earlier pin the old buffer, so a new one is allocated
+        # Instead of resizing it in place
+        self.__recv_buf = bytearray(max(size, len(self.__recv_buf) * 2, self.RECV_BUFFER_LEN))
+        self.__recv_view = memoryview(self.__recv_buf)
+
+    def __recv_amount(self, size : int) -> memoryview:
         """
             Recevies specified amount of data from connected side
+            Data is read straight into the receive buffer without intermediate copies
             
-            INPUT: None
-            OUTPUT: Byte stream
+            INPUT: size
+            OUTPUT: View of the received bytes (empty if connection closed)
             
-            @data -> Stream of bytes
+            @size -> Amount of bytes to receive
         """
         
-        
-        buffer = b''
-        
+        self.__reserve_recv_buffer(size)
+        view = self.__recv_view[:size]
+        received = 0
+
         # Recv until 'size' amount of bytes is received
-        while size:
-            # Receive data in chunks with max size of 'CHUNK_MAX_LEN'
-            tmp_buf = self.__sock.recv(min(size, self.CHUNK_MAX_LEN))
+        while received < size:
+            amount = self.__sock.recv_into(view[received:], size - received)
             
-            if not tmp_buf:
-                return b''
+            if not amount:
+                return memoryview(b'')
             
-            buffer += tmp_buf
-            size -= len(tmp_buf)
+            received += amount
         
-        return buffer
+        return view
 
 
-    def recv(self) -> bytes:
+    def __recv_header(self) -> tuple[int, int]:
         """
-            Recevies data from connected side
+            Receives a frame header by the socket's framing version
+            
+            INPUT: None
+            OUTPUT: Tuple of message length and frame flags (length is -1 if connection closed or header invalid)
+        """
+
+        header = self.__recv_amount(self.header_len())
+        if not header:
+            return -1, self.FRAME_FLAG_NONE
+
+        return self.parse_header(header)
+
+    def header_len(self) -> int:
+        """
+            Returns the length of a frame header by the socket's framing version
             
             INPUT: None
-            OUTPUT: Byte stream
+            OUTPUT: Header length
+        """
+
+        return self.V2_HEADER.size if self.__framing == self.FRAMING_V2 else self.MSG_LEN_LEN
+
+    def parse_header(self, header : Union[bytes, memoryview]) -> tuple[int, int]:
+        """
+            Parses a frame header by the socket's framing version
+            
+            INPUT: header
+            OUTPUT: Tuple of message length and frame flags (length is -1 if header invalid)
             
-            @data -> Stream of bytes
+            @header -> Header bytes, header_len() long
+        """
+
+        if self.__framing == self.FRAMING_V2:
+            data_len, flags = self.V2_HEADER.unpack(header)
+            if data_len > self.V2_MAX_LEN:
+                return -1, self.FRAME_FLAG_NONE
+            
+            return data_len, flags
+
+        try:
+            return int(bytes(header)), self.FRAME_FLAG_NONE
+        except ValueError:
+            return -1, self.FRAME_FLAG_NONE
+
+    def recv_frame(self) -> tuple[int, Union[memoryview, bytes]]:
+        """
+            Recevies a frame from connected side
+            The returned view points into the receive buffer and is only valid until the next recv
+            
+            INPUT: None
+            OUTPUT: Tuple of frame flags and view of the received message (b'' if connection closed)
         """
         
-        data = b''
-        data_len = self.__recv_amount(self.MSG_LEN_LEN) #  Recv length of message
+        data_len, flags = self.__recv_header()
 
-        if data_len == b'':
+        if data_len == -1:
             ip = self.get_ip()
             if ip:
                 print(f"\nConnection forcibly closed by {ip}")
             else:
                 print("\nConnection forcibly closed")
-            return data_len
-        
-        try:
-            data_len = int(data_len)
-        except Exception:
-            return b''
+            return flags, b''
 
         # Recv actual message and log it
         data = self.__recv_amount(data_len)
+        if not data:
+            return flags, b''
+
+        self.__bytes_in += self.header_len() + data_len
         self.log("Receive", data)
         
-        return data
+        return flags, data
+
+    def recv(self) -> Union[memoryview, bytes]:
+        """
+            Recevies data from connected side
+            
+            INPUT: None
+            OUTPUT: View of the received message (b'' if connection closed)
+        """
 
+        return self.recv_frame()[1]
 
-    def send(self, data : Union[bytes, str]):
+    def __frame_header(self, length : int, flags : int) -> bytes:
         """
-            Sends data to connected side
+            Builds a frame header by the socket's framing version
+            
+            INPUT: length, flags
+            OUTPUT: Header bytes
             
-            INPUT: data
+            @length -> Length of the message
+            @flags -> Frame flags (ignored by legacy framing)
+        """
+
+        if self.__framing == self.FRAMING_V2:
+            if length > self.V2_MAX_LEN:
+                raise ValueError(f"Message of {length} bytes exceeds frame limit")
+            
+            return self.V2_HEADER.pack(length, flags)
+
+        if length > self.LEGACY_MAX_LEN:
+            raise ValueError(f"Message of {length} bytes exceeds legacy frame limit")
+
+        return b"%0*d" % (self.MSG_LEN_LEN, length)
+
+    def __send_buffers(self, buffers : list) -> None:
+        """
+            Writes buffers to the socket as a single stream
+            Uses scatter/gather sendmsg when available so buffers are never joined
+            
+            INPUT: buffers
             OUTPUT: None
             
-            @data -> Stream of bytes (can also be a simple string)
+            @buffers -> List of bytes-like objects
         """
-        
-        length = len(data)
-        
-        if length == 0:
+
+        if not hasattr(self.__sock, "sendmsg"):
+            # Platforms without sendmsg (Windows) get one joined buffer and a single sendall
+            self.__sock.sendall(b"".join(buffers))
             return
-            
-        if type(data) != bytes:
-            data = data.encode()
-        
-        # Pad data with its length
-        len_data = str(length).zfill(self.MSG_LEN_LEN).encode()
-        data = len_data + data
-        
-        # Send data and log it
-        total_sent = 0
-        while total_sent < len(data):
-            to_send = data[total_sent:total_sent + self.CHUNK_MAX_LEN]
-            sent = self.__sock.send(to_send)
+
+        views = [memoryview(buf).cast("B") for buf in buffers if len(buf)]
+        index = 0
+
+        while index < len(views):
+            sent = self.__sock.sendmsg(views[index:index + self.SEND_IOV_MAX])
 
             if sent == 0:
                 raise RuntimeError("Socket connection broken")
+
+            # Skip buffers which were fully sent and trim a partially sent one
+            while index < len(views) and sent >= len(views[index]):
+                sent -= len(views[index])
+                index += 1
+
+            if sent:
+                views[index] = views[index][sent:]
+
+    def frame_buffers(self, frames : list[tuple[Union[bytes, memoryview, str], int]]) -> list:
+        """
+            Builds the buffers which make up several frames, headers and data alternating
             
-            total_sent += sent
+            INPUT: frames
+            OUTPUT: List of bytes-like objects
             
-        self.log("Sent", data)
+            @frames -> List of tuples of data and frame flags (flags only sent with v2 framing)
+        """
+
+        buffers = []
+        for data, flags in frames:
+            if isinstance(data, str):
+                data = data.encode()
+
+            length = len(data)
+            if length == 0:
+                continue
+
+            # Pad data with its length
+            buffers.append(self.__frame_header(length, flags))
+            buffers.append(data)
+
+        return buffers
+
+    def send_frames(self, frames : list[tuple[Union[bytes, memoryview, str], int]]) -> None:
+        """
+            Sends several frames to connected side with as few syscalls as possible
+            
+            INPUT: frames
+            OUTPUT: None
+            
+            @frames -> List of tuples of data and frame flags (flags only sent with v2 framing)
+        """
+
+        buffers = self.frame_buffers(frames)
+        if not buffers:
+            return
+
+        # Send data and log it
+        self.__send_buffers(buffers)
+        self.__bytes_out += sum(len(buf) for buf in buffers)
+
+        for data in buffers[1::2]:
+            self.log("Sent", data)
+
+    def send(self, data : Union[bytes, memoryview, str], flags : int = FRAME_FLAG_NONE):
+        """
+            Sends data to connected side
+            
+            INPUT: data, flags
+            OUTPUT: None
+            
+            @data -> Stream of bytes (can also be a simple string)
+            @flags -> Frame flags, only sent with v2 framing
+        """
+        
+        self.send_frames([(data, flags)])
 
     @staticmethod
     def get_free_port() -> int:
@@ -353,6 +734,8 @@ class TCPsocket:
     
 
 class client (TCPsocket):
+
+    __slots__ = ("__mac", "__unsafe_msg_cnt", "__encryption", "__compression", "__send_lock", "__recv_lock", "__legacy_peer")
     
     def __init__(self, sock: Optional[socket.socket] = None, manager: bool = False):
         """
@@ -377,6 +760,17 @@ class client (TCPsocket):
         # Encryption handler
         self.__encryption = ...
 
+        # Compression streams, only used with v2 framing
+        self.__compression = None
+
+        # Nonce counters and compression streams carry state from one message to the next
+        # So threads sharing the connection send one at a time and receive one at a time
+        self.__send_lock = threading.Lock()
+        self.__recv_lock = threading.Lock()
+
+        # Set when the other side is from before framing negotiation, it only knows the legacy key exchange
+        self.__legacy_peer = False
+
         # If its a manager object then only build base for encryption
         if manager:
             self.__encryption = EncryptionHandler()
@@ -403,38 +797,81 @@ class client (TCPsocket):
         
         return self.__mac
     
+    def __recv_exchange(self) -> Optional[list[bytes]]:
+        """
+            Receives a key exchange message
+            
+            INPUT: None
+            OUTPUT: List of message fields (None if message is not a key exchange message)
+        """
+
+        data_type, data = self.protocol_recv(1, decrypt=False)
+        if data_type.decode() != MessageParser.ENCRYPTION_EXCHANGE:
+            return None
+
+        return MessageParser.protocol_message_deconstruct(data)
+
     def exchange_keys(self) -> bool:
         """
             Exchange keys between client and server
+            Manager offers its connection options, server answers with its public key and the chosen options
+            With Diffie-Hellman the manager then sends its public key, with X25519 it was already in the offer
             
             INPUT: None
             OUTPUT: boolean value which indicated wether managed to exchange keys successfully
         """
 
         try:
-            if self.__encryption is not Ellipsis:
+            manager = self.__encryption is not Ellipsis
+
+            if manager:
                 # If client is a manager object
-                sent = self.protocol_send(MessageParser.ENCRYPTION_EXCHANGE, *self.__encryption.get_base_prime(), encrypt=False)
+                # Servers from before negotiation read only base and prime, they answer without options (Diffie-Hellman, AES-CBC)
+                offers = [] if self.__legacy_peer else MessageParser.protocol_options_construct(self.__exchange_offers())
+                sent = self.protocol_send(MessageParser.ENCRYPTION_EXCHANGE, *self.__encryption.get_base_prime(), *offers, encrypt=False)
                 if sent == 0:
                     return False
+
+                data = self.__recv_exchange()
+                if data is None:
+                    return False
+
+                peer_key = data[0]
+                options = MessageParser.protocol_options_deconstruct(data[1:])
+                kex = options.get(MessageParser.EXCHANGE_OPTION_KEX, KEX_DEFAULT)
+
+                if kex == KEX_DH:
+                    sent = self.protocol_send(MessageParser.ENCRYPTION_EXCHANGE, self.__encryption.get_public_key(KEX_DH), encrypt=False)
+                    if sent == 0:
+                        return False
             else:
                 # If client is a server object
-                data_type, data = self.protocol_recv(1, decrypt=False)
-                if data_type.decode() != MessageParser.ENCRYPTION_EXCHANGE:
+                data = self.__recv_exchange()
+                if data is None:
                     return False
                 
-                data = MessageParser.protocol_message_deconstruct(data, 1)
                 self.__encryption = EncryptionHandler(int(data[0]), int(data[1]))
+                offers = MessageParser.protocol_options_deconstruct(data[2:])
+                options = self.__choose_options(offers)
+                kex = options.get(MessageParser.EXCHANGE_OPTION_KEX, KEX_DEFAULT)
 
-            sent = self.protocol_send(MessageParser.ENCRYPTION_EXCHANGE, self.__encryption.dh.get_public_key(), encrypt=False)
-            if sent == 0:
-                return False
-            
-            data_type, data = self.protocol_recv(1, decrypt=False)
-            if data_type.decode() != MessageParser.ENCRYPTION_EXCHANGE:
-                return False
-            
-            self.__encryption.generate_shared_secret(int(data))
+                sent = self.protocol_send(MessageParser.ENCRYPTION_EXCHANGE, self.__encryption.get_public_key(kex),
+                                          *MessageParser.protocol_options_construct(options), encrypt=False)
+                if sent == 0:
+                    return False
+
+                if kex == KEX_DH:
+                    data = self.__recv_exchange()
+                    if data is None:
+                        return False
+                    
+                    peer_key = data[0]
+                else:
+                    peer_key = offers[MessageParser.EXCHANGE_OPTION_KEY_SHARE]
+
+            cipher = options.get(MessageParser.EXCHANGE_OPTION_CIPHER, CIPHER_DEFAULT)
+            self.__encryption.generate_shared_secret(peer_key, cipher, initiator=manager, kex=kex)
+            self.__apply_options(options)
             return True
         except (ConnectionResetError, ValueError) as e:
             return False
@@ -443,6 +880,197 @@ class client (TCPsocket):
             print(traceback.format_exc())
             return False
 
+    def __exchange_offers(self) -> dict:
+        """
+            Builds the connection options this side supports
+            
+            INPUT: None
+            OUTPUT: Dictionary of option names and offered values
+        """
+
+        offers = {
+            MessageParser.EXCHANGE_OPTION_CIPHER: CIPHER_PREFERENCE,
+            MessageParser.EXCHANGE_OPTION_KEX: KEX_PREFERENCE,
+            MessageParser.EXCHANGE_OPTION_KEY_SHARE: self.__encryption.get_public_key(KEX_X25519),
+        }
+
+        # Codecs are only switched on connections with compression streams (v2 framing)
+        if self.__compression is not None:
+            offers[MessageParser.EXCHANGE_OPTION_CODEC] = available_codecs()
+
+        return offers
+
+    def __choose_options(self, offers : dict[str, str]) -> dict:
+        """
+            Picks connection options out of the other side's offers
+            
+            INPUT: offers
+            OUTPUT: Dictionary of option names and chosen values
+            
+            @offers -> Options offered by the other side
+        """
+
+        options = {}
+
+        # X25519 can only be picked when the other side already sent its key share
+        if MessageParser.EXCHANGE_OPTION_KEX in offers:
+            kexes = offers[MessageParser.EXCHANGE_OPTION_KEX].split(MessageParser.PROTOCOL_LIST_SEPARATOR)
+            if MessageParser.EXCHANGE_OPTION_KEY_SHARE not in offers:
+                kexes = [kex for kex in kexes if kex != KEX_X25519]
+
+            options[MessageParser.EXCHANGE_OPTION_KEX] = choose_kex(kexes)
+
+        if MessageParser.EXCHANGE_OPTION_CIPHER in offers:
+            ciphers = offers[MessageParser.EXCHANGE_OPTION_CIPHER].split(MessageParser.PROTOCOL_LIST_SEPARATOR)
+            options[MessageParser.EXCHANGE_OPTION_CIPHER] = choose_cipher(ciphers)
+
+        if MessageParser.EXCHANGE_OPTION_CODEC in offers and self.__compression is not None:
+            codecs = offers[MessageParser.EXCHANGE_OPTION_CODEC].split(MessageParser.PROTOCOL_LIST_SEPARATOR)
+            options[MessageParser.EXCHANGE_OPTION_CODEC] = choose_codec(codecs)
+
+        return options
+
+    def __apply_options(self, options : dict[str, str]) -> None:
+        """
+            Switches the connection to the agreed options
+            Called once both sides received every key exchange message
+            
+            INPUT: options
+            OUTPUT: None
+            
+            @options -> Agreed options
+        """
+
+        codec = options.get(MessageParser.EXCHANGE_OPTION_CODEC)
+        if codec and self.__compression is not None:
+            self.__compression = CompressionHandler(codec, zdict=MessageParser.compression_dictionary())
+
+    def export_session(self) -> dict:
+        """
+            Returns the state needed to resume this session later
+            
+            INPUT: None
+            OUTPUT: Dictionary of session state
+        """
+
+        return {
+            "secret": self.__encryption.get_resumption_secret(),
+            "cipher": self.__encryption.cipher,
+            "codec": self.__compression.codec_name if self.__compression is not None else None,
+            "framing": self.get_framing(),
+        }
+
+    def restore_session(self, session : dict, salt : bytes, initiator : bool) -> None:
+        """
+            Switches the connection to a resumed session
+            
+            INPUT: session, salt, initiator
+            OUTPUT: None
+            
+            @session -> Session state created by export_session
+            @salt -> Random values of both sides
+            @initiator -> Whether this side started the resumption
+        """
+
+        if self.__encryption is Ellipsis:
+            self.__encryption = EncryptionHandler()
+
+        self.__encryption.resume_session(session["secret"], salt, session["cipher"], initiator)
+        self.set_framing(session["framing"])
+
+        if session["codec"] is not None:
+            self.__compression = CompressionHandler(session["codec"], zdict=MessageParser.compression_dictionary())
+
+    def resume_session(self, ticket : str, session : dict) -> Optional[list[bytes]]:
+        """
+            Resumes a previous session with a ticket, skipping key exchange and password
+            
+            INPUT: ticket, session
+            OUTPUT: Fields of the server's answer (new ticket and its lifetime), None if resumption failed
+            
+            @ticket -> Ticket issued by the server for the session
+            @session -> Session state created by export_session
+        """
+
+        try:
+            client_random = secrets.token_hex(16)
+            sent = self.protocol_send(MessageParser.MANAGER_RESUME_SESSION, ticket, client_random, encrypt=False, compress=False)
+            if sent == 0:
+                return None
+            
+            data = self.protocol_recv(decrypt=False, decompress=False)
+            if data == b'' or data == b'ERR' or data[0].decode() != MessageParser.MANAGER_RESUME_SESSION:
+                return None
+            
+            self.restore_session(session, (client_random + data[1].decode()).encode(), initiator=True)
+
+            # Server's first encrypted message confirms both sides derived the same key
+            data = self.protocol_recv()
+            if data == b'' or data == b'ERR' or data[0].decode() != MessageParser.MANAGER_VALID_CONN:
+                return None
+            
+            return data[1:]
+        
+        except (ValueError, IndexError):
+            return None
+
+    def negotiate_framing(self, offered : Optional[bytes] = None) -> bool:
+        """
+            Agree on a frame format with the other side
+            Side which offered its versions (offered is None) waits for the decision
+            Side which received the offer picks the highest common version and answers
+            An offering side which gets no answer in FRAMING_ANSWER_TIMEOUT keeps legacy framing
+            
+            INPUT: offered
+            OUTPUT: boolean value which indicated wether managed to negotiate successfully
+            
+            @offered -> Framing versions received from the other side
+        """
+
+        try:
+            if offered is None:
+                recv_timeout = self.get_socket().gettimeout()
+                self.set_timeout(self.FRAMING_ANSWER_TIMEOUT)
+                try:
+                    data = self.protocol_recv(MessageParser.PROTOCOL_DATA_INDEX, decrypt=False, decompress=False)
+                finally:
+                    self.set_timeout(recv_timeout)
+
+                # Servers from before negotiation do not answer, they wait for the key exchange
+                # So keep legacy framing and the legacy key exchange for them
+                if data == b'ERR':
+                    self.__legacy_peer = True
+                    return True
+
+                if data == b'' or data[0].decode() != MessageParser.FRAMING_NEGOTIATION:
+                    return False
+
+                version = int(data[1])
+            else:
+                # Peers which do not know about negotiation do not offer anything
+                # And do not wait for an answer, keep legacy framing for them
+                if not offered:
+                    return True
+
+                offered = {int(v) for v in MessageParser.protocol_message_deconstruct(offered)}
+                common = offered.intersection(self.FRAMING_VERSIONS)
+                version = max(common) if common else self.FRAMING_LEGACY
+
+                sent = self.protocol_send(MessageParser.FRAMING_NEGOTIATION, version, encrypt=False, compress=False)
+                if sent == 0:
+                    return False
+            
+            self.set_framing(version)
+
+            # Connections with v2 framing compress with persistent streams
+            if version == self.FRAMING_V2:
+                self.__compression = CompressionHandler(zdict=MessageParser.compression_dictionary())
+
+            return True
+        
+        except (ValueError, IndexError):
+            return False
+
     def connect(self, dst_ip : str, dst_port : int) -> bool:
         """
             Connect client to server and exchange keys
@@ -476,35 +1104,105 @@ class client (TCPsocket):
             @decompress -> Boolean to sign if to decompress data
         """
         try:
-            data = self.recv()
-            if data == b'':
-                return data
-            
-            if decrypt:
-                data = self.__encryption.decrypt(data)
-
-            if decompress:
-                data = zlib.decompress(data)
-            
-            data = MessageParser.protocol_message_deconstruct(data, part_split)
-            return data
+            with self.__recv_lock:
+                flags, data = self.recv_frame()
+                if data == b'':
+                    return data
+                
+                return self.unpack_message(flags, data, part_split, decrypt, decompress)
         
         except socket.timeout:
             return b'ERR'
         
         except OSError as e:
-            if e.winerror == 10054:
+            if getattr(e, "winerror", None) == 10054:
                 ip = self.get_ip()
                 if ip:
                     print(f"\nConnection forcibly closed by {ip}")
                 else:
                     print("\nConnection forcibly closed")
-                return b''
+            return b''
 
         except Exception as e:
             print(e)
             return b''
         
+    def unpack_message(self, flags : int, data : Union[bytes, memoryview], part_split : int = -1,
+                       decrypt : bool = True, decompress : bool = True) -> list[bytes]:
+        """
+            Decrypts, decompresses and splits a received frame by protocol
+            Frames must be unpacked one at a time in the order they were received
+            
+            INPUT: flags, data, part_split, decrypt, decompress
+            OUTPUT: List of byte streams
+            
+            @flags -> Frame flags
+            @data -> Frame data
+            @part_split -> Number of fields to seperate from start of message
+            @decrypt -> Boolean to sign if to decrypt
+            @decompress -> Boolean to sign if to decompress data
+        """
+
+        if decrypt:
+            # The flags travel outside the ciphertext, so they are authenticated with it
+            data = self.__encryption.decrypt(data, self.V2_FLAGS.pack(flags))
+
+        if decompress:
+            if self.__compression is None:
+                # Legacy messages are whole zlib streams, bounded like the negotiated codecs
+                decompressor = zlib.decompressobj()
+                data = decompressor.decompress(data, DECOMPRESS_MAX_LEN)
+                if decompressor.unconsumed_tail or not decompressor.eof:
+                    raise ValueError("Decompressed message is too long or truncated")
+            elif flags & self.FRAME_FLAG_COMPRESSED:
+                data = self.__compression.decompress(data)
+        
+        return MessageParser.protocol_message_deconstruct(data, part_split)
+
+    def pack_frames(self, messages : list[tuple], encrypt : bool = True, compress : bool = True) -> list[tuple[bytes, int]]:
+        """
+            Builds frames of several messages, ready to be sent
+            Frames must be sent in the order they were packed, before other frames are packed
+            
+            INPUT: messages, encrypt, compress
+            OUTPUT: List of tuples of message payload and frame flags
+            
+            @messages -> List of tuples, each is message type followed by its arguments
+            @encrypt -> Boolean to indicate if to encrypt
+            @compress -> Boolean to indicate if to compress
+        """
+
+        return [self.__pack_message(msg[0], msg[1:], encrypt, compress) for msg in messages]
+
+    def __pack_message(self, msg_type, args : tuple, encrypt : bool, compress : bool) -> tuple[bytes, int]:
+        """
+            Builds a message ready to be framed
+            
+            INPUT: msg_type, args, encrypt, compress
+            OUTPUT: Tuple of message payload and frame flags
+            
+            @msg_type -> Message type of the message to be sent
+            @args -> The rest of the data to be sent in the message
+            @encrypt -> Boolean to indicate if to encrypt
+            @compress -> Boolean to indicate if to compress
+        """
+
+        constr_msg = MessageParser.protocol_message_construct(msg_type, *args)
+        flags = self.FRAME_FLAG_NONE
+        
+        if compress:
+            if self.__compression is None:
+                constr_msg = zlib.compress(constr_msg)
+            else:
+                constr_msg, compressed = self.__compression.compress(constr_msg)
+                if compressed:
+                    flags |= self.FRAME_FLAG_COMPRESSED
+        
+        if encrypt:
+            constr_msg = self.__encryption.encrypt(constr_msg, self.V2_FLAGS.pack(flags))
+
+        return constr_msg, flags
+
     def protocol_send(self, msg_type, *args, encrypt: bool = True, compress : bool = True) -> int:
         """
             Sends a message constructed by protocl
@@ -518,26 +1216,34 @@ class client (TCPsocket):
             @compress -> Boolean to indicate if to compress
         """
 
-        try:
-            constr_msg = MessageParser.protocol_message_construct(msg_type, *args)
-            
-            if compress:
-                constr_msg = zlib.compress(constr_msg)
+        return self.protocol_send_many([(msg_type, *args)], encrypt=encrypt, compress=compress)
+
+    def protocol_send_many(self, messages : list[tuple], encrypt: bool = True, compress : bool = True) -> int:
+        """
+            Sends several messages constructed by protocol in a single write
             
-            if encrypt:
-                constr_msg = self.__encryption.encrypt(constr_msg)
+            INPUT: messages, encrypt, compress
+            OUTPUT: Number 1/0 which representes if messages were sent successfully
             
-            self.send(constr_msg)
+            @messages -> List of tuples, each is message type followed by its arguments
+            @encrypt -> Boolean to indicate if to encrypt
+            @compress -> Boolean to indicate if to compress
+        """
+
+        try:
+            # Frames must go out in the order they were packed in
+            with self.__send_lock:
+                self.send_frames(self.pack_frames(messages, encrypt, compress))
             return 1
         
         except OSError as e:
-            if e.winerror == 10054:
+            if getattr(e, "winerror", None) == 10054:
                 ip = self.get_ip()
                 if ip:
                     print(f"\nConnection forcibly closed by {ip}")
                 else:
                     print("\nConnection forcibly closed")
-                return 0
+            return 0
 
         except Exception as e:
             print(e)
@@ -569,6 +1275,8 @@ class server (TCPsocket):
     SERVER_BIND_IP   = "0.0.0.0"
     SERVER_BIND_PORT = 6734
 
+    __slots__ = ()
+
     def __init__(self, server_listen : int = 5):
         """
             Create the server side socket